@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""Benchmark of the MR estimators.
+
+Compares the batched estimators (exphewas.mr) to the previous pandas
+implementation of the IVW estimator called once per gene, for batches of 1
+to 100k genes.
+
+"""
+
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from exphewas import mr
+
+
+def legacy_ivw(x_model, y_model):
+    """The previous implementation (for reference, without the summary
+    statistics loop).
+
+    """
+    def _prep_df(df, label):
+        df = df.loc[df["term"].str.startswith("XPC"), ["term", "beta", "se"]]
+        df = df.set_index("term")
+        df.columns = [f"{label}_beta", f"{label}_se"]
+        return df
+
+    df = pd.concat((_prep_df(x_model, "x"), _prep_df(y_model, "y")), axis=1)
+    df["pruned"] = (df["x_beta"] / df["x_se"]) ** 2 < 3.841459
+
+    analysis_df = df.loc[~df["pruned"], :]
+    precisions = analysis_df["y_se"] ** -2
+    ivw_denum = np.sum(analysis_df["x_beta"] ** 2 * precisions)
+    ivw = (
+        np.sum(analysis_df["x_beta"] * analysis_df["y_beta"] * precisions) /
+        ivw_denum
+    )
+
+    return ivw, np.sqrt(1 / ivw_denum)
+
+
+def simulate(n_genes, n_pcs, rng):
+    """Simulate PC effects (genes x PCs) with a causal effect of 0.5."""
+    x_beta = rng.normal(0, 0.3, size=(n_genes, n_pcs))
+    x_se = np.abs(rng.normal(0.05, 0.01, size=(n_genes, n_pcs))) + 0.01
+    y_beta = 0.5 * x_beta + rng.normal(0, 0.05, size=(n_genes, n_pcs))
+    y_se = np.abs(rng.normal(0.05, 0.01, size=(n_genes, n_pcs))) + 0.01
+
+    return x_beta, x_se, y_beta, y_se
+
+
+def to_model_fit(beta, se):
+    return pd.DataFrame({
+        "term": [f"XPC{i + 1}" for i in range(beta.shape[0])],
+        "beta": beta,
+        "se": se,
+    })
+
+
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    out = f(*args, **kwargs)
+    return time.perf_counter() - start, out
+
+
+def main():  # pylint: disable=missing-docstring
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    print("n_genes\tlegacy_ivw_s\tivw_s\tspeedup\tmax_abs_diff\tegger_s\t"
+          "weighted_median_s\tbootstrap_s")
+
+    for exponent in range(0, args.max_exponent + 1):
+        n_genes = 10 ** exponent
+        x_beta, x_se, y_beta, y_se = simulate(n_genes, args.n_pcs, rng)
+
+        ivw_time, ivw = timed(mr.ivw, x_beta, x_se, y_beta, y_se)
+        egger_time, _ = timed(mr.egger, x_beta, x_se, y_beta, y_se)
+        median_time, _ = timed(mr.weighted_median, x_beta, x_se, y_beta,
+                               y_se)
+
+        # The legacy implementation is extrapolated from a subset of genes.
+        n_legacy = min(n_genes, args.max_legacy_genes)
+        models = [
+            (to_model_fit(x_beta[i], x_se[i]), to_model_fit(y_beta[i],
+                                                            y_se[i]))
+            for i in range(n_legacy)
+        ]
+        legacy_time, legacy = timed(
+            lambda: [legacy_ivw(x, y) for x, y in models]
+        )
+        legacy_time *= n_genes / n_legacy
+
+        max_diff = np.max(np.abs(
+            np.array([beta for beta, _ in legacy]) - ivw["beta"][:n_legacy]
+        ))
+
+        if n_genes <= args.max_bootstrap_genes:
+            boot_time, _ = timed(mr.bootstrap, "weighted_median", x_beta,
+                                 x_se, y_beta, y_se, n_boot=args.n_boot,
+                                 seed=args.seed)
+            boot_time = f"{boot_time:.4f}"
+        else:
+            boot_time = "NA"
+
+        print(f"{n_genes}\t{legacy_time:.4f}\t{ivw_time:.4f}\t"
+              f"{legacy_time / ivw_time:.1f}x\t{max_diff:.2g}\t"
+              f"{egger_time:.4f}\t{median_time:.4f}\t{boot_time}")
+
+
+def parse_args():
+    """Parses the arguments."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the MR estimators.",
+    )
+
+    parser.add_argument(
+        "--max-exponent", default=5, type=int,
+        help="Largest number of genes as a power of 10 [%(default)s].",
+    )
+
+    parser.add_argument(
+        "--n-pcs", default=40, type=int,
+        help="Number of PCs per gene [%(default)s].",
+    )
+
+    parser.add_argument(
+        "--max-legacy-genes", default=1000, type=int,
+        help="Number of genes used to time the legacy implementation (the "
+             "time is extrapolated for larger batches) [%(default)s].",
+    )
+
+    parser.add_argument(
+        "--n-boot", default=100, type=int,
+        help="Number of bootstrap replicates [%(default)s].",
+    )
+
+    parser.add_argument(
+        "--max-bootstrap-genes", default=10000, type=int,
+        help="Largest batch for the bootstrap benchmark [%(default)s].",
+    )
+
+    parser.add_argument(
+        "--seed", default=42, type=int,
+        help="Random seed [%(default)s].",
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""Benchmark of the q-value implementation.
+
+Compares the vectorized q-value computation (and its batched variant) to the
+previous implementation (loop over the lambdas and over the p-values).
+
+"""
+
+
+import argparse
+import time
+
+import numpy as np
+from scipy.interpolate import UnivariateSpline
+
+from exphewas.utils import qvalue, qvalue_batch
+
+
+def legacy_qvalue(ps):
+    """The previous implementation (for reference)."""
+    def _pi_0(ps, l=0.5):
+        return np.sum(ps > l) / (ps.shape[0] * (1 - l))
+
+    idx = np.argsort(ps)
+    ps = ps[idx]
+    m = ps.shape[0]
+
+    l = np.arange(0.01, 0.96, 0.01)
+    pi0s = np.empty(l.shape[0])
+
+    for i, cur_l in enumerate(l):
+        pi0s[i] = _pi_0(ps, cur_l)
+
+    spline = UnivariateSpline(x=l, y=pi0s, k=3)
+    pi0 = spline(1)
+
+    qs = np.empty(m, dtype=float)
+    qs[-1] = pi0 * ps[-1]
+
+    for i in reversed(range(m - 1)):
+        qs[i] = np.minimum(
+            pi0 * m * ps[i] / (i + 1),
+            qs[i + 1]
+        )
+
+    return qs[np.argsort(idx)]
+
+
+def simulate_ps(m, rng, prop_alt=0.1):
+    """Simulate p-values with a proportion of alternative hypotheses."""
+    ps = rng.uniform(size=m)
+    n_alt = int(m * prop_alt)
+    ps[:n_alt] = ps[:n_alt] ** 4
+    return ps
+
+
+def timed(f, *args, repeat=3):
+    """Best wall clock time (in seconds) over a few repeats."""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = f(*args)
+        best = min(best, time.perf_counter() - start)
+
+    return best, out
+
+
+def main():  # pylint: disable=missing-docstring
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    print("m\tlegacy_s\tvectorized_s\tspeedup\tmax_abs_diff")
+    for exponent in range(3, args.max_exponent + 1):
+        m = 10 ** exponent
+        ps = simulate_ps(m, rng)
+
+        legacy_time, legacy_qs = timed(legacy_qvalue, ps,
+                                       repeat=1 if m >= 10 ** 5 else 3)
+        new_time, new_qs = timed(qvalue, ps)
+
+        print(f"{m}\t{legacy_time:.4f}\t{new_time:.4f}\t"
+              f"{legacy_time / new_time:.1f}x\t"
+              f"{np.max(np.abs(legacy_qs - new_qs)):.2g}")
+
+    # Batched computation (e.g. all the outcomes of an analysis type).
+    print()
+    print("n_vectors\tm\tlooped_s\tbatched_s\tspeedup")
+    ps = np.vstack([simulate_ps(args.batch_m, rng)
+                    for _ in range(args.batch_size)])
+
+    looped_time, _ = timed(lambda x: [qvalue(row) for row in x], ps)
+    batched_time, _ = timed(qvalue_batch, ps)
+
+    print(f"{args.batch_size}\t{args.batch_m}\t{looped_time:.4f}\t"
+          f"{batched_time:.4f}\t{looped_time / batched_time:.1f}x")
+
+
+def parse_args():
+    """Parses the arguments."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the q-value computation.",
+    )
+
+    parser.add_argument(
+        "--max-exponent", default=6, type=int,
+        help="Largest number of p-values as a power of 10 [%(default)s].",
+    )
+
+    parser.add_argument(
+        "--batch-size", default=200, type=int,
+        help="Number of vectors for the batched benchmark [%(default)s].",
+    )
+
+    parser.add_argument(
+        "--batch-m", default=20000, type=int,
+        help="Number of p-values per vector for the batched benchmark "
+             "[%(default)s].",
+    )
+
+    parser.add_argument(
+        "--seed", default=42, type=int,
+        help="Random seed [%(default)s].",
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
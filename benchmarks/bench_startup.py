@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""Benchmark of the cold start (imports) of the web application and of the
+CLI commands.
+
+Every target is imported in a fresh interpreter with '-X importtime'. The
+wall time of the interpreter and the total import time of the target are
+reported (the median of the repeats), with the packages taking the most time
+to import (their modules' own import times).
+
+The web application needs the usual configuration (e.g.
+EXPHEWAS_DATABASE_URL and EXPHEWAS_STATIC_FOLDER), but the database is not
+queried at import.
+
+"""
+
+
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+
+# CLI command -> module imported (lazily) by the command.
+CLI_COMMANDS = {
+    "metadata": "metadata",
+    "import-ensembl": "import_ensembl",
+    "import-results": "import_results",
+    "import-external": "import_external",
+    "compute-statistics": "statistics",
+    "update-has-results": "has_results",
+    "convert-model-fits": "convert_model_fits",
+    "cis-mr-scan": "cis_mr_scan",
+}
+
+
+IMPORTTIME_PAT = re.compile(
+    r"^import time:\s+(?P<self>\d+) \|\s+(?P<cumulative>\d+) \|"
+    r"(?P<indent>\s*)(?P<module>\S+)$"
+)
+
+
+def targets():
+    """The code importing each target."""
+    out = {"web": "import exphewas.backend"}
+
+    cli = "from exphewas.db.scripts import cli"
+    out["cli"] = cli
+
+    for command, module in CLI_COMMANDS.items():
+        out[f"cli {command}"] = (
+            f"{cli}; from exphewas.db.scripts import {module}"
+        )
+
+    return out
+
+
+def run(code):
+    """Run the code with -X importtime.
+
+    Returns the wall time, the total import time and the import times by
+    package (in seconds).
+
+    """
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-W", "ignore", "-c", code],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        check=True,
+    )
+    wall = time.perf_counter() - start
+
+    total = 0
+    packages = {}
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_PAT.match(line)
+        if match is None:
+            continue
+
+        # Top level imports have a single space of indentation.
+        if len(match.group("indent")) == 1:
+            total += int(match.group("cumulative")) / 1e6
+
+        package = match.group("module").split(".")[0]
+        packages[package] = (
+            packages.get(package, 0) + int(match.group("self")) / 1e6
+        )
+
+    return wall, total, packages
+
+
+def main():  # pylint: disable=missing-docstring
+    args = parse_args()
+
+    print("target\twall_s\timport_s\tslowest_packages")
+
+    for name, code in targets().items():
+        if args.targets and name not in args.targets:
+            continue
+
+        runs = [run(code) for _ in range(args.repeats)]
+
+        wall = statistics.median(wall for wall, _, _ in runs)
+        total = statistics.median(total for _, total, _ in runs)
+
+        _, _, packages = runs[-1]
+        slowest = sorted(packages.items(), key=lambda i: -i[1])[:args.top]
+
+        print(f"{name}\t{wall:.3f}\t{total:.3f}\t" + ", ".join(
+            f"{package} ({seconds:.3f})" for package, seconds in slowest
+        ))
+
+
+def parse_args():
+    """Parses the arguments."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the startup (import) time.",
+    )
+
+    parser.add_argument(
+        "targets", nargs="*",
+        help="Targets to benchmark (e.g. 'web' or 'cli metadata'), all by "
+             "default.",
+    )
+
+    parser.add_argument(
+        "--repeats", default=5, type=int,
+        help="Number of runs per target [%(default)s].",
+    )
+
+    parser.add_argument(
+        "--top", default=5, type=int,
+        help="Number of packages reported [%(default)s].",
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,8 +10,8 @@ from flask_cors import CORS
 from .. import __version__
 
 from .config import URL_ROOT, STATIC_FOLDER
+from . import compression
 from .api import api as api_blueprint
-from .cache import create_or_load_startup_caches
 from .backend import backend as backend_blueprint
 from .backend import inject_db_metadata
 from .dt_api import dt_api as dt_api_blueprint
@@ -19,10 +19,8 @@ from .dt_api import dt_api as dt_api_blueprint
 from ..db.engine import Session
 
 
-# Build the cache if needed.
-create_or_load_startup_caches()
-
-
+# The startup caches (e.g. outcomes) and the GTEx data are loaded on first
+# use, so that workers are ready as soon as the modules are imported.
 app = Flask(
     __name__,
     static_url_path=URL_ROOT.rstrip("/") + "/dist",
@@ -34,6 +32,9 @@ app.config["EXPHEWAS_VERSION"] = __version__
 
 CORS(app)
 
+# Compression of the responses (when accepted by the clients).
+compression.init_app(app)
+
 
 # Adding the blueprints
 app.register_blueprint(api_blueprint, url_prefix=URL_ROOT.rstrip("/") + "/api")
@@ -3,41 +3,159 @@ Flask-based REST API for the results of the ExPheWAS analysis.
 """
 
 import functools
+import hashlib
 
 import numpy as np
 
 from sqlalchemy.exc import NoResultFound, MultipleResultsFound
 
-from flask import Blueprint, jsonify, request
+from flask import (
+    Blueprint, Response, jsonify, make_response, request, stream_with_context,
+)
 
-from .cache import Cache
-from ..db import models
+from .. import __version__
+from .cache import get_cache, get_data_version
+from .cache_backends import get_cache_backend
+from .compression import COMPRESSED_CACHE, COMPRESSION_METRICS
+from .config import API_MAX_AGE, MATRIX_MAX_GENES, RESPONSE_CACHE_FRESH
+from .encoding import (
+    ColumnarResults, FORMATS, encode_arrays_npz, encode_json_array,
+    iter_json_array, negotiate_format,
+)
+from .gtex import get_gtex_matrix
+from .response_cache import RESPONSE_CACHE
+from .single_flight import SINGLE_FLIGHT
+from .store import RESULT_STORE
+from ..db import cis_mr, models
 from ..db.models import get_results_class
-from ..db.tree import tree_from_hierarchy_id
 from ..db.engine import Session
 from ..db.utils import mod_to_dict, ANALYSIS_TYPES
-from ..utils import (
-    load_gtex_median_tpm, load_gtex_statistics, qvalue, one_sample_ivw_mr,
-)
+from ..lazy import LazyModule
+from ..utils import qvalue, one_sample_ivw_mr, clamp_nlog10p
 
 
 api = Blueprint("api_blueprint", __name__)
 
+scipy = LazyModule("scipy")
+
 
-# Loading GTEx data
-GTEX_MEDIAN_TPM = load_gtex_median_tpm()
-GTEX_STATS = load_gtex_statistics()
+# Largest number of outcomes for the UpSet endpoint (2^n intersections).
+UPSET_MAX_OUTCOMES = 16
+
+# Largest page for the paginated gene list.
+GENE_PAGE_MAX_SIZE = 1000
 
 
 class make_api(object):
-    def __init__(self, rule, handler=None):
+    """Registers an API function on the blueprint.
+
+    Functions returning lists can be made streamable. Their rows are then
+    encoded and sent as a chunked response when the request has the
+    'stream=true' parameter.
+
+    Functions returning ColumnarResults can also be encoded in the compact
+    formats (see encoding.negotiate_format).
+
+    The responses have a strong ETag derived from the data version and the
+    request (with a suffix for compressed responses), so conditional requests
+    (If-None-Match) are answered with a 304 without calling the function.
+
+    The serialized responses of GET requests can be memoized (see
+    response_cache) with the cache option: True to keep them for the whole
+    data version, or the number of seconds they are fresh.
+
+    With the coalesce option, concurrent identical GET requests (not
+    streamed) call the function once and share its response (see
+    single_flight).
+
+    """
+    def __init__(self, rule, handler=None, streamable=False, etag=True,
+                 methods=None, cache=False, coalesce=False):
         self.rule = rule
         self.handler = handler
+        self.streamable = streamable
+        self.etag = etag
+        self.methods = methods
+        self.cache = cache
+        self.coalesce = coalesce
 
     @staticmethod
-    def _default_api_call_handler(f, *args, **kwargs):
+    def _compute_etag():
+        """ETag for the current request (None if the data isn't versioned)."""
+        version = get_data_version()
+        if version is None:
+            return None
+
+        args = sorted(request.args.items(multi=True))
+        key = "\n".join([
+            str(__version__), version, request.path, repr(args),
+            request.headers.get("Accept", ""),
+        ])
+
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _view(self, *args, handler, f, **kwargs):
+        etag = None
+        if self.etag and request.method in ("GET", "HEAD"):
+            etag = self._compute_etag()
+
+        # Compressed representations have their own ETag (with the encoding
+        # as a suffix).
+        if etag is not None and request.if_none_match.contains(etag):
+            response = Response(status=304)
+
+        elif (etag is not None and
+              request.if_none_match.contains(f"{etag}-gzip")):
+            response = Response(status=304)
+            etag = f"{etag}-gzip"
+
+        else:
+            def compute():
+                return make_response(handler(*args, f=f, **kwargs))
+
+            get = request.method in ("GET", "HEAD")
+            coalesce = self.coalesce and get and not (
+                self.streamable and request.args.get("stream") == "true"
+            )
+
+            if self.cache is not False and get:
+                fresh = None if self.cache is True else self.cache
+                response = RESPONSE_CACHE.respond(request.endpoint, fresh,
+                                                  compute, coalesce=coalesce)
+            elif coalesce:
+                response = RESPONSE_CACHE.coalesced(request.endpoint, compute)
+            else:
+                response = compute()
+
+            if response.status_code != 200:
+                return response
+
+            if etag is not None and response.content_encoding:
+                etag = f"{etag}-{response.content_encoding}"
+
+        if etag is not None:
+            response.set_etag(etag)
+            response.vary.add("Accept")
+
+            if API_MAX_AGE > 0:
+                response.cache_control.public = True
+                response.cache_control.max_age = API_MAX_AGE
+            else:
+                response.cache_control.no_cache = True
+
+        return response
+
+    def _default_api_call_handler(self, f, *args, **kwargs):
         try:
             results = f(*args, **kwargs)
+
+            # Results held as columns can be encoded in compact formats.
+            if isinstance(results, ColumnarResults):
+                fmt = negotiate_format(request)
+                if fmt != "json":
+                    mimetype, encode = FORMATS[fmt]
+                    return Response(encode(results), mimetype=mimetype)
+
         except RessourceNotFoundError as exception:
             return resource_not_found(exception.message)
         except AmbiguousIdentifierError as exception:
@@ -45,6 +163,22 @@ class make_api(object):
         except ValueError as exception:
             return bad_request(str(exception))
 
+        # The function already built the response (e.g. binary formats).
+        if isinstance(results, Response):
+            return results
+
+        if self.streamable:
+            if request.args.get("stream") == "true":
+                return Response(
+                    stream_with_context(iter_json_array(results)),
+                    mimetype="application/json",
+                )
+
+            # Streamable functions can return iterators. The rows are
+            # encoded like the streamed ones.
+            return Response(encode_json_array(results),
+                            mimetype="application/json")
+
         return jsonify(results)
 
     def __call__(self, f):
@@ -56,7 +190,8 @@ class make_api(object):
         api.add_url_rule(
             self.rule,
             f.__name__,
-            functools.partial(handler, f=f)
+            functools.partial(self._view, handler=handler, f=f),
+            methods=self.methods,
         )
 
         return f
@@ -120,9 +255,36 @@ def get_metadata():
         }
 
 
+@make_api("/metrics/compression", etag=False)
+def get_compression_metrics():
+    """Metrics of the compression of the responses (for this worker)."""
+    metrics = COMPRESSION_METRICS.to_dict()
+    metrics["cache_nbytes"] = COMPRESSED_CACHE.nbytes
+
+    return metrics
+
+
+@make_api("/metrics/cache", etag=False)
+def get_cache_metrics():
+    """Metrics of the cache backend (for this worker)."""
+    return get_cache_backend().info()
+
+
+@make_api("/metrics/responses", etag=False)
+def get_response_cache_metrics():
+    """Metrics of the response cache by endpoint (for this worker)."""
+    return RESPONSE_CACHE.metrics.to_dict()
+
+
+@make_api("/metrics/coalescing", etag=False)
+def get_coalescing_metrics():
+    """Metrics of the coalescing of concurrent requests (for this worker)."""
+    return SINGLE_FLIGHT.metrics()
+
+
 @make_api("/outcome")
 def get_outcomes():
-    return Cache().get("outcomes")
+    return get_cache().get("outcomes")
 
 
 @make_api("/outcome/<id>")
@@ -168,7 +330,8 @@ def get_outcome(id):
     return out
 
 
-@make_api("/outcome/<id>/results")
+@make_api("/outcome/<id>/results", streamable=True,
+          cache=RESPONSE_CACHE_FRESH, coalesce=True)
 def get_outcome_results(id):
     session = Session()
     outcome = _get_outcome(session, id)
@@ -177,49 +340,93 @@ def get_outcome_results(id):
     if analysis_subset not in models.ANALYSIS_SUBSETS:
         raise ValueError(f"{analysis_subset}: not a valid analysis subset")
 
-    results = outcome.query_results(analysis_subset).all()
+    # The results are served from the in-memory columnar store (no ORM
+    # objects are created).
+    results = RESULT_STORE.outcome_results(outcome.iid, outcome.analysis_type,
+                                           analysis_subset)
 
     if len(results) == 0:
         raise NoResultFound(f"Could not find results for outcome '{id}'.")
 
-    # Get the corresponding Q-values.
-    nlog10ps = np.fromiter(
-        (r.static_nlog10p for r in results),
-        dtype=np.float, count=len(results)
-    )
+    nlog10ps, ps = clamp_nlog10p(results.nlog10p.copy())
 
-    # We clamp everything at 10^-500
-    nlog10ps[~np.isfinite(nlog10ps) | (nlog10ps >= 500)] = 500
-
-    ps = 10 ** -nlog10ps
-    qs = qvalue(ps)
+    if results.has_statistics():
+        qs = results.q
+        bonfs = results.bonf
 
-    return [
-        {
-            "gene": o.gene_obj.ensembl_id,
-            "region": {
-                "chrom": o.gene_obj.chrom,
-                "start": o.gene_obj.start,
-                "end": o.gene_obj.end,
-            },
+    else:
+        # The statistics were not computed after the import.
+        qs = qvalue(ps)
+        bonfs = ps * len(results)
+
+    genes = RESULT_STORE.genes().take(results.gene_iid)
+
+    return ColumnarResults(
+        columns={
+            "gene": genes["ensembl_id"],
+            "chrom": genes["chrom"],
+            "start": genes["start"],
+            "end": genes["end"],
+            "nlog10p": nlog10ps,
+            "p": ps,
+            "bonf": bonfs,
+            "q": qs,
+            "gene_name": genes["name"],
+            "n_components": genes["n_pcs"],
+        },
+        constants={
             "analysis_type": outcome.analysis_type,
             "outcome_id": outcome.id,
             "outcome_label": outcome.label,
-            "nlog10p": nlog10p,
-            "p": p,
-            "bonf": p * len(results),
-            "q": q,
-            "gene_name": o.gene_obj.name,
-            "n_components": o.gene_obj.n_pcs
-        }
-        for nlog10p, q, p, o in zip(nlog10ps, qs, ps, results)
-    ]
+        },
+        nested={
+            "region": {"chrom": "chrom", "start": "start", "end": "end"},
+        },
+    )
 
 
-@make_api("/gene")
+@make_api("/gene", streamable=True)
 def get_genes():
-    genes = Session.query(models.Gene).all()
-    return [mod_to_dict(gene) for gene in genes]
+    """Get the genes (from the gene table of the store).
+
+    The genes can be paginated by iid (keyset) with the 'after' (last iid of
+    the previous page) and 'limit' parameters, and the fields can be selected
+    with the 'fields' parameter (separated by ';'). The iid is always
+    included in the pages.
+
+    """
+    genes = RESULT_STORE.genes()
+
+    fields = list(genes.FIELDS)
+    if "fields" in request.args:
+        fields = [i for i in request.args["fields"].split(";") if i]
+
+        unknown = set(fields) - set(genes.columns.keys())
+        if unknown:
+            raise ValueError(f"{', '.join(sorted(unknown))}: unknown fields")
+
+    if "after" not in request.args and "limit" not in request.args:
+        rows = slice(None)
+
+    else:
+        after = request.args.get("after")
+        if after is not None:
+            after = int(after)
+
+        limit = min(int(request.args.get("limit", GENE_PAGE_MAX_SIZE)),
+                    GENE_PAGE_MAX_SIZE)
+
+        if limit < 1:
+            raise ValueError("The limit needs to be positive.")
+
+        rows = genes.page(after, limit)
+
+        if "iid" not in fields:
+            fields.insert(0, "iid")
+
+    return ColumnarResults(
+        columns={name: genes.columns[name][rows] for name in fields}
+    )
 
 
 @make_api("/gene/name/<name>")
@@ -250,59 +457,237 @@ def get_gene_by_ensembl_id(ensg):
     return results
 
 
-@make_api("/gene/<ensg>/results")
+@make_api("/gene/<ensg>/results", streamable=True,
+          cache=RESPONSE_CACHE_FRESH, coalesce=True)
 def get_gene_results(ensg):
-    session = Session()
-    try:
-        gene = session.query(models.Gene).filter_by(ensembl_id=ensg).one()
-    except NoResultFound:
+    gene_iid = RESULT_STORE.genes().find_iid(ensg)
+    if gene_iid is None:
         raise RessourceNotFoundError(
             f"Could not find gene (by Ensembl ID) '{ensg}'."
         )
 
+    # The results of the three subsets can be requested at once.
     analysis_subset = request.args.get("analysis_subset", "BOTH")
 
-    if analysis_subset not in models.ANALYSIS_SUBSETS:
+    if analysis_subset == "ALL":
+        analysis_subsets = models.ANALYSIS_SUBSETS
+
+    elif analysis_subset in models.ANALYSIS_SUBSETS:
+        analysis_subsets = [analysis_subset]
+
+    else:
         raise ValueError(f"{analysis_subset}: not a valid analysis subset")
 
     analysis_type = request.args.get("analysis_type", None)
 
-    results = []
-    nlog10ps = []
-
     if analysis_type is None:
         analysis_types = ANALYSIS_TYPES
 
-    else:
+    elif analysis_type in ANALYSIS_TYPES:
         analysis_types = [analysis_type]
 
-    for analysis_type in analysis_types:
-        result_class = get_results_class(analysis_type, analysis_subset)
-        q = session.query(result_class).filter_by(gene_iid=gene.iid)
-        for res in q:
-            results.append(res.to_object())
-            nlog10ps.append(res.static_nlog10p)
+    else:
+        raise ValueError(f"{analysis_type}: not a valid analysis type")
+
+    # All the results (plain tuples) are fetched in a single query.
+    type_columns = (models.ContinuousResult.TYPE_COLUMNS +
+                    models.BinaryResult.TYPE_COLUMNS)
+
+    cols = ["static_nlog10p", "static_gene_q", "static_gene_bonf"]
+    cols += type_columns
+
+    results = models.query_gene_results(
+        Session(), gene_iid, cols, analysis_types, analysis_subsets,
+    ).all()
 
     if len(results) == 0:
         raise RessourceNotFoundError(f"No results for gene '{ensg}'.")
 
+    values = dict(zip(
+        cols + ["analysis_type", "analysis_subset", "outcome_id",
+                "outcome_label"],
+        zip(*results)
+    ))
+
     # Get the corresponding Q-values.
-    nlog10ps = np.array(nlog10ps)
+    nlog10ps = np.array(values["static_nlog10p"], dtype=float)
     ps = 10 ** -nlog10ps
 
     # We clamp everything at 10^-500
     nlog10ps[~np.isfinite(nlog10ps) | (nlog10ps >= 500)] = 500
 
-    bonf_ps = ps * ps.shape[0]
-    qs = qvalue(ps)
+    # The statistics are computed for each subset. The ones computed at
+    # import are over all the analysis types.
+    gene_qs = np.array(values["static_gene_q"], dtype=float)
+    gene_bonfs = np.array(values["static_gene_bonf"], dtype=float)
 
-    for i in range(len(results)):
-        results[i]["nlog10p"] = nlog10ps[i]
-        results[i]["p"] = ps[i]
-        results[i]["bonf"] = bonf_ps[i]
-        results[i]["q"] = qs[i]
+    subsets = np.array(values["analysis_subset"])
+    qs = np.empty_like(ps)
+    bonf_ps = np.empty_like(ps)
 
-    return results
+    for subset in analysis_subsets:
+        mask = subsets == subset
+        if not mask.any():
+            continue
+
+        if (len(analysis_types) == len(ANALYSIS_TYPES) and
+                np.all(np.isfinite(gene_qs[mask])) and
+                np.all(np.isfinite(gene_bonfs[mask]))):
+            qs[mask] = gene_qs[mask]
+            bonf_ps[mask] = gene_bonfs[mask]
+
+        else:
+            qs[mask] = qvalue(ps[mask])
+            bonf_ps[mask] = ps[mask] * mask.sum()
+
+    columns = {
+        "nlog10p": nlog10ps,
+        "outcome_id": values["outcome_id"],
+        "outcome_label": values["outcome_label"],
+        "analysis_type": values["analysis_type"],
+        "p": ps,
+        "bonf": bonf_ps,
+        "q": qs,
+    }
+
+    constants = {"gene": ensg}
+    if len(analysis_subsets) == 1:
+        constants["analysis_subset"] = analysis_subsets[0]
+    else:
+        columns["analysis_subset"] = values["analysis_subset"]
+
+    # The columns specific to continuous or binary results.
+    is_continuous = np.array(values["analysis_type"]) == "CONTINUOUS_VARIABLE"
+
+    present = {}
+    for col in type_columns:
+        columns[col] = values[col]
+
+        if col in models.ContinuousResult.TYPE_COLUMNS:
+            present[col] = is_continuous
+        else:
+            present[col] = ~is_continuous
+
+    return ColumnarResults(columns, constants, present=present)
+
+
+@make_api("/gene/matrix", methods=["POST"])
+def get_gene_matrix():
+    """Gene x outcome matrix of -log10(p) (and q-values) for a gene list.
+
+    The JSON body has the list of Ensembl IDs ('ensembl_ids') and optionally
+    the 'analysis_subset', the 'analysis_types' and 'include_q'. The q-values
+    are the ones computed over all the genes of the outcomes at import (they
+    are null if the statistics were not computed).
+
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or "ensembl_ids" not in body:
+        raise ValueError("Expected a JSON body with a list of 'ensembl_ids'.")
+
+    ensembl_ids = body["ensembl_ids"]
+    if (not isinstance(ensembl_ids, list) or
+            not all(isinstance(i, str) for i in ensembl_ids)):
+        raise ValueError("'ensembl_ids' should be a list of strings.")
+
+    ensembl_ids = list(dict.fromkeys(ensembl_ids))
+    if len(ensembl_ids) > MATRIX_MAX_GENES:
+        raise ValueError(f"Too many genes (the maximum is "
+                         f"{MATRIX_MAX_GENES}).")
+
+    analysis_subset = body.get("analysis_subset", "BOTH")
+    if analysis_subset not in models.ANALYSIS_SUBSETS:
+        raise ValueError(f"{analysis_subset}: not a valid analysis subset")
+
+    analysis_types = body.get("analysis_types", ANALYSIS_TYPES)
+    if not isinstance(analysis_types, list) or not analysis_types:
+        raise ValueError("'analysis_types' should be a non-empty list.")
+
+    for analysis_type in analysis_types:
+        if analysis_type not in ANALYSIS_TYPES:
+            raise ValueError(f"{analysis_type}: not a valid analysis type")
+
+    include_q = bool(body.get("include_q", False))
+
+    fmt = negotiate_format(request)
+    if fmt not in ("json", "columnar", "npy"):
+        raise ValueError(f"{fmt}: format not available for this endpoint")
+
+    # Finding the genes.
+    gene_table = RESULT_STORE.genes()
+    gene_iids = {}
+    not_found = []
+    for ensembl_id in ensembl_ids:
+        gene_iid = gene_table.find_iid(ensembl_id)
+        if gene_iid is None:
+            not_found.append(ensembl_id)
+        else:
+            gene_iids[gene_iid] = len(gene_iids)
+
+    # Set-based retrieval of the results (in chunks of genes).
+    session = Session()
+    cols = ["outcome_iid", "gene_iid", "static_nlog10p", "static_q"]
+    rows = []
+    chunk_size = 1000
+    all_gene_iids = list(gene_iids)
+    for i in range(0, len(all_gene_iids), chunk_size):
+        union = models.all_results_union(
+            session, cols, analysis_types=analysis_types,
+            analysis_subsets=[analysis_subset], distinct=False,
+            gene_iids=all_gene_iids[i:i + chunk_size],
+        )
+        rows.extend(session.execute(union))
+
+    outcome_iids = np.array([row[0] for row in rows], dtype=np.int64)
+    outcome_iids, outcome_idx = np.unique(outcome_iids, return_inverse=True)
+    gene_idx = np.array([gene_iids[row[1]] for row in rows], dtype=np.int64)
+
+    # The outcomes (columns of the matrix).
+    outcomes = {}
+    for i in range(0, outcome_iids.shape[0], chunk_size):
+        chunk = outcome_iids[i:i + chunk_size].tolist()
+        outcomes.update(
+            (o.iid, o) for o in
+            session.query(models.Outcome).filter(models.Outcome.iid.in_(chunk))
+        )
+    outcomes = [outcomes[iid] for iid in outcome_iids.tolist()]
+
+    shape = (len(gene_iids), len(outcomes))
+    nlog10ps = np.full(shape, np.nan)
+    nlog10ps[gene_idx, outcome_idx] = [
+        np.nan if row[2] is None else row[2] for row in rows
+    ]
+
+    # We clamp everything at 10^-500 (missing results are kept as NaN).
+    nlog10ps[np.isinf(nlog10ps) | (nlog10ps >= 500)] = 500
+
+    out = {
+        "genes": gene_table.take(list(gene_iids))["ensembl_id"],
+        "not_found": not_found,
+        "outcome_id": [o.id for o in outcomes],
+        "outcome_analysis_type": [o.analysis_type for o in outcomes],
+        "outcome_label": [o.label for o in outcomes],
+        "analysis_subset": analysis_subset,
+        "nlog10p": nlog10ps,
+    }
+
+    if include_q:
+        qs = np.full(shape, np.nan)
+        qs[gene_idx, outcome_idx] = [
+            np.nan if row[3] is None else row[3] for row in rows
+        ]
+        out["q"] = qs
+
+    if fmt == "npy":
+        return Response(encode_arrays_npz(out), mimetype=FORMATS["npy"][0])
+
+    for key in ("nlog10p", "q"):
+        if key in out:
+            values = out[key].astype(object)
+            values[np.isnan(out[key])] = None
+            out[key] = values.tolist()
+
+    return out
 
 
 @make_api("/gene/<ensg>/xrefs")
@@ -326,62 +711,152 @@ def get_gene_xrefs(ensg):
 
 @make_api("/gene/<ensg>/gtex")
 def get_gene_gtex(ensg):
-    if ensg not in GTEX_MEDIAN_TPM.index:
-        return []
+    return get_gtex_matrix().gene_expression(ensg)
 
-    gtex_data = [
-        {"tissue": tissue, "value": value, "nb_samples": GTEX_STATS[tissue]}
-        for tissue, value in GTEX_MEDIAN_TPM.loc[ensg, :].iteritems()
-    ]
-    return gtex_data
+
+def _outcome_gene_sets(session, outcome_ids):
+    """Get the tested and significant genes for outcomes as boolean matrices
+    (outcomes x gene iids).
+
+    """
+    analysis_subset = request.args.get("analysis_subset", "BOTH")
+    if analysis_subset not in models.ANALYSIS_SUBSETS:
+        raise ValueError(f"{analysis_subset}: not a valid analysis subset")
+
+    q_threshold = float(request.args.get("q", 0.05))
+
+    gene_sets = []
+    for outcome_id in outcome_ids:
+        outcome = _get_outcome(session, outcome_id)
+        gene_sets.append(RESULT_STORE.gene_sets(
+            outcome.iid, outcome.analysis_type, analysis_subset, q_threshold
+        ))
+
+    tested = np.vstack([cur.tested for cur in gene_sets])
+    significant = np.vstack([cur.significant for cur in gene_sets])
+
+    return tested, significant
 
 
 @make_api("/outcome/venn")
 def get_outcome_venn():
-    # Getting the genes
+    # Getting the outcomes
     outcomes = request.args.get("outcomes", "").split(";")
+    if len(outcomes) != 2:
+        raise ValueError("Two outcomes are required (use /outcome/upset for "
+                         "more).")
 
-    # Getting the p value threshold
-    q_threshold = float(request.args.get("q", 0.05))
-
-    # Getting the genes for each of the outcomes
-    outcome_genes = []
-    for outcome in outcomes:
-        genes = {
-            data["gene"] for data in get_outcome_results(outcome)
-            if data["q"] < q_threshold
-        }
-        outcome_genes.append(genes)
+    _, significant = _outcome_gene_sets(Session(), outcomes)
+    first, second = significant
 
     return [
         {
             "sets": [outcomes[0]],
-            "size": len(outcome_genes[0] - outcome_genes[1]),
+            "size": int(np.count_nonzero(first & ~second)),
         },
         {
             "sets": [outcomes[1]],
-            "size": len(outcome_genes[1] - outcome_genes[0])
+            "size": int(np.count_nonzero(second & ~first)),
         },
         {
             "sets": [outcomes],
-            "size": len(outcome_genes[1] & outcome_genes[0]),
+            "size": int(np.count_nonzero(first & second)),
         },
     ]
 
 
-@make_api("/tree/<id>")
+@make_api("/outcome/upset")
+def get_outcome_upset():
+    """Intersections of the sets of significant genes for N outcomes.
+
+    Every intersection is exclusive (genes significant for exactly these
+    outcomes). For each pair of outcomes, the overlap is tested with a
+    hypergeometric test among the genes tested for both outcomes.
+
+    """
+    outcomes = [i for i in request.args.get("outcomes", "").split(";") if i]
+    if not 2 <= len(outcomes) <= UPSET_MAX_OUTCOMES:
+        raise ValueError(f"Between 2 and {UPSET_MAX_OUTCOMES} outcomes are "
+                         "required.")
+
+    tested, significant = _outcome_gene_sets(Session(), outcomes)
+
+    # Every gene gets a code with bit k set if it is significant for the
+    # outcome k.
+    n_outcomes = len(outcomes)
+    codes = np.zeros(significant.shape[1], dtype=np.int64)
+    for k in range(n_outcomes):
+        codes |= significant[k].astype(np.int64) << k
+
+    counts = np.bincount(codes, minlength=2 ** n_outcomes)
+    counts[0] = 0
+
+    nonzero = np.flatnonzero(counts)
+    nonzero = nonzero[np.argsort(-counts[nonzero], kind="stable")]
+
+    intersections = [
+        {
+            "sets": [outcomes[k] for k in range(n_outcomes) if code >> k & 1],
+            "size": int(counts[code]),
+        }
+        for code in nonzero.tolist()
+    ]
+
+    # Pairwise counts among the genes tested for both outcomes.
+    tested = tested.astype(np.int64)
+    significant = (significant & tested.astype(bool)).astype(np.int64)
+
+    n_universe = tested @ tested.T
+    n_significant = significant @ tested.T
+    n_overlap = significant @ significant.T
+
+    i, j = np.triu_indices(n_outcomes, k=1)
+    ps = scipy.stats.hypergeom.sf(
+        n_overlap[i, j] - 1, n_universe[i, j], n_significant[i, j],
+        n_significant[j, i],
+    )
+
+    pairs = [
+        {
+            "sets": [outcomes[a], outcomes[b]],
+            "n_tested": int(n_universe[a, b]),
+            "overlap": int(n_overlap[a, b]),
+            "p": float(p),
+        }
+        for a, b, p in zip(i.tolist(), j.tolist(), ps.tolist())
+    ]
+
+    return {
+        "outcomes": [
+            {"id": outcome, "n_tested": int(n_universe[k, k]),
+             "n_significant": int(n_overlap[k, k])}
+            for k, outcome in enumerate(outcomes)
+        ],
+        "intersections": intersections,
+        "pairs": pairs,
+    }
+
+
+@make_api("/tree/<id>", cache=RESPONSE_CACHE_FRESH)
 def get_tree(id):
-    root = tree_from_hierarchy_id(id)
-    if len(root.children) == 0:
+    # The hierarchies are serialized and compressed once per data version.
+    document = RESULT_STORE.hierarchy_document(id)
+    if document is None:
         raise RessourceNotFoundError(f"{id}: not a valid hierarchy")
 
-    tree = root.to_primitive()
-    tree["code"] = id
+    if request.accept_encodings["gzip"]:
+        response = Response(document.data, mimetype="application/json")
+        response.content_encoding = "gzip"
+    else:
+        response = Response(document.decompress(),
+                            mimetype="application/json")
+
+    response.vary.add("Accept-Encoding")
 
-    return tree
+    return response
 
 
-@make_api("/cisMR")
+@make_api("/cisMR", coalesce=True)
 def cis_mendelian_randomization():
     """Performs cis-MR using the IVW estimator and the PCs as IVs."""
     gene = request.args["ensembl_id"]
@@ -448,7 +923,109 @@ def cis_mendelian_randomization():
     return mr_results
 
 
-@make_api("/enrichment/atc/contingency/<outcome_id>")
+@make_api("/cisMR/genome", streamable=True, coalesce=True)
+def genome_wide_cis_mendelian_randomization():
+    """Performs cis-MR for every gene with results for the exposure and the
+    outcome (ranked by p-value).
+
+    """
+    analysis_subset = request.args.get("analysis_subset", "BOTH")
+    if analysis_subset not in models.ANALYSIS_SUBSETS:
+        raise ValueError(f"{analysis_subset}: not a valid analysis subset")
+
+    session = Session()
+    exposure = _get_outcome(session, request.args.get("exposure_id"),
+                            request.args.get("exposure_type"))
+    outcome = _get_outcome(session, request.args.get("outcome_id"),
+                           request.args.get("outcome_type"))
+
+    disable_pruning = request.args.get("disable_pruning") == "true"
+
+    results = cis_mr.genome_wide_cis_mr(
+        session, exposure, outcome, analysis_subset,
+        instrument_prune=not disable_pruning,
+    )
+
+    genes = RESULT_STORE.genes().take(results.pop("gene_iid"),
+                                      ["ensembl_id", "name"])
+
+    columns = {"gene": genes["ensembl_id"], "gene_name": genes["name"]}
+    columns.update(results)
+
+    return ColumnarResults(
+        columns=columns,
+        constants={
+            "analysis_subset": analysis_subset,
+            "exposure_id": exposure.id,
+            "exposure_label": exposure.label,
+            "outcome_id": outcome.id,
+            "outcome_label": outcome.label,
+            "outcome_is_binary": outcome.is_binary(),
+        },
+    )
+
+
+@make_api("/cisMR/phenome", streamable=True, coalesce=True)
+def phenome_wide_cis_mendelian_randomization():
+    """Performs cis-MR of an exposure on every outcome for a gene (ranked by
+    p-value).
+
+    """
+    ensg = request.args.get("ensembl_id")
+    analysis_subset = request.args.get("analysis_subset", "BOTH")
+    if analysis_subset not in models.ANALYSIS_SUBSETS:
+        raise ValueError(f"{analysis_subset}: not a valid analysis subset")
+
+    gene_iid = RESULT_STORE.genes().find_iid(ensg)
+    if gene_iid is None:
+        raise RessourceNotFoundError(f"Could not find gene '{ensg}'.")
+
+    session = Session()
+    exposure = _get_outcome(session, request.args.get("exposure_id"),
+                            request.args.get("exposure_type"))
+
+    disable_pruning = request.args.get("disable_pruning") == "true"
+
+    results = cis_mr.phenome_wide_cis_mr(
+        session, gene_iid, exposure, analysis_subset,
+        instrument_prune=not disable_pruning,
+    )
+
+    if results is None:
+        raise RessourceNotFoundError(
+            f"Could not find results for the exposure '{exposure.id}' and "
+            f"gene '{ensg}' in subset {analysis_subset}."
+        )
+
+    outcome_iids = results.pop("outcome_iid").tolist()
+    outcomes = {
+        outcome.iid: outcome for outcome in
+        session.query(models.Outcome)
+        .filter(models.Outcome.iid.in_(outcome_iids))
+    }
+    outcomes = [outcomes[iid] for iid in outcome_iids]
+
+    columns = {
+        "outcome_id": [outcome.id for outcome in outcomes],
+        "outcome_label": [outcome.label for outcome in outcomes],
+        "analysis_type": [outcome.analysis_type for outcome in outcomes],
+        "outcome_is_binary": [outcome.is_binary() for outcome in outcomes],
+    }
+    columns.update(results)
+
+    return ColumnarResults(
+        columns=columns,
+        constants={
+            "analysis_subset": analysis_subset,
+            "gene": ensg,
+            "exposure_id": exposure.id,
+            "exposure_label": exposure.label,
+        },
+    )
+
+
+@make_api("/enrichment/atc/contingency/<outcome_id>",
+          cache=RESPONSE_CACHE_FRESH)
 def get_enrichment_atc_contingency_for_outcome(outcome_id):
     outcome = _get_outcome(Session(), outcome_id,
                            request.args.get("analysis_type"))
@@ -457,49 +1034,37 @@ def get_enrichment_atc_contingency_for_outcome(outcome_id):
 
 
 def get_enrichment_for_outcome(outcome_iid, enr_model):
-    atc_tree = tree_from_hierarchy_id("ATC")
-
-    # We will make a dict representation of the ATC tree to update the data
-    # easily.
-    atc_dict = {n.code: n for _, n in atc_tree.iter_depth_first()}
+    atc_tree = RESULT_STORE.hierarchy("ATC")
 
     results = Session.query(enr_model)\
         .filter_by(hierarchy_id="ATC")\
         .filter_by(outcome_iid=outcome_iid)\
         .all()
 
-    for enrichment_result in results:
-        n = atc_dict[enrichment_result.gene_set_id]
-        n._data = enrichment_result.get_data_dict()
-        n._data["min_p_children"] = None
-
-    stack = []
-    for _, node in atc_tree.iter_depth_first():
-        # Set the minimum p-value in subtree.
-        stack.append(node)
-
-    while stack:
-        cur = stack.pop()
+    # The enrichment values are aligned with the nodes of the tree.
+    data = [None] * len(atc_tree)
+    ps = np.full(len(atc_tree), np.nan)
 
-        if cur._data is None:
-            cur._data = {"p": None, "min_p_children": None}
-
-        ps = [i._data["min_p_children"] for i in cur.children]
-        ps.append(cur._data["p"])
+    for enrichment_result in results:
+        i = atc_tree.find(enrichment_result.gene_set_id)
+        if i is None:
+            continue
 
-        # Remove Nones
-        ps = [i for i in ps if i is not None]
+        data[i] = enrichment_result.get_data_dict()
+        if data[i]["p"] is not None:
+            ps[i] = data[i]["p"]
 
-        if len(ps) == 0:
-            # If there are no data for this node and all its children.
-            cur_min = None
+    # Set the minimum p-value in subtree.
+    min_ps = atc_tree.subtree_min(ps)
+    min_ps = [None if np.isnan(p) else p for p in min_ps.tolist()]
 
-        else:
-            cur_min = min(ps)
+    for i in range(1, len(atc_tree)):
+        if data[i] is None:
+            data[i] = {"p": None}
 
-        cur._data["min_p_children"] = cur_min
+        data[i]["min_p_children"] = min_ps[i]
 
-    tree = atc_tree.to_primitive()
+    tree = atc_tree.to_primitive(data)
     tree["code"] = "ATC"
 
     return tree
@@ -10,7 +10,7 @@ from sqlalchemy.orm.exc import NoResultFound
 from flask import Blueprint, render_template, abort, url_for, request, redirect
 
 from . import api
-from .cache import Cache
+from .cache import get_cache
 from ..version import exphewas_version
 from ..db import models
 from ..db.engine import Session
@@ -133,15 +133,11 @@ def get_outcome(id):
     elif analysis_subset == "MALE_ONLY":
         title += " (Male only)"
 
-    available_subsets = list(filter(
-        lambda o: (
-            o["id"] == id and
-            o["analysis_type"] == outcome_dict["analysis_type"]
-        ),
-        Cache().get("outcomes")
-    ))
-    assert len(available_subsets) == 1
-    available_subsets = available_subsets[0]["available_subsets"]
+    cached_outcome = get_cache().lookup(
+        "outcomes", "id_analysis_type", (id, outcome_dict["analysis_type"])
+    )
+    assert cached_outcome is not None
+    available_subsets = cached_outcome["available_subsets"]
 
     return render_template(
         "outcome.html",
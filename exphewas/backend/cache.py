@@ -5,55 +5,186 @@ Disk-based caching for ExPheWas.
 import os
 import json
 import sys
+import tempfile
+import threading
+import time
 
 from sqlalchemy.sql.expression import func
 
-from .config import CACHE_DIR
+from .config import CACHE_DIR, DATA_VERSION_CHECK_INTERVAL
 from ..db import models
 from ..db.engine import Session
 
 
+# The last data version read from the metadata table and when it was read.
+_DATA_VERSION = {"version": None, "checked_at": None}
+
+
+def get_data_version():
+    """Return the version of the results database (from the `meta` table).
+
+    The database is only queried if the last check is older than
+    DATA_VERSION_CHECK_INTERVAL seconds. None is returned if the version has
+    not been set.
+
+    """
+    now = time.monotonic()
+    checked_at = _DATA_VERSION["checked_at"]
+
+    if checked_at is None or now - checked_at >= DATA_VERSION_CHECK_INTERVAL:
+        version = Session.query(models.Metadata.version).first()
+        _DATA_VERSION["version"] = None if version is None else version[0]
+        _DATA_VERSION["checked_at"] = now
+
+    return _DATA_VERSION["version"]
+
+
 def path_to(name):
     """Return the path to a given cache file."""
     return os.path.join(CACHE_DIR, name)
 
 
+class CacheEntry(object):
+    """A parsed cache file with its secondary indexes."""
+    def __init__(self, stat_key, data, indexes):
+        self.stat_key = stat_key
+        self.data = data
+        self.indexes = indexes
+
+
+def _stat_key(filename):
+    """The modification time, size and inode of a file (None if it doesn't
+    exist).
+
+    """
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _build_indexes(name, data):
+    indexes = {}
+    for index_name, (key, unique) in CACHE_INDEXES.get(name, {}).items():
+        index = {}
+        for item in data:
+            if unique:
+                index[key(item)] = item
+            else:
+                index.setdefault(key(item), []).append(item)
+
+        indexes[index_name] = index
+
+    return indexes
+
+
 class Cache(object):
-    """Cache object."""
+    """Cache object.
+
+    The files (in the CACHE_DIR) are shared by the workers, but every
+    process keeps a parsed copy which is reloaded when the file changes
+    (modification time or size). Secondary indexes (CACHE_INDEXES) are built
+    when a file is loaded. The parsed data is shared, so it should not be
+    modified.
+
+    """
     # pylint: disable=missing-function-docstring
     def __init__(self):
         print(f"Using '{CACHE_DIR}' as data cache.")
 
+        self._lock = threading.Lock()
+        self._entries = {}
+
     def put(self, name, data):
-        with open(path_to(name), "w") as f:
+        # Written to a temporary file which is renamed, so that concurrent
+        # workers never read partial files.
+        with tempfile.NamedTemporaryFile("w", dir=CACHE_DIR, suffix=".tmp",
+                                         delete=False) as f:
             json.dump(data, f)
+        os.replace(f.name, path_to(name))
+
+    def _entry(self, name):
+        filename = path_to(name)
+
+        stat_key = _stat_key(filename)
+        if stat_key is None and name in STARTUP_CACHES:
+            # The startup caches are created on first use.
+            print(f"Creating cache for {name}")
+            STARTUP_CACHES[name](self, Session())
+            stat_key = _stat_key(filename)
+
+        entry = self._entries.get(name)
+        if entry is not None and entry.stat_key == stat_key:
+            return entry
+
+        with open(filename, "r") as f:
+            data = json.load(f)
+
+        entry = CacheEntry(stat_key, data, _build_indexes(name, data))
+        with self._lock:
+            self._entries[name] = entry
+
+        return entry
 
     def get(self, name):
-        with open(path_to(name), "r") as f:
-            return json.load(f)
+        return self._entry(name).data
+
+    def lookup(self, name, index, key, default=None):
+        """Get an item (or the list of items for non unique indexes) from
+        a secondary index.
+
+        """
+        return self._entry(name).indexes[index].get(key, default)
 
     def has(self, name):
-        try:
-            with open(path_to(name), "r"):
-                return True
-        except:
-            return False
+        return os.path.isfile(path_to(name))
 
     def clear(self):
+        # The subdirectories belong to the cache backends (their files can be
+        # open in the running workers), which are cleared through their API.
         for filename in os.listdir(CACHE_DIR):
-            os.remove(os.path.join(CACHE_DIR, filename))
+            filename = os.path.join(CACHE_DIR, filename)
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+        with self._lock:
+            self._entries.clear()
+
+        # Imported here as the backends depend on this module.
+        from .cache_backends import get_cache_backend
+        get_cache_backend().clear()
+
         print("Cache cleared.")
 
 
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache():
+    """Get the cache of the process."""
+    global _CACHE
+
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = Cache()
+
+    return _CACHE
+
+
 # Create the data caches.
 def create_or_load_startup_caches():
-    """Create or load the startup cache (outcome)."""
-    cache = Cache()
+    """Create the startup caches (otherwise created on first use)."""
+    cache = get_cache()
     session = Session()
 
-    if not cache.has("outcomes"):
-        print("Creating cache for outcomes")
-        cache_outcomes(cache, session)
+    for name, create_cache in STARTUP_CACHES.items():
+        if not cache.has(name):
+            print(f"Creating cache for {name}")
+            create_cache(cache, session)
 
 
 def cache_outcomes(cache, session):
@@ -87,33 +218,42 @@ def cache_outcomes(cache, session):
     cache.put("outcomes", results)
 
 
-def cache_gene_with_results():
-    """Cache genes with results (setting `has_results` to True)."""
-    print("Finding genes with results", file=sys.stderr)
-    session = Session()
+# Startup cache name -> function creating it.
+STARTUP_CACHES = {
+    "outcomes": cache_outcomes,
+}
+
+# Cache name -> {index name: (key function, unique)}.
+CACHE_INDEXES = {
+    "outcomes": {
+        "id_analysis_type": (lambda o: (o["id"], o["analysis_type"]), True),
+        "analysis_type": (lambda o: o["analysis_type"], False),
+    },
+}
 
-    # Retrieving all the genes with results
-    all_genes = session.query(models.RESULTS_CLASSES[0].gene_iid)
-    for result_obj in models.RESULTS_CLASSES[1:]:
-        all_genes = all_genes.union(session.query(result_obj.gene_iid))
 
-    # Setting has_results to true for these genes
-    for gene in all_genes.all():
-        gene_obj = session.query(models.Gene)\
-            .filter(models.Gene.iid == gene[0])\
-            .one()
-        gene_obj.has_results = True
+def cache_gene_with_results(gene_iids=None):
+    """Cache genes with results (setting `has_results`).
 
+    Only the given genes are updated if gene_iids is set (e.g. after an
+    import).
+
+    """
+    print("Finding genes with results", file=sys.stderr)
+    session = Session()
+
+    start = time.time()
+    n_updated = models.update_has_results(session, gene_iids)
     session.commit()
 
+    print(f"Updated {n_updated} genes in {time.time() - start:.2f}s",
+          file=sys.stderr)
+
 
 def clear_cache_gene_with_results():
     """Clear cache genes with results (setting `has_results` to False)."""
     print("Clearing genes with results", file=sys.stderr)
     session = Session()
 
-    # Resetting the cache
-    genes = session.query(models.Gene)
-    for gene in genes.all():
-        gene.has_results = False
+    models.clear_has_results(session)
     session.commit()
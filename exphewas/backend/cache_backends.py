@@ -0,0 +1,572 @@
+"""
+Key-value caches with interchangeable backends.
+
+The backends store bytes by (string) key, with an optional time to live, and
+evict the least recently used entries when their budget (in bytes) is
+exceeded:
+
+- MemoryBackend: in the process.
+- DiskBackend: one file per entry in a directory (written atomically).
+- SQLiteBackend: a SQLite database shared by the workers of a host.
+
+The disk and SQLite backends keep their files in their own subdirectory of
+the cache directory (which is not touched by Cache.clear).
+
+VersionedCache namespaces the keys by the data version (the `meta` table), so
+the entries of a previous release are never read (they are evicted over
+time).
+
+The backend is selected with the EXPHEWAS_CACHE_BACKEND variable (see
+config).
+"""
+
+import hashlib
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from os import path
+
+from .cache import get_data_version
+from .config import CACHE_BACKEND, CACHE_DIR, CACHE_MAX_BYTES, CACHE_TTL
+
+
+class CacheStats(object):
+    """Counters of a cache backend (for this process)."""
+    FIELDS = ("hits", "misses", "sets", "evictions", "expirations")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def incr(self, field, n=1):
+        with self._lock:
+            self._counts[field] += n
+
+    def to_dict(self):
+        with self._lock:
+            out = dict(self._counts)
+
+        lookups = out["hits"] + out["misses"]
+        out["hit_ratio"] = out["hits"] / lookups if lookups else None
+
+        return out
+
+
+def _expires_at(ttl):
+    """Expiration time (0 for no expiration)."""
+    return time.time() + ttl if ttl else 0
+
+
+def _is_expired(expires_at):
+    return expires_at != 0 and expires_at <= time.time()
+
+
+def _file_size(filename):
+    """The size of a file (0 if it doesn't exist)."""
+    try:
+        return os.stat(filename).st_size
+    except FileNotFoundError:
+        return 0
+
+
+class CacheBackend(object):
+    """Interface of the cache backends."""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+
+    def get(self, key):
+        """Get the value (bytes) of a key (None if missing or expired)."""
+        raise NotImplementedError()
+
+    def set(self, key, value, ttl=None):
+        """Set the value (bytes) of a key (ttl in seconds)."""
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+    @property
+    def nbytes(self):
+        raise NotImplementedError()
+
+    def info(self):
+        out = self.stats.to_dict()
+        out.update({
+            "backend": type(self).__name__,
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+        })
+
+        return out
+
+
+class MemoryBackend(CacheBackend):
+    """In-process cache (least recently used entries are evicted first)."""
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        super().__init__(max_bytes)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._nbytes = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and _is_expired(entry[1]):
+                self._remove(key)
+                self.stats.incr("expirations")
+                entry = None
+
+            if entry is None:
+                self.stats.incr("misses")
+                return None
+
+            self._entries.move_to_end(key)
+
+        self.stats.incr("hits")
+        return entry[0]
+
+    def set(self, key, value, ttl=None):
+        self.stats.incr("sets")
+
+        if len(value) > self.max_bytes:
+            # The previous value must not be served.
+            self.delete(key)
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, _expires_at(ttl))
+            self._nbytes += len(value)
+
+            while self._nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.stats.incr("evictions")
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._nbytes -= len(entry[0])
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+
+class DiskBackend(CacheBackend):
+    """One file per entry in a directory.
+
+    The files start with the expiration time (float64) followed by the
+    value. They are written to temporary files which are renamed, so
+    concurrent workers never read partial entries. Reading an entry updates
+    its modification time, and the oldest files are removed when the
+    directory exceeds its budget.
+
+    The size of the directory is estimated from its last scan and the writes
+    of this process. As other workers write to the same directory, it is
+    scanned again every SCAN_INTERVAL seconds, or when this process has
+    written more than SCAN_FRACTION of the budget since the last scan.
+
+    """
+    HEADER = struct.Struct("<d")
+    SUFFIX = ".entry"
+
+    SCAN_INTERVAL = 60
+    SCAN_FRACTION = 0.1
+
+    def __init__(self, directory=path.join(CACHE_DIR, "entries"),
+                 max_bytes=CACHE_MAX_BYTES):
+        super().__init__(max_bytes)
+        self.directory = directory
+
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._nbytes = None
+        self._scanned_at = None
+        self._written = 0
+
+    def _filename(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return path.join(self.directory, digest + self.SUFFIX)
+
+    def get(self, key):
+        filename = self._filename(key)
+
+        try:
+            with open(filename, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.stats.incr("misses")
+            return None
+
+        expires_at, = self.HEADER.unpack_from(data)
+        if _is_expired(expires_at):
+            self.delete(key)
+            self.stats.incr("expirations")
+            self.stats.incr("misses")
+            return None
+
+        try:
+            os.utime(filename)
+        except FileNotFoundError:
+            pass
+
+        self.stats.incr("hits")
+        return data[self.HEADER.size:]
+
+    def set(self, key, value, ttl=None):
+        self.stats.incr("sets")
+
+        if len(value) > self.max_bytes:
+            # The previous value must not be served.
+            self.delete(key)
+            return
+
+        filename = self._filename(key)
+
+        with tempfile.NamedTemporaryFile("wb", dir=self.directory,
+                                         suffix=".tmp", delete=False) as f:
+            f.write(self.HEADER.pack(_expires_at(ttl)))
+            f.write(value)
+
+        # The size of the replaced entry (if any).
+        old_size = _file_size(filename)
+        os.replace(f.name, filename)
+
+        size = self.HEADER.size + len(value)
+        with self._lock:
+            if self._nbytes is not None:
+                self._nbytes += size - old_size
+            self._written += size
+
+        if self.nbytes > self.max_bytes:
+            self._evict()
+
+    def _entries(self):
+        """The (modification time, size, filename) of the entries."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(self.SUFFIX):
+                    continue
+
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+
+                entries.append((st.st_mtime, st.st_size, entry.path))
+
+        return entries
+
+    def _scanned(self, nbytes):
+        """Record the size of the directory from a scan (with the lock)."""
+        self._nbytes = nbytes
+        self._scanned_at = time.monotonic()
+        self._written = 0
+
+    def _evict(self):
+        """Remove the least recently used files (down to 90% of the budget,
+        to avoid scanning the directory on every write).
+
+        """
+        with self._lock:
+            entries = sorted(self._entries())
+            nbytes = sum(size for _, size, _ in entries)
+
+            for _, size, filename in entries:
+                if nbytes <= 0.9 * self.max_bytes:
+                    break
+
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+                else:
+                    self.stats.incr("evictions")
+
+                nbytes -= size
+
+            self._scanned(nbytes)
+
+    def delete(self, key):
+        filename = self._filename(key)
+        size = _file_size(filename)
+
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            return
+
+        with self._lock:
+            if self._nbytes is not None:
+                self._nbytes -= size
+
+    def clear(self):
+        with self._lock:
+            for _, _, filename in self._entries():
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+
+            self._scanned(0)
+
+    def _needs_scan(self):
+        return (
+            self._nbytes is None or
+            time.monotonic() - self._scanned_at > self.SCAN_INTERVAL or
+            self._written > self.SCAN_FRACTION * self.max_bytes
+        )
+
+    @property
+    def nbytes(self):
+        # Computed from the directory (shared with other workers), then
+        # tracked for the writes of this process until the next scan.
+        with self._lock:
+            if self._needs_scan():
+                self._scanned(sum(size for _, size, _ in self._entries()))
+
+            return self._nbytes
+
+
+class SQLiteBackend(CacheBackend):
+    """Entries in a SQLite database (in WAL mode) shared by the workers of
+    a host.
+
+    Reads only write the access time of an entry if it is older than
+    ACCESS_RESOLUTION seconds, and the total size of the entries is kept in
+    a one-row table (maintained by triggers).
+
+    """
+    ACCESS_RESOLUTION = 60
+
+    def __init__(self, filename=path.join(CACHE_DIR, "sqlite", "cache.sqlite"),
+                 max_bytes=CACHE_MAX_BYTES):
+        super().__init__(max_bytes)
+        self.filename = filename
+
+        os.makedirs(path.dirname(filename), exist_ok=True)
+
+        self._local = threading.local()
+
+        with self._connection() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " nbytes INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            con.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed_at "
+                "ON entries (accessed_at)"
+            )
+
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS totals ("
+                " id INTEGER PRIMARY KEY CHECK (id = 0),"
+                " nbytes INTEGER NOT NULL)"
+            )
+            con.execute(
+                "INSERT OR IGNORE INTO totals "
+                "SELECT 0, COALESCE(SUM(nbytes), 0) FROM entries"
+            )
+            con.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_insert "
+                "AFTER INSERT ON entries BEGIN"
+                " UPDATE totals SET nbytes = nbytes + new.nbytes; END"
+            )
+            con.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_update "
+                "AFTER UPDATE OF nbytes ON entries BEGIN"
+                " UPDATE totals SET nbytes = nbytes + new.nbytes - old.nbytes;"
+                " END"
+            )
+            con.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_delete "
+                "AFTER DELETE ON entries BEGIN"
+                " UPDATE totals SET nbytes = nbytes - old.nbytes; END"
+            )
+
+    def _connection(self):
+        # One connection per thread.
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.filename, timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+
+        return con
+
+    def get(self, key):
+        con = self._connection()
+        row = con.execute(
+            "SELECT value, expires_at, accessed_at FROM entries "
+            "WHERE key = ?", (key, )
+        ).fetchone()
+
+        if row is not None and _is_expired(row[1]):
+            self.delete(key)
+            self.stats.incr("expirations")
+            row = None
+
+        if row is None:
+            self.stats.incr("misses")
+            return None
+
+        # The access time is coarse to avoid a write for every read.
+        now = time.time()
+        if now - row[2] > self.ACCESS_RESOLUTION:
+            with con:
+                con.execute(
+                    "UPDATE entries SET accessed_at = ? WHERE key = ?",
+                    (now, key)
+                )
+
+        self.stats.incr("hits")
+        return bytes(row[0])
+
+    def set(self, key, value, ttl=None):
+        self.stats.incr("sets")
+
+        if len(value) > self.max_bytes:
+            # The previous value must not be served.
+            self.delete(key)
+            return
+
+        # An upsert (instead of INSERT OR REPLACE) so that the triggers
+        # see the replaced entry.
+        con = self._connection()
+        with con:
+            con.execute(
+                "INSERT INTO entries VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value,"
+                " nbytes = excluded.nbytes, expires_at = excluded.expires_at,"
+                " accessed_at = excluded.accessed_at",
+                (key, sqlite3.Binary(value), len(value), _expires_at(ttl),
+                 time.time()),
+            )
+
+        if self.nbytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries (down to 90% of the
+        budget).
+
+        """
+        con = self._connection()
+        with con:
+            nbytes, = con.execute("SELECT nbytes FROM totals").fetchone()
+            rows = con.execute(
+                "SELECT key, nbytes FROM entries ORDER BY accessed_at"
+            )
+
+            evicted = []
+            for key, size in rows:
+                if nbytes <= 0.9 * self.max_bytes:
+                    break
+
+                evicted.append((key, ))
+                nbytes -= size
+
+            con.executemany("DELETE FROM entries WHERE key = ?", evicted)
+
+        self.stats.incr("evictions", len(evicted))
+
+    def delete(self, key):
+        con = self._connection()
+        with con:
+            con.execute("DELETE FROM entries WHERE key = ?", (key, ))
+
+    def clear(self):
+        con = self._connection()
+        with con:
+            con.execute("DELETE FROM entries")
+
+    @property
+    def nbytes(self):
+        nbytes, = self._connection().execute(
+            "SELECT nbytes FROM totals"
+        ).fetchone()
+
+        return nbytes
+
+
+BACKENDS = {
+    "memory": MemoryBackend,
+    "disk": DiskBackend,
+    "sqlite": SQLiteBackend,
+}
+
+
+class VersionedCache(object):
+    """A cache namespace where the keys include the data version."""
+    def __init__(self, namespace, backend=None, ttl=None):
+        self.namespace = namespace
+        self.ttl = CACHE_TTL if ttl is None else ttl
+        self._backend = backend
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            return get_cache_backend()
+
+        return self._backend
+
+    def _key(self, key):
+        return f"{self.namespace}\n{get_data_version()}\n{key}"
+
+    def get(self, key):
+        return self.backend.get(self._key(key))
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(self._key(key), value,
+                         self.ttl if ttl is None else ttl)
+
+    def delete(self, key):
+        self.backend.delete(self._key(key))
+
+
+_BACKEND = None
+_BACKEND_LOCK = threading.Lock()
+
+
+def get_cache_backend():
+    """Get the configured cache backend (EXPHEWAS_CACHE_BACKEND)."""
+    global _BACKEND
+
+    if _BACKEND is None:
+        with _BACKEND_LOCK:
+            if _BACKEND is None:
+                if CACHE_BACKEND not in BACKENDS:
+                    raise ValueError(
+                        f"{CACHE_BACKEND}: invalid cache backend "
+                        f"({', '.join(BACKENDS)})"
+                    )
+
+                _BACKEND = BACKENDS[CACHE_BACKEND]()
+
+    return _BACKEND
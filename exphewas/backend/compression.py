@@ -0,0 +1,176 @@
+"""
+Compression (gzip) of the responses.
+
+Responses are compressed after the request when the client accepts gzip,
+unless they are small, streamed, already encoded or not text (e.g. the npz
+format). Responses with an ETag are only compressed once: the compressed
+bytes are kept in memory (by ETag) and reused for the following requests.
+
+The number of bytes before and after compression and the time spent
+compressing are counted (see CompressionMetrics) to assess the CPU vs
+bandwidth trade-off.
+"""
+
+import gzip
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request
+
+from .config import (
+    COMPRESSION_CACHE_MAX_BYTES, COMPRESSION_LEVEL, COMPRESSION_MIN_SIZE,
+)
+
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json", "application/javascript", "application/xml",
+    "image/svg+xml",
+}
+
+
+class CompressionMetrics(object):
+    """Counters of the compression middleware."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.n_compressed = 0
+        self.n_cache_hits = 0
+        self.n_skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compress_seconds = 0
+
+    def add(self, bytes_in, bytes_out, seconds=0, cache_hit=False):
+        with self._lock:
+            self.n_compressed += 1
+            self.n_cache_hits += cache_hit
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.compress_seconds += seconds
+
+    def skip(self):
+        with self._lock:
+            self.n_skipped += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "n_compressed": self.n_compressed,
+                "n_cache_hits": self.n_cache_hits,
+                "n_skipped": self.n_skipped,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+                "ratio": (self.bytes_in / self.bytes_out
+                          if self.bytes_out else None),
+                "compress_seconds": self.compress_seconds,
+                "level": COMPRESSION_LEVEL,
+                "min_size": COMPRESSION_MIN_SIZE,
+            }
+
+
+class CompressedCache(object):
+    """Compressed responses by ETag (least recently used are evicted first
+    when the memory budget is exceeded).
+
+    """
+    def __init__(self, max_bytes=COMPRESSION_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, etag):
+        with self._lock:
+            data = self._entries.get(etag)
+            if data is not None:
+                self._entries.move_to_end(etag)
+
+            return data
+
+    def put(self, etag, data):
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            if etag not in self._entries:
+                self._entries[etag] = data
+                self.nbytes += len(data)
+
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+COMPRESSION_METRICS = CompressionMetrics()
+COMPRESSED_CACHE = CompressedCache()
+
+
+def _is_compressible(response):
+    if (response.status_code != 200 or response.direct_passthrough or
+            response.is_streamed or "Content-Encoding" in response.headers):
+        return False
+
+    if response.cache_control.no_transform:
+        return False
+
+    mimetype = response.mimetype or ""
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_MIMETYPES
+
+
+def compress_response(response):
+    """Compress a response (after_request function)."""
+    if COMPRESSION_LEVEL <= 0 or not request.accept_encodings["gzip"]:
+        return response
+
+    if not _is_compressible(response):
+        COMPRESSION_METRICS.skip()
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESSION_MIN_SIZE:
+        COMPRESSION_METRICS.skip()
+        return response
+
+    etag, weak = response.get_etag()
+    if weak:
+        etag = None
+
+    compressed = None if etag is None else COMPRESSED_CACHE.get(etag)
+
+    if compressed is not None:
+        COMPRESSION_METRICS.add(len(data), len(compressed), cache_hit=True)
+
+    else:
+        start = time.perf_counter()
+        compressed = gzip.compress(data, compresslevel=COMPRESSION_LEVEL,
+                                   mtime=0)
+        COMPRESSION_METRICS.add(len(data), len(compressed),
+                                time.perf_counter() - start)
+
+        if etag is not None:
+            COMPRESSED_CACHE.put(etag, compressed)
+
+    response.set_data(compressed)
+    response.content_encoding = "gzip"
+    response.vary.add("Accept-Encoding")
+
+    # The compressed representation has its own ETag (see api.make_api).
+    if etag is not None:
+        response.set_etag(f"{etag}-gzip")
+
+    return response
+
+
+def init_app(app):
+    """Compress the responses of the application."""
+    app.after_request(compress_response)
@@ -15,6 +15,69 @@ CACHE_DIR = os.environ.get(
     os.path.join(tempfile.gettempdir(), "exphewas")
 )
 
+# Memory budget (in bytes) for the in-memory columnar result store.
+RESULT_STORE_MAX_BYTES = int(os.environ.get(
+    "EXPHEWAS_RESULT_STORE_MAX_BYTES", 256 * 1024 ** 2
+))
+
+# Minimum delay (in seconds) between two checks of the data version in the
+# metadata table. In-memory structures are invalidated when it changes.
+DATA_VERSION_CHECK_INTERVAL = float(os.environ.get(
+    "EXPHEWAS_DATA_VERSION_CHECK_INTERVAL", 30
+))
+
+# Max age (in seconds) in the Cache-Control header of the API responses. The
+# responses have an ETag tied to the data version, so clients (and proxies)
+# can always revalidate them cheaply.
+API_MAX_AGE = int(os.environ.get("EXPHEWAS_API_MAX_AGE", 0))
+
+# Maximum number of genes in a request for the gene x outcome matrix.
+MATRIX_MAX_GENES = int(os.environ.get("EXPHEWAS_MATRIX_MAX_GENES", 5000))
+
+# Compression of the responses (gzip level, 0 to disable, and minimum size in
+# bytes of the compressed responses).
+COMPRESSION_LEVEL = int(os.environ.get("EXPHEWAS_COMPRESSION_LEVEL", 6))
+COMPRESSION_MIN_SIZE = int(os.environ.get(
+    "EXPHEWAS_COMPRESSION_MIN_SIZE", 1024
+))
+
+# Memory budget (in bytes) for the compressed responses which are reused
+# (responses with an ETag).
+COMPRESSION_CACHE_MAX_BYTES = int(os.environ.get(
+    "EXPHEWAS_COMPRESSION_CACHE_MAX_BYTES", 64 * 1024 ** 2
+))
+
+# Backend of the response cache (memory, disk or sqlite, see cache_backends),
+# its budget in bytes and the default time to live of the entries in seconds
+# (0 for no expiration).
+CACHE_BACKEND = os.environ.get("EXPHEWAS_CACHE_BACKEND", "memory")
+CACHE_MAX_BYTES = int(os.environ.get(
+    "EXPHEWAS_CACHE_MAX_BYTES", 256 * 1024 ** 2
+))
+CACHE_TTL = float(os.environ.get("EXPHEWAS_CACHE_TTL", 0))
+
+# Number of seconds the memoized API responses (see make_api's cache option)
+# are fresh. The keys include the data version, but this also bounds how long
+# a response can be served when the database is updated without changing its
+# version (or has none).
+RESPONSE_CACHE_FRESH = float(os.environ.get(
+    "EXPHEWAS_RESPONSE_CACHE_FRESH", 3600
+))
+
+# Number of seconds stale API responses (see make_api's cache option) are
+# still served while they are recomputed.
+RESPONSE_CACHE_STALE = float(os.environ.get(
+    "EXPHEWAS_RESPONSE_CACHE_STALE", 60
+))
+
+# Whether concurrent identical API calls (see make_api's coalesce option) are
+# also coalesced across the workers of a host (with lock files). The results
+# are shared through the cache backend, so it needs to be shared too (disk or
+# sqlite).
+COALESCE_ACROSS_WORKERS = os.environ.get(
+    "EXPHEWAS_COALESCE_ACROSS_WORKERS", "false"
+).lower() in ("1", "true", "yes")
+
 if not os.path.isdir(CACHE_DIR):
     os.makedirs(CACHE_DIR)
 
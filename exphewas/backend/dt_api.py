@@ -7,10 +7,12 @@ from flask import Blueprint, request
 
 from sqlalchemy import or_
 
-from datatables import DataTable
-
 from ..db import models
 from ..db.engine import Session
+from ..lazy import LazyModule
+
+
+datatables = LazyModule("datatables")
 
 
 dt_api = Blueprint("dt_api_blueprint", __name__)
@@ -28,7 +30,7 @@ def dt_gene():
     if with_results_only:
         q = q.filter(models.Gene.has_results.is_(True))
 
-    table = DataTable(
+    table = datatables.DataTable(
         request.args,
         models.Gene,
         q,
@@ -0,0 +1,335 @@
+"""
+Encoding of the API responses.
+
+Large list results can be streamed as a chunked response where the rows are
+encoded from an iterator instead of building the complete document in
+memory first.
+
+Results held as columns (ColumnarResults) can also be encoded in compact
+formats where constant fields are only written once:
+
+- columnar: JSON with one array per column.
+- npy: NumPy (.npz) archive with one little-endian array per column.
+- msgpack: like columnar, but with numeric columns as raw little-endian
+  bytes (requires the optional msgpack package).
+"""
+
+import io
+import json
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Fields clamped when their value is too large or not finite (the -log10(p)
+# are capped at 500 by the API). Other non finite values are encoded as null
+# to produce valid JSON.
+CLAMPED_FIELDS = {"nlog10p": 500}
+
+# Number of rows encoded before a chunk is sent.
+STREAM_CHUNK_ROWS = 1000
+
+
+class APIJSONEncoder(json.JSONEncoder):
+    """JSON encoder with support for NumPy scalars and arrays."""
+    def default(self, o):  # pylint: disable=method-hidden
+        if isinstance(o, np.integer):
+            return int(o)
+
+        if isinstance(o, np.floating):
+            return float(o)
+
+        if isinstance(o, np.bool_):
+            return bool(o)
+
+        if isinstance(o, np.ndarray):
+            return o.tolist()
+
+        return super().default(o)
+
+
+_ENCODER = APIJSONEncoder(separators=(",", ":"), sort_keys=True)
+
+
+def clamp_row(row):
+    """Clamp the values of a row (dict) so that it is valid JSON."""
+    for key, value in row.items():
+        if not isinstance(value, (float, np.floating)):
+            continue
+
+        if key in CLAMPED_FIELDS:
+            cap = CLAMPED_FIELDS[key]
+            if not value < cap:
+                row[key] = cap
+
+        elif not np.isfinite(value):
+            row[key] = None
+
+    return row
+
+
+def encode_json_array(rows):
+    """Encode an iterable of rows as a JSON array (like iter_json_array, in
+    a single string).
+
+    """
+    return _ENCODER.encode([clamp_row(row) for row in rows])
+
+
+def iter_json_array(rows, chunk_rows=STREAM_CHUNK_ROWS):
+    """Encode an iterable of rows as a JSON array, in chunks of rows."""
+    yield "["
+
+    chunk = []
+    first = True
+    for row in rows:
+        chunk.append(_ENCODER.encode(clamp_row(row)))
+
+        if len(chunk) == chunk_rows:
+            yield ("" if first else ",") + ",".join(chunk)
+            first = False
+            chunk = []
+
+    if chunk:
+        yield ("" if first else ",") + ",".join(chunk)
+
+    yield "]"
+
+
+class ColumnarResults(object):
+    """Tabular results held as columns.
+
+    The fields with the same value for every row are held once as
+    constants. Nested fields (e.g. the gene region) are reconstructed from
+    their columns when iterating over the rows. Optionally, a boolean mask
+    tells for which rows an optional column is present.
+
+    Iterating yields the rows as dicts, so it can be used as a list of
+    results.
+
+    """
+    def __init__(self, columns, constants=None, nested=None, present=None):
+        self.columns = columns
+        self.constants = constants if constants else {}
+        self.nested = nested if nested else {}
+        self.present = present if present else {}
+
+    @classmethod
+    def from_rows(cls, rows, nested=None):
+        """Create from a list of flat rows (dicts)."""
+        names = []
+        for row in rows:
+            names.extend(name for name in row if name not in names)
+
+        columns = {}
+        constants = {}
+        present = {}
+        for name in names:
+            mask = np.array([name in row for row in rows], dtype=bool)
+            values = [row.get(name) for row in rows]
+
+            if mask.all() and values and all(
+                value == values[0] for value in values
+            ):
+                constants[name] = values[0]
+                continue
+
+            columns[name] = values
+            if not mask.all():
+                present[name] = mask
+
+        return cls(columns, constants, nested, present)
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+
+        return len(next(iter(self.columns.values())))
+
+    def __iter__(self):
+        values = {name: _to_list(col) for name, col in self.columns.items()}
+        present = {name: mask.tolist() for name, mask in self.present.items()}
+
+        nested_columns = {
+            column for fields in self.nested.values()
+            for column in fields.values()
+        }
+
+        flat = [name for name in values if name not in nested_columns]
+
+        for i in range(len(self)):
+            row = dict(self.constants)
+
+            for name in flat:
+                if name in present and not present[name][i]:
+                    continue
+                row[name] = values[name][i]
+
+            for field, fields in self.nested.items():
+                row[field] = {
+                    key: values[column][i] for key, column in fields.items()
+                }
+
+            yield row
+
+    def to_columnar(self):
+        """Primitive representation with the columns as lists."""
+        return {
+            "n_rows": len(self),
+            "constants": self.constants,
+            "nested": self.nested,
+            "columns": {
+                name: _to_list(col, nan_as_none=True)
+                for name, col in self.columns.items()
+            },
+        }
+
+
+def _to_list(col, nan_as_none=False):
+    if isinstance(col, np.ndarray):
+        if nan_as_none and col.dtype.kind == "f":
+            values = col.astype(object)
+            values[~np.isfinite(col)] = None
+            return values.tolist()
+
+        return col.tolist()
+
+    if nan_as_none:
+        return [
+            None if isinstance(value, float) and not np.isfinite(value)
+            else value
+            for value in col
+        ]
+
+    return list(col)
+
+
+def _to_array(col):
+    """Convert a column to a little-endian array (strings are unicode)."""
+    # Object arrays (Python values) are converted like lists.
+    if not isinstance(col, np.ndarray) or col.dtype == object:
+        values = list(col)
+        non_null = [value for value in values if value is not None]
+
+        if all(isinstance(value, str) for value in non_null):
+            col = np.array(
+                ["" if value is None else value for value in values],
+                dtype=str,
+            )
+
+        elif len(non_null) < len(values):
+            # Missing numerical values are represented as NaN.
+            col = np.array(
+                [np.nan if value is None else value for value in values],
+                dtype=float,
+            )
+
+        else:
+            col = np.array(values)
+
+    if col.dtype.kind in "iuf" and col.dtype.byteorder == ">":
+        col = col.astype(col.dtype.newbyteorder("<"))
+
+    return col
+
+
+def encode_columnar_json(results):
+    return _ENCODER.encode(results.to_columnar())
+
+
+def encode_npz(results):
+    """Encode as a NumPy archive (read with numpy.load).
+
+    The constants are 0-d arrays and the presence masks are stored as
+    '<column>.present'.
+
+    """
+    arrays = dict(results.constants)
+    arrays.update(results.columns)
+    arrays.update({f"{name}.present": mask
+                   for name, mask in results.present.items()})
+
+    return encode_arrays_npz(arrays)
+
+
+def encode_arrays_npz(arrays):
+    """Encode a dict of arrays (or lists and scalars) as a NumPy archive."""
+    arrays = {
+        name: _to_array(value) if isinstance(value, (list, tuple, np.ndarray))
+        else _to_array([value])[0]
+        for name, value in arrays.items()
+    }
+
+    f = io.BytesIO()
+    np.savez(f, **arrays)
+    return f.getvalue()
+
+
+def encode_msgpack(results):
+    """Encode using msgpack.
+
+    Numeric columns are maps with the dtype (e.g. '<f8') and the raw data
+    (to read with numpy.frombuffer). Other columns are lists.
+
+    """
+    if msgpack is None:
+        raise ValueError("The msgpack format is not available on this "
+                         "server.")
+
+    columns = {}
+    for name, col in results.columns.items():
+        col = _to_array(col)
+
+        if col.dtype.kind in "iufb":
+            columns[name] = {"dtype": col.dtype.str, "data": col.tobytes()}
+        else:
+            columns[name] = col.tolist()
+
+    return msgpack.packb({
+        "n_rows": len(results),
+        "constants": results.constants,
+        "nested": results.nested,
+        "columns": columns,
+        "present": {name: mask.tolist()
+                    for name, mask in results.present.items()},
+    }, use_bin_type=True)
+
+
+# Format name -> (mimetype, encoder).
+FORMATS = {
+    "columnar": ("application/json", encode_columnar_json),
+    "npy": ("application/x-npz", encode_npz),
+    "msgpack": ("application/x-msgpack", encode_msgpack),
+}
+
+
+# The mimetypes that can be used in the Accept header to select a format.
+ACCEPT_FORMATS = {
+    "application/json": "json",
+    "application/vnd.exphewas.columnar+json": "columnar",
+    "application/x-npz": "npy",
+    "application/x-msgpack": "msgpack",
+    "application/msgpack": "msgpack",
+}
+
+
+def negotiate_format(request):
+    """Get the requested format (from the format parameter or the Accept
+    header). The default is 'json' (rows).
+
+    """
+    fmt = request.args.get("format")
+    if fmt is None:
+        best = request.accept_mimetypes.best_match(list(ACCEPT_FORMATS))
+        return ACCEPT_FORMATS.get(best, "json")
+
+    if fmt != "json" and fmt not in FORMATS:
+        raise ValueError(
+            f"{fmt}: not a valid format (json, {', '.join(FORMATS)})"
+        )
+
+    return fmt
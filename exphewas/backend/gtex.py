@@ -0,0 +1,142 @@
+"""
+GTEx median expression (TPM) served by the API.
+
+Parsing the gzipped GCT file is slow, so it is converted once to a float32
+NumPy array (genes x tissues) saved in the CACHE_DIR with a JSON index (genes,
+tissues and number of samples). The cached files are keyed on the hash of the
+source files, so they are rebuilt when the GTEx data changes.
+
+The matrix is memory-mapped on first use, which lets the workers share the
+pages through the OS page cache.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from os import path
+
+import numpy as np
+
+from .config import CACHE_DIR
+from .. import utils
+from ..lazy import LazyModule
+
+
+pkg_resources = LazyModule("pkg_resources")
+
+
+GTEX_MEDIAN_TPM_FILENAME = (
+    "GTEx_Analysis_2017-06-05_v8_RNASeQCv1.1.9_gene_median_tpm.gct.gz"
+)
+GTEX_STATISTICS_FILENAME = "GTEx_Current_Release.csv.gz"
+
+
+class GTExMatrix(object):
+    """The GTEx median TPM (genes x tissues) with a gene to row index."""
+    def __init__(self, matrix, genes, tissues, n_samples):
+        self.matrix = matrix
+        self.tissues = tissues
+        self.n_samples = n_samples
+
+        self._gene_index = {gene: i for i, gene in enumerate(genes)}
+
+    @classmethod
+    def load(cls, cache_dir=CACHE_DIR):
+        """Load the matrix from the cache (creating it if needed)."""
+        sources = [
+            pkg_resources.resource_filename(
+                utils.__name__, path.join("backend", "data", fn)
+            )
+            for fn in (GTEX_MEDIAN_TPM_FILENAME, GTEX_STATISTICS_FILENAME)
+        ]
+
+        prefix = path.join(cache_dir, f"gtex_median_tpm_{_hash(sources)}")
+        matrix_fn = prefix + ".npy"
+        index_fn = prefix + ".json"
+
+        if not (path.isfile(matrix_fn) and path.isfile(index_fn)):
+            _create_cache(matrix_fn, index_fn)
+
+        with open(index_fn) as f:
+            index = json.load(f)
+
+        return cls(np.load(matrix_fn, mmap_mode="r"), index["genes"],
+                   index["tissues"], index["n_samples"])
+
+    def gene_expression(self, ensembl_id):
+        """Get the expression of a gene in every tissue (an empty list if
+        the gene is not in GTEx).
+
+        """
+        i = self._gene_index.get(ensembl_id)
+        if i is None:
+            return []
+
+        # The values are converted using their shortest float32
+        # representation (e.g. 0.1 instead of 0.10000000149011612).
+        values = self.matrix[i].astype(str).astype(float).tolist()
+
+        return [
+            {"tissue": tissue, "value": value, "nb_samples": n_samples}
+            for tissue, value, n_samples in zip(self.tissues, values,
+                                                self.n_samples)
+        ]
+
+
+def _hash(filenames):
+    sha1 = hashlib.sha1()
+    for fn in filenames:
+        with open(fn, "rb") as f:
+            for chunk in iter(lambda: f.read(2 ** 20), b""):
+                sha1.update(chunk)
+
+    return sha1.hexdigest()[:16]
+
+
+def _create_cache(matrix_fn, index_fn):
+    """Parse the GTEx files and write the cached matrix and index.
+
+    The files are written to temporary files which are renamed, so that
+    concurrent workers never read partial files.
+
+    """
+    df = utils.load_gtex_median_tpm()
+    n_samples = utils.load_gtex_statistics()
+
+    index = {
+        "genes": df.index.tolist(),
+        "tissues": df.columns.tolist(),
+        "n_samples": [n_samples.get(tissue) for tissue in df.columns],
+    }
+
+    matrix = np.ascontiguousarray(df.values, dtype=np.float32)
+
+    directory = path.dirname(matrix_fn)
+
+    with tempfile.NamedTemporaryFile("wt", dir=directory, suffix=".tmp",
+                                     delete=False) as f:
+        json.dump(index, f)
+    os.replace(f.name, index_fn)
+
+    with tempfile.NamedTemporaryFile("wb", dir=directory, suffix=".tmp",
+                                     delete=False) as f:
+        np.save(f, matrix)
+    os.replace(f.name, matrix_fn)
+
+
+_GTEX = None
+_GTEX_LOCK = threading.Lock()
+
+
+def get_gtex_matrix():
+    """Get the GTEx matrix (loaded on first use)."""
+    global _GTEX
+
+    if _GTEX is None:
+        with _GTEX_LOCK:
+            if _GTEX is None:
+                _GTEX = GTExMatrix.load()
+
+    return _GTEX
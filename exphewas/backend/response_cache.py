@@ -0,0 +1,256 @@
+"""
+Memoization of the serialized API responses (see make_api's cache option).
+
+The responses are stored in the cache backend (see cache_backends), so they
+share its byte budget, keyed on the rule, the URL arguments (sorted), the
+negotiated representation (Accept and gzip support) and the data version.
+
+Cached responses can be fresh for a given number of seconds. Stale responses
+are still served for RESPONSE_CACHE_STALE seconds while they are recomputed
+in the background (stale-while-revalidate), once per key at a time.
+
+The concurrent identical requests can also be coalesced (see make_api's
+coalesce option and single_flight): one of them computes the response, the
+others wait for it and get a copy.
+"""
+
+import json
+import threading
+import time
+
+from flask import Response, copy_current_request_context, request
+
+from .. import __version__
+from .cache_backends import VersionedCache
+from .config import RESPONSE_CACHE_STALE
+from .single_flight import SINGLE_FLIGHT
+
+
+# Headers kept with the cached responses.
+CACHED_HEADERS = ("Content-Type", "Content-Encoding", "Vary")
+
+
+class CachedResponse(object):
+    """A serialized response (status, headers and body) with its creation
+    time."""
+    def __init__(self, headers, data, created_at, status=200):
+        self.headers = headers
+        self.data = data
+        self.created_at = created_at
+        self.status = status
+
+    @classmethod
+    def from_response(cls, response):
+        headers = {name: response.headers[name] for name in CACHED_HEADERS
+                   if name in response.headers}
+
+        return cls(headers, response.get_data(), time.time(),
+                   response.status_code)
+
+    def to_response(self):
+        return Response(self.data, status=self.status, headers=self.headers)
+
+    def encode(self):
+        """A JSON header line followed by the body."""
+        header = json.dumps({"headers": self.headers,
+                             "created_at": self.created_at,
+                             "status": self.status})
+
+        return header.encode("utf-8") + b"\n" + self.data
+
+    @classmethod
+    def decode(cls, data):
+        header, body = data.split(b"\n", 1)
+        header = json.loads(header)
+
+        return cls(header["headers"], body, header["created_at"],
+                   header.get("status", 200))
+
+
+class EndpointMetrics(object):
+    """Counters of the response cache by endpoint (for this process)."""
+    FIELDS = ("hits", "stale_hits", "rechecked_hits", "misses", "stores",
+              "revalidations", "coalesced", "bytes_served")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def incr(self, endpoint, field, n=1):
+        with self._lock:
+            counts = self._counts.get(endpoint)
+            if counts is None:
+                counts = self._counts[endpoint] = dict.fromkeys(
+                    self.FIELDS, 0
+                )
+
+            counts[field] += n
+
+    def to_dict(self):
+        with self._lock:
+            out = {endpoint: dict(counts)
+                   for endpoint, counts in self._counts.items()}
+
+        for counts in out.values():
+            hits = (counts["hits"] + counts["stale_hits"] +
+                    counts["rechecked_hits"])
+            lookups = hits + counts["misses"]
+            counts["hit_ratio"] = hits / lookups if lookups else None
+
+        return out
+
+
+class ResponseCache(object):
+    """Cache of the responses of the API functions."""
+    def __init__(self, namespace="responses", stale=RESPONSE_CACHE_STALE):
+        self.stale = stale
+        self.metrics = EndpointMetrics()
+
+        self._cache = VersionedCache(namespace)
+        self._lock = threading.Lock()
+        self._revalidating = set()
+
+    @staticmethod
+    def request_key():
+        """The key of the current request."""
+        return "\n".join([
+            str(__version__), request.url_rule.rule,
+            repr(sorted(request.view_args.items())),
+            repr(sorted(request.args.items(multi=True))),
+            request.headers.get("Accept", ""),
+            str(bool(request.accept_encodings["gzip"])),
+        ])
+
+    def respond(self, endpoint, fresh, compute, coalesce=False):
+        """Get the response for the current request, from the cache or by
+        calling compute.
+
+        Responses are fresh for 'fresh' seconds (None for the whole data
+        version). Only successful, non streamed responses are cached.
+
+        If coalesce is set, compute is called once for the concurrent misses
+        of a key (see coalesced).
+
+        """
+        key = self.request_key()
+
+        cached = self._lookup(key)
+        if cached is not None:
+            age = time.time() - cached.created_at
+            if fresh is None or age <= fresh:
+                self.metrics.incr(endpoint, "hits")
+
+            else:
+                self.metrics.incr(endpoint, "stale_hits")
+                self._revalidate(endpoint, key, fresh, compute)
+
+            self.metrics.incr(endpoint, "bytes_served", len(cached.data))
+            return cached.to_response()
+
+        if coalesce:
+            def compute_and_store():
+                response = compute()
+                self._store(endpoint, key, fresh, response)
+                return response
+
+            # Another worker may have stored the response while we were
+            # waiting for it.
+            cached, outcome = self._coalesced(
+                key, compute_and_store, recheck=lambda: self._lookup(key)
+            )
+
+            self.metrics.incr(
+                endpoint, "misses" if outcome == "computed" else outcome
+            )
+            return cached.to_response()
+
+        self.metrics.incr(endpoint, "misses")
+
+        response = compute()
+        self._store(endpoint, key, fresh, response)
+
+        return response
+
+    def coalesced(self, endpoint, compute, key=None, recheck=None):
+        """Get the response for the current request by calling compute once
+        for the concurrent identical requests.
+
+        The response is serialized (it must not be streamed) and every
+        request gets its own copy. The requests can be coalesced across
+        workers if recheck is given (see SingleFlight.do).
+
+        """
+        if key is None:
+            key = self.request_key()
+
+        cached, outcome = self._coalesced(key, compute, recheck)
+        if outcome != "computed":
+            self.metrics.incr(endpoint, outcome)
+
+        return cached.to_response()
+
+    def _coalesced(self, key, compute, recheck=None):
+        """The serialized response and how it was obtained: 'computed' (by
+        this request), 'rechecked_hits' (stored by another worker) or
+        'coalesced' (computed by a concurrent request).
+
+        """
+        outcome = []
+
+        def run():
+            outcome.append("computed")
+            return CachedResponse.from_response(compute())
+
+        def checked():
+            cached = recheck()
+            if cached is not None:
+                outcome.append("rechecked_hits")
+
+            return cached
+
+        cached = SINGLE_FLIGHT.do(
+            key, run, recheck=None if recheck is None else checked
+        )
+
+        return cached, outcome[0] if outcome else "coalesced"
+
+    def _lookup(self, key):
+        data = self._cache.get(key)
+        if data is None:
+            return None
+
+        return CachedResponse.decode(data)
+
+    def _store(self, endpoint, key, fresh, response):
+        if (response.status_code != 200 or response.is_streamed or
+                response.direct_passthrough):
+            return
+
+        # The entries expire when they are too stale to be served.
+        ttl = 0 if fresh is None else fresh + self.stale
+
+        self._cache.set(key, CachedResponse.from_response(response).encode(),
+                        ttl=ttl)
+        self.metrics.incr(endpoint, "stores")
+
+    def _revalidate(self, endpoint, key, fresh, compute):
+        """Recompute a response in the background (once at a time)."""
+        with self._lock:
+            if key in self._revalidating:
+                return
+
+            self._revalidating.add(key)
+
+        @copy_current_request_context
+        def revalidate():
+            try:
+                self._store(endpoint, key, fresh, compute())
+                self.metrics.incr(endpoint, "revalidations")
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        threading.Thread(target=revalidate, daemon=True).start()
+
+
+RESPONSE_CACHE = ResponseCache()
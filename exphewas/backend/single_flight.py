@@ -0,0 +1,130 @@
+"""
+Coalescing of concurrent identical calls (single flight).
+
+The first call for a key runs the function and the concurrent calls for the
+same key wait for its result (or its exception) instead of running it again.
+
+Calls can also be coalesced across the workers of a host: the callers take a
+lock file (named by the hash of the key) and call a recheck function before
+running the function, which lets them reuse a result stored by another worker
+while they were waiting (e.g. in a shared cache).
+
+The lock files are empty and left in place (removing them while another
+worker waits on them would break the lock). They can be removed when no
+worker is running.
+"""
+
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from os import path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .config import CACHE_DIR, COALESCE_ACROSS_WORKERS
+
+
+class _Call(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesces the concurrent calls with the same key."""
+    def __init__(self, lock_dir=None):
+        self.lock_dir = lock_dir
+        if lock_dir is not None:
+            os.makedirs(lock_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._counts = {"leaders": 0, "followers": 0, "rechecked": 0}
+
+    def _incr(self, field):
+        with self._lock:
+            self._counts[field] += 1
+
+    def do(self, key, f, recheck=None):
+        """Get the result of f() for a key, shared by the concurrent calls.
+
+        If the calls are coalesced across workers and a recheck function is
+        given, its result is used instead of calling f unless it is None.
+
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self._incr("followers")
+            call.event.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        self._incr("leaders")
+        try:
+            call.result = self._run(key, f, recheck)
+            return call.result
+
+        except BaseException as exception:
+            call.error = exception
+            raise
+
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+            call.event.set()
+
+    def _run(self, key, f, recheck):
+        if self.lock_dir is None or recheck is None or fcntl is None:
+            return f()
+
+        with self._file_lock(key):
+            result = recheck()
+            if result is not None:
+                self._incr("rechecked")
+                return result
+
+            return f()
+
+    @contextmanager
+    def _file_lock(self, key):
+        # One lock file per key: flock conflicts between any two open files,
+        # even in the same process, so shared files would serialize unrelated
+        # keys.
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+        filename = path.join(self.lock_dir, f"{digest}.lock")
+        with open(filename, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def metrics(self):
+        with self._lock:
+            out = dict(self._counts)
+            out["in_flight"] = len(self._calls)
+
+        out["across_workers"] = self.lock_dir is not None and \
+            fcntl is not None
+
+        return out
+
+
+SINGLE_FLIGHT = SingleFlight(
+    path.join(CACHE_DIR, "locks") if COALESCE_ACROSS_WORKERS else None
+)
@@ -0,0 +1,474 @@
+"""
+In-memory columnar store for the results served by the API.
+
+The results database only changes when a new release is imported, so the
+results of an outcome are loaded once as NumPy arrays (without building ORM
+objects) and served from memory afterwards. The store is bounded in memory
+(least recently used outcomes are evicted first) and it is emptied when the
+data version in the `meta` table changes.
+
+The sets of tested and significant genes of outcomes (used for the set
+operations of the API) are also held as boolean masks indexed by gene iid,
+and the hierarchies as compact trees.
+
+The hierarchies are also kept serialized (JSON compressed with gzip) in
+memory and in the CACHE_DIR, as they are served as is by the API.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from os import path
+
+import numpy as np
+
+from .cache import get_data_version
+from .config import CACHE_DIR, RESULT_STORE_MAX_BYTES
+from ..db import models
+from ..db.engine import Session
+from ..db.tree import CompactTree, tree_from_hierarchy_id
+from ..utils import clamp_nlog10p, qvalue
+
+
+class GeneTable(object):
+    """The gene table held as arrays sorted by gene iid.
+
+    The columns are the ones of the genes table (FIELDS) and the number of
+    PCs (n_pcs).
+
+    """
+    FIELDS = tuple(models.Gene.__table__.columns.keys())
+
+    def __init__(self, iid, columns):
+        self.iid = iid
+        self.columns = columns
+
+        self._ensembl_index = {
+            ensembl_id: i
+            for i, ensembl_id in enumerate(columns["ensembl_id"].tolist())
+        }
+
+    @classmethod
+    def load(cls, session):
+        Gene = models.Gene
+
+        names = cls.FIELDS + ("n_pcs", )
+
+        rows = session.query(
+            *[getattr(Gene, name) for name in cls.FIELDS],
+            models.GeneNPcs.n_pcs_95,
+        )\
+            .outerjoin(models.GeneNPcs)\
+            .order_by(Gene.iid)\
+            .all()
+
+        iid = np.fromiter((row.iid for row in rows), dtype=np.int64,
+                          count=len(rows))
+
+        # Object arrays are used to keep Python types (and None) which are
+        # directly serializable.
+        columns = {}
+        for i, name in enumerate(names):
+            col = np.empty(len(rows), dtype=object)
+            col[:] = [row[i] for row in rows]
+            columns[name] = col
+
+        return cls(iid, columns)
+
+    def page(self, after=None, limit=None):
+        """Get the row slice of the genes with iid > after (at most limit
+        genes).
+
+        """
+        start = 0
+        if after is not None:
+            start = int(np.searchsorted(self.iid, after, side="right"))
+
+        end = self.iid.shape[0]
+        if limit is not None:
+            end = min(end, start + limit)
+
+        return slice(start, end)
+
+    def find_iid(self, ensembl_id):
+        """Get the iid of a gene from its Ensembl ID (None if not found)."""
+        i = self._ensembl_index.get(ensembl_id)
+        return None if i is None else int(self.iid[i])
+
+    def index_of(self, gene_iids):
+        """Get the row index of the genes (which need to exist)."""
+        return np.searchsorted(self.iid, gene_iids)
+
+    def take(self, gene_iids, columns=None):
+        """Get the columns (as lists) for a sequence of genes."""
+        idx = self.index_of(gene_iids)
+
+        if columns is None:
+            columns = self.columns.keys()
+
+        return {name: self.columns[name][idx].tolist() for name in columns}
+
+    @property
+    def nbytes(self):
+        # This is an underestimation because of the object arrays.
+        return self.iid.nbytes + sum(
+            col.nbytes for col in self.columns.values()
+        )
+
+
+class OutcomeResults(object):
+    """The results for an outcome in an analysis subset as arrays."""
+    def __init__(self, gene_iid, nlog10p, q, bonf):
+        self.gene_iid = gene_iid
+        self.nlog10p = nlog10p
+        self.q = q
+        self.bonf = bonf
+
+    @classmethod
+    def load(cls, session, outcome_iid, analysis_type, analysis_subset):
+        Result = models.get_results_class(analysis_type, analysis_subset)
+
+        rows = session.query(
+            Result.gene_iid, Result.static_nlog10p, Result.static_q,
+            Result.static_bonf,
+        )\
+            .filter_by(outcome_iid=outcome_iid)\
+            .order_by(Result.gene_iid)\
+            .all()
+
+        gene_iid = np.fromiter((row[0] for row in rows), dtype=np.int64,
+                               count=len(rows))
+
+        nlog10p, q, bonf = (
+            np.fromiter(
+                (np.nan if row[i] is None else row[i] for row in rows),
+                dtype=np.float64, count=len(rows)
+            )
+            for i in (1, 2, 3)
+        )
+
+        return cls(gene_iid, nlog10p, q, bonf)
+
+    def has_statistics(self):
+        """Whether the multiple testing statistics were computed at import."""
+        return bool(np.all(np.isfinite(self.q)) and
+                    np.all(np.isfinite(self.bonf)))
+
+    def __len__(self):
+        return self.gene_iid.shape[0]
+
+    @property
+    def nbytes(self):
+        return (self.gene_iid.nbytes + self.nlog10p.nbytes + self.q.nbytes +
+                self.bonf.nbytes)
+
+
+class GeneSets(object):
+    """The tested and significant genes for an outcome as boolean masks
+    indexed by gene iid.
+
+    """
+    def __init__(self, tested, significant):
+        self.tested = tested
+        self.significant = significant
+
+    @property
+    def nbytes(self):
+        return self.tested.nbytes + self.significant.nbytes
+
+
+class CompressedDocument(object):
+    """A JSON document compressed with gzip."""
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def from_primitive(cls, document):
+        # Same serialization as jsonify (sorted keys, compact). The mtime is
+        # fixed to get reproducible bytes.
+        data = json.dumps(document, sort_keys=True, separators=(",", ":"))
+        return cls(gzip.compress(data.encode("utf-8"), compresslevel=9,
+                                 mtime=0))
+
+    def decompress(self):
+        return gzip.decompress(self.data)
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+
+class ResultStore(object):
+    """Process-wide store of results (and genes) held as arrays.
+
+    Entries are built lazily and evicted in least recently used order when
+    the memory budget is exceeded. The store is emptied when the data version
+    changes, and entries loaded under the previous version are dropped.
+
+    """
+    def __init__(self, max_bytes=RESULT_STORE_MAX_BYTES, cache_dir=CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+
+        self._lock = threading.Lock()
+        self._version = None
+        self._genes = None
+        self._hierarchies = {}
+        self._entries = OrderedDict()
+        self._entries_nbytes = 0
+
+    def _check_version(self):
+        """Empty the store if the data version changed.
+
+        Returns the version, which the loaders pass when they add their
+        entries.
+
+        """
+        version = get_data_version()
+
+        with self._lock:
+            changed = version != self._version
+            if changed:
+                self._version = version
+                self._clear()
+
+        if changed:
+            self._remove_stale_documents(version)
+
+        return version
+
+    def _remove_stale_documents(self, version):
+        """Remove the hierarchy documents of the other versions from the
+        cache directory.
+
+        """
+        prefix = None if version is None else _document_prefix(version)
+
+        for filename in os.listdir(self.cache_dir):
+            if not (filename.startswith("tree_") and
+                    filename.endswith(".json.gz")):
+                continue
+
+            if prefix is not None and filename.startswith(prefix):
+                continue
+
+            try:
+                os.remove(path.join(self.cache_dir, filename))
+            except FileNotFoundError:
+                pass
+
+    def _clear(self):
+        self._genes = None
+        self._hierarchies = {}
+        self._entries.clear()
+        self._entries_nbytes = 0
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    @property
+    def nbytes(self):
+        genes_nbytes = 0 if self._genes is None else self._genes.nbytes
+        return genes_nbytes + self._entries_nbytes
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+            return entry
+
+    def _put(self, key, entry, version):
+        """Add an entry loaded under a data version (it is dropped if the
+        version changed in the meantime).
+
+        """
+        with self._lock:
+            if version != self._version:
+                return
+
+            if key not in self._entries:
+                self._entries[key] = entry
+                self._entries_nbytes += entry.nbytes
+
+            # Evict the least recently used entries (keeping at least the
+            # current one).
+            while (self._entries_nbytes > self.max_bytes and
+                   len(self._entries) > 1):
+                _, evicted = self._entries.popitem(last=False)
+                self._entries_nbytes -= evicted.nbytes
+
+    def genes(self):
+        """Get the gene table."""
+        version = self._check_version()
+
+        genes = self._genes
+        if genes is None:
+            genes = GeneTable.load(Session())
+            with self._lock:
+                if version == self._version:
+                    self._genes = genes
+
+        return genes
+
+    def hierarchy(self, id):
+        """Get a hierarchy as a CompactTree (loaded once per version)."""
+        version = self._check_version()
+
+        tree = self._hierarchies.get(id)
+        if tree is None:
+            tree = CompactTree.from_node(tree_from_hierarchy_id(id))
+
+            # Unknown hierarchies (only a root) are not kept, as the IDs come
+            # from the requests.
+            if len(tree) > 1:
+                with self._lock:
+                    if version == self._version:
+                        self._hierarchies[id] = tree
+
+        return tree
+
+    def hierarchy_document(self, id):
+        """Get a hierarchy as a CompressedDocument (None if the hierarchy
+        does not exist).
+
+        The documents are also written to the cache directory (for the
+        other workers and after restarts) when the data is versioned. The
+        files of the other versions are removed when the version changes.
+
+        """
+        version = self._check_version()
+
+        key = ("tree_document", id)
+
+        document = self._get(key)
+        if document is not None:
+            return document
+
+        filename = None
+        if version is not None:
+            # The ID is hashed, as it comes from the request.
+            digest = hashlib.sha1(
+                "\n".join(["tree", version, id]).encode("utf-8")
+            ).hexdigest()
+            filename = path.join(
+                self.cache_dir,
+                f"{_document_prefix(version)}{digest[:16]}.json.gz"
+            )
+
+        if filename is not None and path.isfile(filename):
+            with open(filename, "rb") as f:
+                document = CompressedDocument(f.read())
+
+        else:
+            tree = self.hierarchy(id)
+            if len(tree) <= 1:
+                return None
+
+            primitive = tree.to_primitive()
+            primitive["code"] = id
+            document = CompressedDocument.from_primitive(primitive)
+
+            if filename is not None:
+                _write_atomic(filename, document.data)
+
+        self._put(key, document, version)
+
+        return document
+
+    def outcome_results(self, outcome_iid, analysis_type,
+                        analysis_subset="BOTH"):
+        """Get the results for an outcome in a given analysis subset."""
+        version = self._check_version()
+
+        key = ("results", outcome_iid, analysis_subset)
+
+        results = self._get(key)
+        if results is None:
+            # Loading from the database (outside of the lock to allow
+            # concurrent requests for other outcomes).
+            results = OutcomeResults.load(Session(), outcome_iid,
+                                          analysis_type, analysis_subset)
+            self._put(key, results, version)
+
+        return results
+
+    def gene_sets(self, outcome_iid, analysis_type, analysis_subset,
+                  q_threshold):
+        """Get the tested and significant genes (q < q_threshold) for an
+        outcome.
+
+        The precomputed significance bitmaps are used for the standard
+        thresholds. Otherwise, the sets are built from the results.
+
+        """
+        version = self._check_version()
+        genes = self.genes()
+
+        key = ("gene_sets", outcome_iid, analysis_subset, q_threshold)
+
+        gene_sets = self._get(key)
+        if gene_sets is not None:
+            return gene_sets
+
+        n_bits = int(genes.iid[-1]) + 1 if genes.iid.shape[0] else 0
+
+        bitmap = None
+        if q_threshold in models.SignificanceBitmap.Q_THRESHOLDS:
+            bitmap = Session.query(models.SignificanceBitmap)\
+                .filter_by(outcome_iid=outcome_iid,
+                           analysis_subset=analysis_subset,
+                           q_threshold=q_threshold)\
+                .one_or_none()
+
+        if bitmap is not None:
+            unpack = models.SignificanceBitmap.unpack
+            gene_sets = GeneSets(unpack(bitmap.tested, n_bits),
+                                 unpack(bitmap.significant, n_bits))
+
+        else:
+            results = self.outcome_results(outcome_iid, analysis_type,
+                                           analysis_subset)
+
+            if results.has_statistics():
+                qs = results.q
+            else:
+                qs = qvalue(clamp_nlog10p(results.nlog10p.copy())[1])
+
+            tested = np.zeros(n_bits, dtype=bool)
+            tested[results.gene_iid] = True
+
+            significant = np.zeros(n_bits, dtype=bool)
+            significant[results.gene_iid[qs < q_threshold]] = True
+
+            gene_sets = GeneSets(tested, significant)
+
+        self._put(key, gene_sets, version)
+
+        return gene_sets
+
+
+def _document_prefix(version):
+    """The prefix of the hierarchy document files of a data version."""
+    digest = hashlib.sha1(version.encode("utf-8")).hexdigest()
+    return f"tree_{digest[:8]}_"
+
+
+def _write_atomic(filename, data):
+    """Write to a temporary file which is renamed, so that concurrent
+    workers never read partial files.
+
+    """
+    with tempfile.NamedTemporaryFile("wb", dir=path.dirname(filename),
+                                     suffix=".tmp", delete=False) as f:
+        f.write(data)
+    os.replace(f.name, filename)
+
+
+RESULT_STORE = ResultStore()
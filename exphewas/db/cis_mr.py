@@ -0,0 +1,181 @@
+"""
+Cis-MR over many genes (or many outcomes) using the PC effects from the model
+fits.
+
+The model fits are read as arrays of PC effects (without building
+DataFrames, see model_fits) and all the MR estimates are computed at once.
+"""
+
+import numpy as np
+from sqlalchemy import case
+
+from .model_fits import model_fit_pc_effects
+from .models import RESULTS_CLASS_MAP
+from .. import mr
+from ..utils import clamp_nlog10p
+
+
+# Number of model fits fetched at once from the database.
+FETCH_SIZE = 1000
+
+
+def _model_fit_columns(ModelFit):
+    """The binary model fit and the JSON one (only fetched when there is no
+    binary model fit).
+
+    """
+    return (
+        ModelFit.model_fit_bin,
+        case((ModelFit.model_fit_bin.is_(None), ModelFit.model_fit)),
+    )
+
+
+def iter_pc_effects(session, outcome, analysis_subset="BOTH",
+                    gene_iids=None):
+    """Iterate over the PC effects for the genes with results for an
+    outcome.
+
+    Yields (gene_iid, (terms, betas, standard errors)).
+
+    """
+    ModelFit = outcome.get_results_class(analysis_subset).model_fit_cls
+
+    query = session.query(ModelFit.gene_iid, *_model_fit_columns(ModelFit))\
+        .filter_by(outcome_iid=outcome.iid)
+
+    if gene_iids is not None:
+        query = query.filter(ModelFit.gene_iid.in_(gene_iids))
+
+    for gene_iid, model_fit_bin, model_fit in query.yield_per(FETCH_SIZE):
+        effects = model_fit_pc_effects(model_fit, model_fit_bin)
+        if effects is not None:
+            yield gene_iid, effects
+
+
+def iter_gene_pc_effects(session, gene_iid, analysis_subset="BOTH"):
+    """Iterate over the PC effects for every outcome with results for a
+    gene (from the model fit tables of all the analysis types).
+
+    Yields (outcome_iid, (terms, betas, standard errors)).
+
+    """
+    for Result in RESULTS_CLASS_MAP[analysis_subset].values():
+        ModelFit = Result.model_fit_cls
+
+        query = session.query(ModelFit.outcome_iid,
+                              *_model_fit_columns(ModelFit))\
+            .filter_by(gene_iid=gene_iid)
+
+        for outcome_iid, model_fit_bin, model_fit in \
+                query.yield_per(FETCH_SIZE):
+            effects = model_fit_pc_effects(model_fit, model_fit_bin)
+            if effects is not None:
+                yield outcome_iid, effects
+
+
+def _results_nlog10p(session, outcome, analysis_subset):
+    Result = outcome.get_results_class(analysis_subset)
+
+    return dict(
+        session.query(Result.gene_iid, Result.static_nlog10p)
+        .filter_by(outcome_iid=outcome.iid)
+    )
+
+
+def genome_wide_cis_mr(session, exposure, outcome, analysis_subset="BOTH",
+                       instrument_prune=True, alpha=0.05):
+    """IVW cis-MR of an exposure on an outcome for every gene.
+
+    Genes without results for both outcomes or without instruments (after
+    pruning) are excluded.
+
+    Returns a dict of arrays (gene_iid, ivw_beta, ivw_se, CI bounds,
+    wald_p, nlog10p, n_instruments and exposure_nlog10p) ranked by p-value.
+
+    """
+    exposure_fits = dict(iter_pc_effects(session, exposure, analysis_subset))
+
+    gene_iids = []
+    pairs = []
+    for gene_iid, y in iter_pc_effects(session, outcome, analysis_subset):
+        x = exposure_fits.get(gene_iid)
+        if x is not None:
+            gene_iids.append(gene_iid)
+            pairs.append((x, y))
+
+    _, x_beta, x_se, y_beta, y_se = mr.align_pc_effects(pairs)
+
+    results = mr.ivw(x_beta, x_se, y_beta, y_se, instrument_prune)
+    exposure_nlog10p = _results_nlog10p(session, exposure, analysis_subset)
+    exposure_nlog10p, _ = clamp_nlog10p(np.array(
+        [exposure_nlog10p.get(i, np.nan) for i in gene_iids], dtype=float
+    ))
+
+    return _ranked_results(
+        {"gene_iid": np.array(gene_iids, dtype=np.int64),
+         "exposure_nlog10p": exposure_nlog10p},
+        results, alpha,
+    )
+
+
+def phenome_wide_cis_mr(session, gene_iid, exposure, analysis_subset="BOTH",
+                        instrument_prune=True, alpha=0.05):
+    """IVW cis-MR of an exposure on every outcome for a gene.
+
+    The outcomes without instruments (after pruning) and the exposure itself
+    are excluded.
+
+    Returns a dict of arrays (outcome_iid, ivw_beta, ivw_se, CI bounds,
+    wald_p, nlog10p and n_instruments) ranked by p-value, or None if there
+    is no model fit for the exposure.
+
+    """
+    x = next(
+        iter_pc_effects(session, exposure, analysis_subset, [gene_iid]), None
+    )
+    if x is None:
+        return None
+
+    _, x = x
+
+    outcome_iids = []
+    pairs = []
+    for outcome_iid, y in iter_gene_pc_effects(session, gene_iid,
+                                               analysis_subset):
+        if outcome_iid != exposure.iid:
+            outcome_iids.append(outcome_iid)
+            pairs.append((x, y))
+
+    _, x_beta, x_se, y_beta, y_se = mr.align_pc_effects(pairs)
+
+    results = mr.ivw(x_beta, x_se, y_beta, y_se, instrument_prune)
+
+    return _ranked_results(
+        {"outcome_iid": np.array(outcome_iids, dtype=np.int64)},
+        results, alpha,
+    )
+
+
+def _ranked_results(columns, results, alpha):
+    """Add the IVW estimates to the columns, excluding the rows without
+    instruments and ranking by p-value.
+
+    """
+    ci_pct = str(int((1 - alpha) * 100))
+    lower, upper, p, nlog10p = mr.wald_test(results["beta"], results["se"],
+                                            alpha)
+
+    columns.update({
+        "ivw_beta": results["beta"],
+        "ivw_se": results["se"],
+        f"lower_ci{ci_pct}": lower,
+        f"upper_ci{ci_pct}": upper,
+        "wald_p": p,
+        "nlog10p": nlog10p,
+        "n_instruments": results["n_instruments"],
+    })
+
+    keep = np.flatnonzero(results["n_instruments"] > 0)
+    order = keep[np.argsort(-nlog10p[keep], kind="stable")]
+
+    return {name: col[order] for name, col in columns.items()}
@@ -0,0 +1,172 @@
+"""
+Storage of the model fits (effects of the terms of the augmented models).
+
+The model fits are imported as JSON tables, but only the effects (beta and
+standard error) of the PCs are used (e.g. for MR). They can also be stored
+in a compact binary layout (the model_fit_bin column):
+
+- header: magic (4 bytes), format version (uint8), 3 padding bytes, number
+  of PCs (uint32) and number of covariates (uint32).
+- float64 arrays: PC betas, PC standard errors, covariate betas and covariate
+  standard errors.
+- uint32 array: the PC numbers (e.g. 3 for XPC3).
+- the covariate names (utf-8, separated by newlines).
+
+Everything is little-endian and the float arrays are aligned, so they are
+read directly as NumPy arrays.
+"""
+
+import re
+import struct
+
+import numpy as np
+
+
+# Prefix of the PC terms in the model fits.
+PC_TERM_PREFIX = "XPC"
+
+PC_TERM_PAT = re.compile(r"^XPC(?P<pc>[0-9]+)$")
+
+MAGIC = b"EXMF"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sB3xII")
+
+
+def _fit_rows(model_fit):
+    """Iterate over the (term, beta, se) of a model fit (JSON).
+
+    Both the records (list of rows) and the columns (dict of columns)
+    orientations of the model fit table are supported.
+
+    """
+    if isinstance(model_fit, dict):
+        term_column = "term" if "term" in model_fit else "variable"
+        columns = [model_fit[term_column], model_fit["beta"], model_fit["se"]]
+
+        # DataFrame.to_dict() gives {column: {index: value}}.
+        if isinstance(columns[0], dict):
+            index = list(columns[0].keys())
+            columns = [[col[i] for i in index] for col in columns]
+
+        return zip(*columns)
+
+    term_column = "term" if any("term" in row for row in model_fit) \
+        else "variable"
+
+    return (
+        (row.get(term_column), row.get("beta"), row.get("se"))
+        for row in model_fit
+    )
+
+
+def _to_float(value):
+    return np.nan if value is None else value
+
+
+def pc_effects(model_fit):
+    """Get the PC effects from a model fit (JSON).
+
+    Returns the terms, betas and standard errors of the PCs.
+
+    """
+    terms, betas, ses = [], [], []
+    for term, beta, se in _fit_rows(model_fit):
+        if isinstance(term, str) and term.startswith(PC_TERM_PREFIX):
+            terms.append(term)
+            betas.append(_to_float(beta))
+            ses.append(_to_float(se))
+
+    return terms, np.array(betas, dtype=float), np.array(ses, dtype=float)
+
+
+def encode_model_fit(model_fit, covariates=True):
+    """Encode a model fit (JSON) in the binary layout.
+
+    Raises a ValueError if a PC term is not of the form XPC<number>.
+
+    """
+    pcs, pc_rows, covariate_names, covariate_rows = [], [], [], []
+    for term, beta, se in _fit_rows(model_fit):
+        effects = (_to_float(beta), _to_float(se))
+
+        if isinstance(term, str) and term.startswith(PC_TERM_PREFIX):
+            match = PC_TERM_PAT.match(term)
+            if match is None:
+                raise ValueError(f"{term}: unexpected PC term")
+
+            pcs.append(int(match.group("pc")))
+            pc_rows.append(effects)
+
+        elif covariates:
+            covariate_names.append(str(term))
+            covariate_rows.append(effects)
+
+    pc_rows = np.array(pc_rows, dtype="<f8").reshape(-1, 2)
+    covariate_rows = np.array(covariate_rows, dtype="<f8").reshape(-1, 2)
+
+    return b"".join([
+        HEADER.pack(MAGIC, FORMAT_VERSION, len(pcs), len(covariate_names)),
+        pc_rows.T.tobytes(),
+        covariate_rows.T.tobytes(),
+        np.array(pcs, dtype="<u4").tobytes(),
+        "\n".join(covariate_names).encode("utf-8"),
+    ])
+
+
+def _decode(data, covariates):
+    magic, version, n_pcs, n_cov = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Unsupported binary model fit.")
+
+    floats = np.frombuffer(data, dtype="<f8", count=2 * (n_pcs + n_cov),
+                           offset=HEADER.size)
+
+    offset = HEADER.size + floats.nbytes
+    pcs = np.frombuffer(data, dtype="<u4", count=n_pcs, offset=offset)
+
+    pc_beta, pc_se = floats[:n_pcs], floats[n_pcs:2 * n_pcs]
+    terms = [f"{PC_TERM_PREFIX}{pc}" for pc in pcs.tolist()]
+
+    if not covariates:
+        return terms, pc_beta, pc_se
+
+    names = bytes(data[offset + pcs.nbytes:]).decode("utf-8")
+    cov_terms = names.split("\n") if n_cov else []
+
+    return (
+        cov_terms + terms,
+        np.concatenate([floats[2 * n_pcs:2 * n_pcs + n_cov], pc_beta]),
+        np.concatenate([floats[2 * n_pcs + n_cov:], pc_se]),
+    )
+
+
+def decode_pc_effects(data):
+    """Get the PC terms, betas and standard errors from a binary model
+    fit.
+
+    """
+    return _decode(data, covariates=False)
+
+
+def decode_model_fit(data):
+    """Decode a binary model fit as records (the covariates first)."""
+    terms, betas, ses = _decode(data, covariates=True)
+
+    return [
+        {"term": term, "beta": beta, "se": se}
+        for term, beta, se in zip(terms, betas.tolist(), ses.tolist())
+    ]
+
+
+def model_fit_pc_effects(model_fit, model_fit_bin):
+    """Get the PC effects from the binary model fit (if available) or from
+    the JSON one. Returns None if there is no model fit.
+
+    """
+    if model_fit_bin is not None:
+        return decode_pc_effects(model_fit_bin)
+
+    if model_fit:
+        return pc_effects(model_fit)
+
+    return None
@@ -6,27 +6,34 @@ from collections import defaultdict
 from itertools import product
 
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
-from sqlalchemy.sql import literal, union
+from sqlalchemy.sql import literal, null, union, union_all
 from sqlalchemy.orm import relationship, foreign, joinedload, undefer
 from sqlalchemy import (
     Column, Integer, String, ForeignKey, Enum, Float, Boolean,
-    ForeignKeyConstraint, Date, JSON, and_, cast
+    ForeignKeyConstraint, Date, JSON, LargeBinary, and_, case, cast, exists,
+    false, func, or_, update
 )
 
-import scipy.stats
 import numpy as np
-import pandas as pd
 
 from .engine import Session
+from ..lazy import LazyModule
+from .model_fits import decode_model_fit
 from .utils import (
     ANALYSIS_SUBSETS, ANALYSIS_TYPES, _get_table_name, _get_class_name
 )
 
 
+# Only needed for some methods (e.g. model_fit_df).
+pd = LazyModule("pandas")
+scipy = LazyModule("scipy")
+
+
 AnalysisEnum = Enum(*ANALYSIS_TYPES, name="enum_analysis_type")
 SexSubsetEnum = Enum(*ANALYSIS_SUBSETS,
                      name="enum_sex_subset")
 BiotypeEnum = Enum("lincRNA", "protein_coding", name="enum_biotype")
+TestingScopeEnum = Enum("OUTCOME", "GENE", name="enum_testing_scope")
 
 
 Base = declarative_base()
@@ -85,6 +92,73 @@ class EnrichmentContingency(Base):
         }
 
 
+class MultipleTestingSummary(Base):
+    """Summary of the multiple testing correction for a set of results.
+
+    The OUTCOME scope is over all the results of an outcome (iid is the
+    outcome iid) and the GENE scope is over all the results of a gene across
+    analysis types (iid is the gene iid). Both are within an analysis subset.
+
+    """
+    __tablename__ = "multiple_testing_summary"
+
+    scope = Column(TestingScopeEnum, primary_key=True)
+    iid = Column(Integer, primary_key=True)
+    analysis_subset = Column(SexSubsetEnum, primary_key=True)
+
+    n_tests = Column(Integer, nullable=False)
+    pi0 = Column(Float)
+
+
+class SignificanceBitmap(Base):
+    """Genes with results (tested) and significant genes for an outcome.
+
+    The sets of genes are bitmaps where the bit i (in little bit order) is set
+    for the gene with iid i. They are computed with the multiple testing
+    statistics for the standard q-value thresholds.
+
+    """
+    __tablename__ = "significance_bitmap"
+
+    Q_THRESHOLDS = (0.01, 0.05, 0.1)
+
+    outcome_iid = Column(Integer, ForeignKey("outcomes.iid"), primary_key=True)
+    analysis_subset = Column(SexSubsetEnum, primary_key=True)
+    q_threshold = Column(Float, primary_key=True)
+
+    n_tested = Column(Integer, nullable=False)
+    n_significant = Column(Integer, nullable=False)
+
+    tested = Column(LargeBinary, nullable=False)
+    significant = Column(LargeBinary, nullable=False)
+
+    @staticmethod
+    def pack(gene_iids):
+        """Create a bitmap from gene iids."""
+        gene_iids = np.asarray(gene_iids, dtype=np.int64)
+
+        bits = np.zeros(gene_iids.max() + 1 if gene_iids.size else 0,
+                        dtype=bool)
+        bits[gene_iids] = True
+
+        return np.packbits(bits, bitorder="little").tobytes()
+
+    @staticmethod
+    def unpack(bitmap, n_bits):
+        """Get a boolean mask (indexed by gene iid) of n_bits from a
+        bitmap.
+
+        """
+        bits = np.unpackbits(np.frombuffer(bitmap, dtype=np.uint8),
+                             bitorder="little")
+
+        mask = np.zeros(n_bits, dtype=bool)
+        n = min(n_bits, bits.shape[0])
+        mask[:n] = bits[:n]
+
+        return mask
+
+
 class Hierarchy(Base):
     __tablename__ = "hierarchy"
 
@@ -182,19 +256,40 @@ class ModelFitMixin(object):
 
     @declared_attr
     def gene_iid(cls):
-        return Column(Integer, ForeignKey("genes.iid"), primary_key=True)
+        # The index is used by the gene-centric queries (e.g. the phenome
+        # cis-MR), as the gene is the second column of the primary key.
+        return Column(Integer, ForeignKey("genes.iid"), primary_key=True,
+                      index=True)
 
     def model_fit_df(self):
+        if self.model_fit is None and self.model_fit_bin is not None:
+            return pd.DataFrame(decode_model_fit(self.model_fit_bin))
+
         return pd.DataFrame(self.model_fit)
 
     @declared_attr
     def model_fit(cls):
         return Column(JSON)
 
+    # The model fit in a compact binary layout (see model_fits). The JSON
+    # model fit can be cleared once it is converted.
+    @declared_attr
+    def model_fit_bin(cls):
+        return Column(LargeBinary)
+
 
 class ResultMixin(object):
     static_nlog10p = Column(Float)
 
+    # Multiple testing statistics computed after the import (using the
+    # compute-statistics command). The q-value and Bonferroni corrected
+    # p-value are computed over all the results of the outcome and, for the
+    # "gene" ones, over all the results of the gene (all analysis types).
+    static_q = Column(Float)
+    static_bonf = Column(Float)
+    static_gene_q = Column(Float)
+    static_gene_bonf = Column(Float)
+
     # This is not a FK because the pair of (outcome_id, analysis_type) forms
     # the key, but analysis type is not stored in the DB for performance
     # reasons.
@@ -207,7 +302,10 @@ class ResultMixin(object):
 
     @declared_attr
     def gene_iid(cls):
-        return Column(Integer, ForeignKey("genes.iid"), primary_key=True)
+        # The index is used by the gene-centric queries (the gene is the
+        # second column of the primary key).
+        return Column(Integer, ForeignKey("genes.iid"), primary_key=True,
+                      index=True)
 
     @declared_attr
     def gene_obj(cls):
@@ -260,6 +358,10 @@ class ResultMixin(object):
 
 
 class ContinuousResult(ResultMixin):
+    # The columns specific to this type of results.
+    TYPE_COLUMNS = ["n", "rss_base", "rss_augmented",
+                    "n_params_base", "n_params_augmented"]
+
     n = Column(Integer, nullable=False)
 
     rss_base = Column(Float)
@@ -269,9 +371,7 @@ class ContinuousResult(ResultMixin):
 
     def to_object(self):
         o = super().to_object()
-        keys = ["n", "rss_base", "rss_augmented",
-                "n_params_base", "n_params_augmented"]
-        o.update({k: getattr(self, k) for k in keys})
+        o.update({k: getattr(self, k) for k in self.TYPE_COLUMNS})
         return o
 
     @staticmethod
@@ -320,6 +420,10 @@ class ContinuousResult(ResultMixin):
 
 
 class BinaryResult(ResultMixin):
+    # The columns specific to this type of results.
+    TYPE_COLUMNS = ["n_cases", "n_controls", "n_excluded_from_controls",
+                    "deviance_base", "deviance_augmented"]
+
     n_cases = Column(Integer)
     n_controls = Column(Integer)
     n_excluded_from_controls = Column(Integer, default=0)
@@ -329,9 +433,7 @@ class BinaryResult(ResultMixin):
 
     def to_object(self):
         o = super().to_object()
-        keys = ["n_cases", "n_controls", "n_excluded_from_controls",
-                "deviance_base", "deviance_augmented"]
-        o.update({k: getattr(self, k) for k in keys})
+        o.update({k: getattr(self, k) for k in self.TYPE_COLUMNS})
         return o
 
     def p(self):
@@ -543,12 +645,35 @@ def get_model_fit_class(analysis_type, analysis_subset="BOTH"):
     return MODEL_FIT_CLASS_MAP[analysis_subset][analysis_type]
 
 
-def all_results_union(session, cols=None):
+def _result_column(cls, col):
+    """Get a labeled column from a results class.
+
+    Columns that only exist for other types of results (e.g. n_cases for
+    continuous variables) are typed NULLs.
+
+    """
+    if hasattr(cls, col):
+        return getattr(cls, col).label(col)
+
+    for other_cls in (ContinuousResult, BinaryResult):
+        if hasattr(other_cls, col):
+            return cast(null(), getattr(other_cls, col).type).label(col)
+
+    raise ValueError(f"{col}: not a valid results column")
+
+
+def all_results_union(session, cols=None, gene_iid=None, analysis_types=None,
+                      analysis_subsets=None, distinct=True, gene_iids=None):
     """Returns a sqlalchemy query unioning the binary and continuous results.
 
     By default, this only uses outcome_id, analysis_type and analysis_subset.
     Note that analysis subset always get added to the list of columns.
 
+    The results can be restricted to a gene or a list of genes (which uses
+    the gene_iid index of every results table) and to some analysis types and
+    subsets. If distinct is False, a UNION ALL is used and duplicated rows
+    are kept.
+
     """
     if cols is None:
         cols = ["outcome_iid"]
@@ -563,11 +688,120 @@ def all_results_union(session, cols=None):
 
     # The binary and continuous variables
     for analysis_subset, d in RESULTS_CLASS_MAP.items():
+        if analysis_subsets is not None and \
+                analysis_subset not in analysis_subsets:
+            continue
+
         for analysis_type, cls in d.items():
-            queries.append(session.query(
-                *[getattr(cls, col).label(col) for col in cols],
+            if analysis_types is not None and \
+                    analysis_type not in analysis_types:
+                continue
+
+            query = session.query(
+                *[_result_column(cls, col) for col in cols],
                 cast(literal(analysis_type).label("analysis_type"), AnalysisEnum),
                 cast(literal(analysis_subset).label("analysis_subset"), SexSubsetEnum),
-            ).distinct())
+            )
+
+            if gene_iid is not None:
+                query = query.filter(cls.gene_iid == gene_iid)
+
+            if gene_iids is not None:
+                query = query.filter(cls.gene_iid.in_(gene_iids))
+
+            if distinct:
+                query = query.distinct()
+
+            queries.append(query)
+
+    if distinct:
+        return union(*queries)
+
+    return union_all(*queries)
+
+
+def _has_results_expression():
+    """True for the genes with at least one row in any results table."""
+    return or_(*[
+        exists().where(Result.gene_iid == Gene.iid)
+        for Result in RESULTS_CLASSES
+    ])
+
+
+def update_has_results(session, gene_iids=None):
+    """Set has_results for all the genes (or only the given genes).
+
+    This is a single UPDATE (with an EXISTS over the gene_iid index of every
+    results table) which only writes the rows where the flag changes.
+    Returns the number of updated genes. The session is not committed.
 
-    return union(*queries)
+    """
+    has_results = _has_results_expression()
+
+    stmt = update(Gene)\
+        .where(Gene.has_results.is_distinct_from(has_results))\
+        .values(has_results=has_results)\
+        .execution_options(synchronize_session=False)
+
+    if gene_iids is not None:
+        stmt = stmt.where(Gene.iid.in_(list(gene_iids)))
+
+    return session.execute(stmt).rowcount
+
+
+def clear_has_results(session):
+    """Set has_results to False for all the genes.
+
+    Returns the number of updated genes. The session is not committed.
+
+    """
+    stmt = update(Gene)\
+        .where(Gene.has_results.isnot(False))\
+        .values(has_results=false())\
+        .execution_options(synchronize_session=False)
+
+    return session.execute(stmt).rowcount
+
+
+def count_has_results(session):
+    """The number of genes with has_results set."""
+    return session.query(func.count(Gene.iid))\
+        .filter(Gene.has_results.is_(True))\
+        .scalar()
+
+
+def query_gene_results(session, gene_iid, cols, analysis_types=None,
+                       analysis_subsets=None):
+    """Query the results of a gene in a single round trip.
+
+    The results of all the analysis types (and subsets) are unioned and
+    joined once with the outcomes. The query returns plain tuples with the
+    requested results columns, the analysis type and subset and the outcome
+    id and label, in the order of ANALYSIS_SUBSETS and ANALYSIS_TYPES.
+
+    """
+    results = all_results_union(
+        session, ["outcome_iid"] + list(cols), gene_iid=gene_iid,
+        analysis_types=analysis_types, analysis_subsets=analysis_subsets,
+        distinct=False,
+    ).subquery()
+
+    return session.query(
+        *[results.c[col] for col in cols],
+        results.c.analysis_type,
+        results.c.analysis_subset,
+        Outcome.id,
+        Outcome.label,
+    )\
+        .join(Outcome, Outcome.iid == results.c.outcome_iid)\
+        .order_by(_position(results.c.analysis_subset, ANALYSIS_SUBSETS),
+                  _position(results.c.analysis_type, ANALYSIS_TYPES),
+                  results.c.outcome_iid)
+
+
+def _position(col, values):
+    """Order by the position of the values in a list (e.g. ANALYSIS_TYPES)
+    instead of alphabetically.
+
+    """
+    return case({value: i for i, value in enumerate(values)}, value=col)
@@ -0,0 +1,72 @@
+"""Genome-wide cis-MR of an exposure on an outcome (ranked table of genes)."""
+
+import csv
+import sys
+import time
+
+import numpy as np
+from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
+
+from ..engine import Session
+from ..models import Outcome, Gene
+from ..cis_mr import genome_wide_cis_mr
+
+
+# cis-mr-scan --exposure-id --exposure-type --outcome-id --outcome-type
+#             --analysis-subset --disable-pruning --output
+def main(args):
+    session = Session()
+
+    exposure = _get_outcome(session, args.exposure_id, args.exposure_type)
+    outcome = _get_outcome(session, args.outcome_id, args.outcome_type)
+
+    start = time.time()
+    results = genome_wide_cis_mr(
+        session, exposure, outcome, args.analysis_subset,
+        instrument_prune=not args.disable_pruning,
+    )
+
+    genes = dict(
+        (iid, (ensembl_id, name)) for iid, ensembl_id, name in
+        session.query(Gene.iid, Gene.ensembl_id, Gene.name)
+    )
+
+    gene_iids = results.pop("gene_iid")
+    columns = list(results.keys())
+
+    f = sys.stdout if args.output is None else open(args.output, "w")
+    try:
+        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+        writer.writerow(["gene", "gene_name"] + columns)
+
+        for i, gene_iid in enumerate(gene_iids.tolist()):
+            row = list(genes[gene_iid])
+            row.extend(_format(results[col][i]) for col in columns)
+            writer.writerow(row)
+
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+    print(f"Computed cis-MR estimates for {gene_iids.shape[0]} gene(s) in "
+          f"{time.time() - start:.1f}s.", file=sys.stderr)
+
+
+def _get_outcome(session, id, analysis_type):
+    filters = {"id": id}
+    if analysis_type is not None:
+        filters["analysis_type"] = analysis_type
+
+    try:
+        return session.query(Outcome).filter_by(**filters).one()
+    except NoResultFound:
+        raise ValueError(f"Could not find outcome '{id}'.")
+    except MultipleResultsFound:
+        raise ValueError(f"There are multiple outcomes with id='{id}' (use "
+                         "the analysis type to disambiguate).")
+
+
+def _format(value):
+    if isinstance(value, np.floating):
+        return repr(float(value))
+    return value
@@ -6,14 +6,24 @@ import os
 import functools
 from collections import defaultdict
 
-import pandas as pd
-
 from ..engine import ENGINE, Session
 from ..models import Base, ANALYSIS_TYPES
 from .. import models
 from ..tree import tree_from_hierarchies
+from ...lazy import LazyModule
+
+
+# The commands only import what they need.
+pd = LazyModule("pandas")
 
-from . import import_ensembl, import_results, import_external, metadata
+import_ensembl = LazyModule(".import_ensembl", __package__)
+import_results = LazyModule(".import_results", __package__)
+import_external = LazyModule(".import_external", __package__)
+metadata = LazyModule(".metadata", __package__)
+statistics = LazyModule(".statistics", __package__)
+has_results = LazyModule(".has_results", __package__)
+cis_mr_scan = LazyModule(".cis_mr_scan", __package__)
+convert_model_fits = LazyModule(".convert_model_fits", __package__)
 
 
 def create():
@@ -417,6 +427,94 @@ def main():
         type=int,
     )
 
+    parser_import_results.add_argument(
+        "--no-json-model-fits",
+        action="store_true",
+        help="Only store the model fits in the binary layout (the PCs and "
+             "covariates effects)."
+    )
+
+    # Command to convert the JSON model fits to the binary layout.
+    parser_convert_model_fits = subparsers.add_parser("convert-model-fits")
+    parser_convert_model_fits.add_argument(
+        "--batch-size",
+        help="Number of model fits converted per transaction "
+             "[%(default)s].",
+        default=5000,
+        type=int,
+    )
+
+    parser_convert_model_fits.add_argument(
+        "--no-covariates",
+        action="store_true",
+        help="Only keep the effects of the PCs."
+    )
+
+    parser_convert_model_fits.add_argument(
+        "--clear-json",
+        action="store_true",
+        help="Remove the JSON model fits which have a binary model fit. "
+             "Other columns of the model fit tables (e.g. p-values) are "
+             "lost."
+    )
+
+    # Command to set the has_results flag of the genes.
+    parser_update_has_results = subparsers.add_parser("update-has-results")
+    parser_update_has_results.add_argument(
+        "--clear",
+        action="store_true",
+        help="Set has_results to false for all the genes instead of "
+             "recomputing it."
+    )
+
+    # Command to compute the multiple testing statistics (after import).
+    parser_compute_statistics = subparsers.add_parser("compute-statistics")
+    parser_compute_statistics.add_argument(
+        "--full",
+        action="store_true",
+        help="Recompute the statistics for all outcomes and genes instead of "
+             "only the ones with missing statistics (e.g. newly imported "
+             "results)."
+    )
+
+    parser_compute_statistics.add_argument(
+        "--n-jobs",
+        help="Number of results tables processed in parallel "
+             "[%(default)s].",
+        default=4,
+        type=int,
+    )
+
+    # Command to run cis-MR for an exposure and an outcome over all genes.
+    parser_cis_mr_scan = subparsers.add_parser("cis-mr-scan")
+    parser_cis_mr_scan.add_argument("--exposure-id", required=True)
+    parser_cis_mr_scan.add_argument(
+        "--exposure-type",
+        help="Analysis type of the exposure (if the ID is ambiguous).",
+        choices=ANALYSIS_TYPES,
+    )
+    parser_cis_mr_scan.add_argument("--outcome-id", required=True)
+    parser_cis_mr_scan.add_argument(
+        "--outcome-type",
+        help="Analysis type of the outcome (if the ID is ambiguous).",
+        choices=ANALYSIS_TYPES,
+    )
+    parser_cis_mr_scan.add_argument(
+        "--analysis-subset",
+        default="BOTH",
+        choices=["BOTH", "FEMALE_ONLY", "MALE_ONLY"]
+    )
+    parser_cis_mr_scan.add_argument(
+        "--disable-pruning",
+        action="store_true",
+        help="Use all the PCs as instruments (instead of the ones with a "
+             "significant effect on the exposure)."
+    )
+    parser_cis_mr_scan.add_argument(
+        "--output",
+        help="Output filename (tab separated) [stdout].",
+    )
+
     parser_import_external = subparsers.add_parser("import-external")
     parser_import_external.add_argument(
         "--external-db", help="The external databases", required=True,
@@ -451,6 +549,18 @@ def main():
     elif args.command == "import-results":
         return import_results.main(args)
 
+    elif args.command == "compute-statistics":
+        return statistics.main(args)
+
+    elif args.command == "update-has-results":
+        return has_results.main(args)
+
+    elif args.command == "convert-model-fits":
+        return convert_model_fits.main(args)
+
+    elif args.command == "cis-mr-scan":
+        return cis_mr_scan.main(args)
+
     elif args.command == "import-n-pcs":
         return import_n_pcs(args)
 
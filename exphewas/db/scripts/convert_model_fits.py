@@ -0,0 +1,100 @@
+"""Convert the JSON model fits to the binary layout (see model_fits).
+
+The model fits are converted in batches (by primary key) and only the rows
+without a binary model fit are processed, so the conversion can be resumed.
+
+"""
+
+import json
+import sys
+import time
+
+from sqlalchemy import and_, or_, null
+
+from ..engine import Session
+from ..models import MODEL_FIT_CLASSES
+from ..model_fits import encode_model_fit
+
+
+# convert-model-fits --batch-size --no-covariates --clear-json
+def main(args):
+    start = time.time()
+    session = Session()
+
+    for ModelFit in MODEL_FIT_CLASSES:
+        convert_model_fits(session, ModelFit, args.batch_size,
+                           not args.no_covariates)
+
+        if args.clear_json:
+            n = session.query(ModelFit)\
+                .filter(ModelFit.model_fit_bin.isnot(None))\
+                .update({ModelFit.model_fit: null()},
+                        synchronize_session=False)
+            session.commit()
+
+            print(f"{ModelFit.__tablename__}: cleared {n} JSON model fit(s).",
+                  file=sys.stderr)
+
+    print(f"Converted the model fits in {time.time() - start:.1f}s.")
+
+
+def convert_model_fits(session, ModelFit, batch_size, covariates=True):
+    n_converted = 0
+    n_failed = 0
+    json_bytes = 0
+    bin_bytes = 0
+
+    last = None
+    while True:
+        query = session.query(
+            ModelFit.outcome_iid, ModelFit.gene_iid, ModelFit.model_fit
+        )\
+            .filter(ModelFit.model_fit_bin.is_(None))\
+            .filter(ModelFit.model_fit.isnot(None))
+
+        if last is not None:
+            query = query.filter(or_(
+                ModelFit.outcome_iid > last[0],
+                and_(ModelFit.outcome_iid == last[0],
+                     ModelFit.gene_iid > last[1]),
+            ))
+
+        rows = query\
+            .order_by(ModelFit.outcome_iid, ModelFit.gene_iid)\
+            .limit(batch_size)\
+            .all()
+
+        if not rows:
+            break
+
+        mappings = []
+        for outcome_iid, gene_iid, model_fit in rows:
+            # JSON 'null' values.
+            if model_fit is None:
+                continue
+
+            try:
+                model_fit_bin = encode_model_fit(model_fit, covariates)
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"{ModelFit.__tablename__}: could not convert the "
+                      f"model fit for outcome_iid={outcome_iid} and "
+                      f"gene_iid={gene_iid} ({e}).", file=sys.stderr)
+                n_failed += 1
+                continue
+
+            mappings.append({"outcome_iid": outcome_iid,
+                             "gene_iid": gene_iid,
+                             "model_fit_bin": model_fit_bin})
+
+            json_bytes += len(json.dumps(model_fit))
+            bin_bytes += len(model_fit_bin)
+
+        session.bulk_update_mappings(ModelFit, mappings)
+        session.commit()
+
+        n_converted += len(mappings)
+        last = rows[-1][:2]
+
+    print(f"{ModelFit.__tablename__}: converted {n_converted} model fit(s) "
+          f"({json_bytes} bytes of JSON to {bin_bytes} bytes), "
+          f"{n_failed} failed.", file=sys.stderr)
@@ -0,0 +1,35 @@
+"""Maintain the has_results flag of the genes.
+
+A gene has results if it has at least one row in any of the results tables.
+The flag is updated with set-based UPDATE statements (see
+models.update_has_results), for all the genes or only for some of them (e.g.
+the genes of an import).
+
+"""
+
+import sys
+import time
+
+from ..engine import Session
+from ..models import clear_has_results, count_has_results, update_has_results
+
+
+# update-has-results --clear
+def main(args):
+    session = Session()
+
+    before = count_has_results(session)
+    start = time.time()
+
+    if args.clear:
+        n_updated = clear_has_results(session)
+    else:
+        n_updated = update_has_results(session)
+
+    session.commit()
+    elapsed = time.time() - start
+
+    after = count_has_results(session)
+
+    print(f"Genes with results: {before} before, {after} after "
+          f"({n_updated} updated in {elapsed:.2f}s).", file=sys.stderr)
@@ -8,9 +8,10 @@ import pandas as pd
 import numpy as np
 
 from ..engine import Session
+from ..model_fits import encode_model_fit
 from ..models import (
     Gene, Outcome, ContinuousResult, BinaryResult, get_results_class,
-    get_model_fit_class,
+    get_model_fit_class, update_has_results,
 )
 from ...utils import load_ukbphewas_model, load_variable_labels
 from ..utils import ANALYSIS_TYPES, ANALYSIS_SUBSETS
@@ -40,7 +41,8 @@ def main(args):
 
     # Get n_pcs
     session = Session()
-    n_pcs = session.query(Gene).filter_by(ensembl_id=gene).one().n_pcs
+    gene_obj = session.query(Gene).filter_by(ensembl_id=gene).one()
+    n_pcs = gene_obj.n_pcs
 
     # By default, analysis kept only 40 PCs
     n_pcs = min(n_pcs, args.max_n_pcs)
@@ -91,11 +93,12 @@ def main(args):
             objects[row.analysis_type][o["analysis_subset"]].append(o)
 
             # Adding the model fit
+            model_fit = models[(row["analysis_type"], row["variable_id"])]
             model_fit_objects[row.analysis_type][o["analysis_subset"]].append(
                 dict(
                     outcome_id=o["outcome_id"],
                     gene=gene,
-                    model_fit=models[(row["analysis_type"], row["variable_id"])],
+                    **_model_fit_columns(model_fit, args.no_json_model_fits)
                 )
             )
 
@@ -114,9 +117,28 @@ def main(args):
             model_fit_class = get_model_fit_class(analysis_type, sex_subset)
             session.bulk_insert_mappings(model_fit_class, to_insert)
 
+    # Only this gene can have new results.
+    update_has_results(session, [gene_obj.iid])
+
     session.commit()
 
 
+def _model_fit_columns(model_fit, no_json=False):
+    """The JSON and binary model fits (the JSON one is kept if the model fit
+    can't be converted).
+
+    """
+    try:
+        model_fit_bin = encode_model_fit(model_fit)
+    except ValueError:
+        return {"model_fit": model_fit}
+
+    if no_json:
+        return {"model_fit_bin": model_fit_bin}
+
+    return {"model_fit": model_fit, "model_fit_bin": model_fit_bin}
+
+
 def _compute_nlog10p(result_class, o, n_pcs):
     if issubclass(result_class, ContinuousResult):
         return ContinuousResult.nlog10p_primitive(
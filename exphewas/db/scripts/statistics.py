@@ -0,0 +1,266 @@
+"""Compute the multiple testing statistics after results are imported.
+
+The q-values, Bonferroni corrected p-values and pi0 estimates only change
+when results are imported. They are computed once (per outcome and per gene,
+within each analysis subset) and stored next to the static -log10(p) instead
+of being computed for every API request.
+
+The sets of significant genes for every outcome are also stored as bitmaps
+(at standard q-value thresholds) for the set operations of the API.
+
+By default, only the outcomes and genes with missing statistics (e.g. with
+newly imported results) are processed.
+
+"""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ..engine import Session
+from ..models import (
+    RESULTS_CLASSES, RESULTS_CLASS_MAP, MultipleTestingSummary,
+    SignificanceBitmap,
+)
+from ..utils import ANALYSIS_SUBSETS
+from ...utils import clamp_nlog10p, qvalue_batch
+
+
+# Number of outcomes (or genes) processed in a single transaction.
+CHUNK_SIZE = 100
+
+
+# compute-statistics --full --n-jobs
+def main(args):
+    start = time.time()
+
+    with ThreadPoolExecutor(max_workers=args.n_jobs) as executor:
+        # The outcome statistics are independent for every results table.
+        _wait_all(
+            executor.submit(_in_session, compute_outcome_statistics, Result,
+                            args.full)
+            for Result in RESULTS_CLASSES
+        )
+
+        # The gene statistics span all the tables of an analysis subset.
+        # They are computed after the outcome statistics so that concurrent
+        # transactions never update the same rows.
+        _wait_all(
+            executor.submit(_in_session, compute_gene_statistics,
+                            analysis_subset, args.full)
+            for analysis_subset in ANALYSIS_SUBSETS
+        )
+
+    print(f"Computed statistics in {time.time() - start:.1f}s.")
+
+
+def compute_outcome_statistics(Result, full=False):
+    """Compute the statistics over the results of every outcome."""
+    session = Session()
+
+    q = session.query(Result.outcome_iid).distinct()
+    outcome_iids = {row[0] for row in q}
+
+    if not full:
+        # Outcomes with new results or without significance bitmaps.
+        missing = {
+            row[0] for row in q.filter(Result.static_q.is_(None))
+        }
+
+        with_bitmaps = {
+            row[0] for row in
+            session.query(SignificanceBitmap.outcome_iid)
+            .filter_by(analysis_subset=Result.analysis_subset)
+            .distinct()
+        }
+
+        outcome_iids = missing | (outcome_iids - with_bitmaps)
+
+    outcome_iids = sorted(outcome_iids)
+
+    for chunk in _chunks(outcome_iids, CHUNK_SIZE):
+        rows = session.query(
+            Result.outcome_iid, Result.gene_iid, Result.static_nlog10p
+        ).filter(Result.outcome_iid.in_(chunk)).all()
+
+        outcome_iid, gene_iid, nlog10p = _to_arrays(rows)
+        order, keys, ms, pi0s, qs, bonfs = _multiple_testing(outcome_iid,
+                                                             nlog10p)
+
+        session.bulk_update_mappings(Result, [
+            {"outcome_iid": o, "gene_iid": g, "static_q": q,
+             "static_bonf": bonf}
+            for o, g, q, bonf in zip(
+                outcome_iid[order].tolist(), gene_iid[order].tolist(),
+                qs.tolist(), bonfs.tolist(),
+            )
+        ])
+
+        _save_summaries(session, "OUTCOME", Result.analysis_subset, keys, ms,
+                        pi0s)
+        _save_bitmaps(session, Result.analysis_subset, keys, ms,
+                      gene_iid[order], qs)
+        session.commit()
+
+    print(f"{Result.__tablename__}: computed statistics for "
+          f"{len(outcome_iids)} outcome(s).", file=sys.stderr)
+
+
+def compute_gene_statistics(analysis_subset, full=False):
+    """Compute the statistics over the results of every gene.
+
+    For a gene, all the analysis types are considered together.
+
+    """
+    session = Session()
+    classes = list(RESULTS_CLASS_MAP[analysis_subset].values())
+
+    gene_iids = set()
+    for Result in classes:
+        q = session.query(Result.gene_iid).distinct()
+        if not full:
+            q = q.filter(Result.static_gene_q.is_(None))
+
+        gene_iids.update(row[0] for row in q)
+
+    for chunk in _chunks(sorted(gene_iids), CHUNK_SIZE):
+        class_idx = []
+        rows = []
+        for i, Result in enumerate(classes):
+            cur = session.query(
+                Result.outcome_iid, Result.gene_iid, Result.static_nlog10p
+            ).filter(Result.gene_iid.in_(chunk)).all()
+
+            class_idx.extend([i] * len(cur))
+            rows.extend(cur)
+
+        outcome_iid, gene_iid, nlog10p = _to_arrays(rows)
+        order, keys, ms, pi0s, qs, bonfs = _multiple_testing(gene_iid,
+                                                             nlog10p)
+
+        outcome_iid = outcome_iid[order]
+        gene_iid = gene_iid[order]
+        class_idx = np.array(class_idx, dtype=int)[order]
+
+        for i, Result in enumerate(classes):
+            mask = class_idx == i
+            session.bulk_update_mappings(Result, [
+                {"outcome_iid": o, "gene_iid": g, "static_gene_q": q,
+                 "static_gene_bonf": bonf}
+                for o, g, q, bonf in zip(
+                    outcome_iid[mask].tolist(), gene_iid[mask].tolist(),
+                    qs[mask].tolist(), bonfs[mask].tolist(),
+                )
+            ])
+
+        _save_summaries(session, "GENE", analysis_subset, keys, ms, pi0s)
+        session.commit()
+
+    print(f"{analysis_subset}: computed statistics for {len(gene_iids)} "
+          f"gene(s).", file=sys.stderr)
+
+
+def _multiple_testing(keys, nlog10ps):
+    """Compute the q-values and Bonferroni p-values within groups of keys.
+
+    Returns the order sorting the results by key, the unique keys with their
+    number of tests and pi0 estimates, and the q-values and Bonferroni
+    corrected p-values (in sorted order).
+
+    """
+    order = np.argsort(keys, kind="stable")
+    _, ps = clamp_nlog10p(nlog10ps[order])
+
+    keys, starts, ms = np.unique(keys[order], return_index=True,
+                                 return_counts=True)
+
+    qs, pi0s = qvalue_batch(np.split(ps, starts[1:]), return_pi0=True)
+    qs = np.concatenate(qs)
+    bonfs = ps * np.repeat(ms, ms)
+
+    return order, keys, ms, pi0s, qs, bonfs
+
+
+def _save_summaries(session, scope, analysis_subset, iids, ms, pi0s):
+    """Replace the multiple testing summaries for the iids."""
+    iids = iids.tolist()
+
+    session.query(MultipleTestingSummary)\
+        .filter_by(scope=scope, analysis_subset=analysis_subset)\
+        .filter(MultipleTestingSummary.iid.in_(iids))\
+        .delete(synchronize_session=False)
+
+    session.bulk_insert_mappings(MultipleTestingSummary, [
+        {"scope": scope, "iid": iid, "analysis_subset": analysis_subset,
+         "n_tests": m, "pi0": pi0}
+        for iid, m, pi0 in zip(iids, ms.tolist(), pi0s.tolist())
+    ])
+
+
+def _save_bitmaps(session, analysis_subset, outcome_iids, ms, gene_iids,
+                  qs):
+    """Replace the significance bitmaps for the outcomes.
+
+    The gene iids and q-values are grouped by outcome (in the order of the
+    outcome iids) and ms are the group sizes.
+
+    """
+    session.query(SignificanceBitmap)\
+        .filter_by(analysis_subset=analysis_subset)\
+        .filter(SignificanceBitmap.outcome_iid.in_(outcome_iids.tolist()))\
+        .delete(synchronize_session=False)
+
+    starts = np.cumsum(ms)[:-1]
+    bitmaps = []
+    for outcome_iid, genes, outcome_qs in zip(
+        outcome_iids.tolist(), np.split(gene_iids, starts),
+        np.split(qs, starts),
+    ):
+        tested = SignificanceBitmap.pack(genes)
+
+        for q_threshold in SignificanceBitmap.Q_THRESHOLDS:
+            significant = genes[outcome_qs < q_threshold]
+
+            bitmaps.append({
+                "outcome_iid": outcome_iid,
+                "analysis_subset": analysis_subset,
+                "q_threshold": q_threshold,
+                "n_tested": genes.shape[0],
+                "n_significant": significant.shape[0],
+                "tested": tested,
+                "significant": SignificanceBitmap.pack(significant),
+            })
+
+    session.bulk_insert_mappings(SignificanceBitmap, bitmaps)
+
+
+def _to_arrays(rows):
+    """Convert (outcome_iid, gene_iid, nlog10p) rows to arrays."""
+    outcome_iid = np.array([row[0] for row in rows], dtype=np.int64)
+    gene_iid = np.array([row[1] for row in rows], dtype=np.int64)
+    nlog10p = np.array(
+        [np.nan if row[2] is None else row[2] for row in rows],
+        dtype=float
+    )
+
+    return outcome_iid, gene_iid, nlog10p
+
+
+def _chunks(values, size):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _in_session(f, *args):
+    """Run a function in a worker thread with its own session."""
+    try:
+        return f(*args)
+    finally:
+        Session.remove()
+
+
+def _wait_all(futures):
+    for future in list(futures):
+        future.result()
@@ -3,16 +3,25 @@ Utilities to process hierarchical data.
 
 tree = tree_from_hierarchy_id("ICD10")
 
+Hierarchies can also be held in a compact (immutable) preorder layout for
+aggregations over subtrees and O(1) ancestor/descendant queries:
+
+tree = CompactTree.from_node(tree_from_hierarchy_id("ICD10"))
+
 """
 
 import collections
 
+import numpy as np
 
 from .models import Hierarchy
 from .engine import Session
 
 
 class Node(object):
+    __slots__ = ("is_root", "parent", "children", "code", "description",
+                 "_data", "_depth")
+
     def __init__(self):
         self.is_root = False
 
@@ -22,6 +31,7 @@ class Node(object):
         self.code = None
         self.description = None
         self._data = None
+        self._depth = None
 
     def __repr__(self):
         parent_code = self.parent.code if self.parent else None
@@ -35,23 +45,46 @@ class Node(object):
                       len(self.children))
         )
 
+    @property
+    def depth(self):
+        """Depth of the node (0 for the root), computed once (i.e. the tree
+        should not be modified afterwards).
+
+        """
+        if self._depth is None:
+            # Walk up to the first node with a known depth.
+            path = [self]
+            while path[-1].parent is not None and path[-1]._depth is None:
+                path.append(path[-1].parent)
+
+            top = path.pop()
+            if top._depth is None:
+                top._depth = 0
+
+            for node in reversed(path):
+                node._depth = node.parent._depth + 1
+
+        return self._depth
+
     def iter_depth_first(self, level=0):
         """Depths first tree traversal rooted at this node."""
-        if level > 0:
-            yield level, self
-
-        for child in self.children:
-            yield from child.iter_depth_first(level + 1)
+        stack = [(level, self)]
+        while stack:
+            cur_level, node = stack.pop()
+            if cur_level > 0:
+                yield cur_level, node
 
+            # Reversed to visit the children in order.
+            stack.extend(
+                (cur_level + 1, child) for child in reversed(node.children)
+            )
 
     def iter_parents(self):
         """Returns the chain of parents up to the root."""
-        if self.parent is None:
-            return
-
-        else:
-            yield self.parent
-            yield from self.parent.iter_parents()
+        node = self.parent
+        while node is not None:
+            yield node
+            node = node.parent
 
     def search_one(self, predicate):
         """Search for the first occurence verifying the predicate in the
@@ -87,18 +120,26 @@ class Node(object):
 
     def to_primitive(self):
         """Converts a tree into a nested dict representation."""
-
-        out = {
-            "code": self.code if not self.is_root else "root",
-            "description": self.description if self.description else "",
-            "data": self._data,
-        }
-
-        for child in self.children:
-            if "children" not in out:
-                out["children"] = []
-
-            out["children"].append(child.to_primitive())
+        def _primitive(node):
+            return {
+                "code": node.code if not node.is_root else "root",
+                "description": node.description if node.description else "",
+                "data": node._data,
+            }
+
+        out = _primitive(self)
+
+        # Iterative to support deep hierarchies.
+        stack = [(self, out)]
+        while stack:
+            node, node_out = stack.pop()
+            if node.children:
+                node_out["children"] = []
+
+            for child in node.children:
+                child_out = _primitive(child)
+                node_out["children"].append(child_out)
+                stack.append((child, child_out))
 
         return out
 
@@ -150,6 +191,275 @@ def tree_from_hierarchies(hierarchies, keep_hierarchy=False):
     return root
 
 
+class CompactTree(object):
+    """A tree held as arrays in preorder (depth first) order.
+
+    The root is at index 0 and the subtree of the node i is the range
+    [i, end[i]) (i.e. its Euler tour interval), so descendant checks are
+    O(1). parent is -1 for the root and the depth of the root is 0.
+
+    Nodes can be accessed through views implementing the Node API
+    (e.g. tree.root().iter_depth_first()).
+
+    """
+    def __init__(self, codes, descriptions, parent, end, depth, data=None):
+        self.codes = codes
+        self.descriptions = descriptions
+        self.parent = parent
+        self.end = end
+        self.depth = depth
+        self.data = data
+
+        # The first node (in preorder) for every code.
+        self._index = {}
+        for i, code in enumerate(codes):
+            self._index.setdefault(code, i)
+
+    @classmethod
+    def from_node(cls, root, keep_data=False):
+        codes, descriptions, parent, depth = [], [], [], []
+        data = [] if keep_data else None
+
+        stack = [(root, -1, 0)]
+        while stack:
+            node, parent_idx, level = stack.pop()
+
+            i = len(codes)
+            codes.append(node.code)
+            descriptions.append(node.description)
+            parent.append(parent_idx)
+            depth.append(level)
+
+            if keep_data:
+                data.append(node._data)
+
+            # Reversed to visit the children in order.
+            for child in reversed(node.children):
+                stack.append((child, i, level + 1))
+
+        # The end of a subtree is the largest end of its children (nodes are
+        # processed bottom-up, from the end of the preorder).
+        end = list(range(1, len(codes) + 1))
+        for i in range(len(codes) - 1, 0, -1):
+            if end[i] > end[parent[i]]:
+                end[parent[i]] = end[i]
+
+        return cls(codes, descriptions, np.array(parent, dtype=np.int64),
+                   np.array(end, dtype=np.int64),
+                   np.array(depth, dtype=np.int64), data)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def find(self, code):
+        """Get the index of a code (None if it is not in the tree)."""
+        return self._index.get(code)
+
+    def root(self):
+        return NodeView(self, 0)
+
+    def node(self, code):
+        """Get the view of a node from its code (None if not found)."""
+        i = self.find(code)
+        return None if i is None else NodeView(self, i)
+
+    def children(self, i):
+        """Get the indices of the children of a node."""
+        children = []
+
+        j = i + 1
+        while j < self.end[i]:
+            children.append(j)
+            j = int(self.end[j])
+
+        return children
+
+    def is_descendant(self, i, j):
+        """Whether the node(s) i are in the subtree of j (vectorized)."""
+        return (j <= i) & (i < self.end[j])
+
+    def _levels(self, reverse=False):
+        """Non root nodes grouped by depth."""
+        order = np.argsort(-self.depth[1:] if reverse else self.depth[1:],
+                           kind="stable") + 1
+
+        return np.split(
+            order, np.flatnonzero(np.diff(self.depth[order])) + 1
+        )
+
+    def subtree_min(self, values):
+        """Get the minimum of the values (aligned with the nodes) in the
+        subtree of every node. Missing values are NaN.
+
+        """
+        out = np.array(values, dtype=float)
+
+        for nodes in self._levels(reverse=True):
+            np.fmin.at(out, self.parent[nodes], out[nodes])
+
+        return out
+
+    def ancestor_paths(self):
+        """Get the paths from the root for all the nodes.
+
+        Returns a (n_nodes, max_depth) array where the row i holds the
+        indices of the ancestors of i (excluding the root) and i itself,
+        padded with -1.
+
+        """
+        paths = np.full((len(self), int(self.depth.max(initial=0))), -1,
+                        dtype=np.int64)
+
+        for nodes in self._levels():
+            if nodes.size == 0:
+                continue
+
+            paths[nodes] = paths[self.parent[nodes]]
+            paths[nodes, self.depth[nodes] - 1] = nodes
+
+        return paths
+
+    def formatted_ancestors(self, sep=" > "):
+        """Node.formatted_ancestors for all the nodes (the root is '')."""
+        labels = [
+            code if description is None else description
+            for code, description in zip(self.codes, self.descriptions)
+        ]
+
+        return [
+            sep.join(labels[j] for j in path if j >= 0)
+            for path in self.ancestor_paths().tolist()
+        ]
+
+    def to_primitive(self, data=None, index=0, root_code="root"):
+        """Converts the (sub)tree into a nested dict representation (like
+        Node.to_primitive), with data aligned with the nodes.
+
+        """
+        if data is None:
+            data = self.data
+
+        start, end = index, int(self.end[index])
+        parents = self.parent[start:end].tolist()
+
+        nodes = {}
+        for i in range(start, end):
+            description = self.descriptions[i]
+            out = {
+                "code": self.codes[i] if i > 0 else root_code,
+                "description": description if description else "",
+                "data": data[i] if data is not None else None,
+            }
+            nodes[i] = out
+
+            if i > start:
+                nodes[parents[i - start]].setdefault("children", [])\
+                    .append(out)
+
+        return nodes[start]
+
+
+class NodeView(object):
+    """A node of a CompactTree with the Node API."""
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    def __eq__(self, other):
+        return (isinstance(other, NodeView) and self.tree is other.tree and
+                self.index == other.index)
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
+
+    def __repr__(self):
+        if self.is_root:
+            return "<Root Node>"
+
+        parent = self.parent
+
+        return (
+            "<Node '{}' - `{}` [parent is '{}' | {} children]>"
+            "".format(self.code, self.description, parent.code,
+                      len(self.children))
+        )
+
+    @property
+    def is_root(self):
+        return self.index == 0
+
+    @property
+    def code(self):
+        return self.tree.codes[self.index]
+
+    @property
+    def description(self):
+        return self.tree.descriptions[self.index]
+
+    @property
+    def _data(self):
+        return None if self.tree.data is None else self.tree.data[self.index]
+
+    @property
+    def depth(self):
+        return int(self.tree.depth[self.index])
+
+    @property
+    def parent(self):
+        parent = self.tree.parent[self.index]
+        return None if parent < 0 else NodeView(self.tree, int(parent))
+
+    @property
+    def children(self):
+        return [NodeView(self.tree, i) for i in self.tree.children(self.index)]
+
+    def is_descendant_of(self, other):
+        return bool(self.tree.is_descendant(self.index, other.index))
+
+    def iter_depth_first(self, level=0):
+        """Depths first tree traversal rooted at this node."""
+        if level > 0:
+            yield level, self
+
+        offset = level - self.depth
+        for i in range(self.index + 1, int(self.tree.end[self.index])):
+            yield int(self.tree.depth[i]) + offset, NodeView(self.tree, i)
+
+    def iter_parents(self):
+        """Returns the chain of parents up to the root."""
+        node = self.parent
+        while node is not None:
+            yield node
+            node = node.parent
+
+    def search_one(self, predicate):
+        for _, n in self.iter_depth_first():
+            if predicate(n):
+                return n
+
+        return None
+
+    def search_all(self, predicate):
+        return filter(predicate, self.iter_depth_first())
+
+    def formatted_ancestors(self, sep=" > "):
+        # Walk up the parent array (excluding the root).
+        tree = self.tree
+        labels = []
+        i = self.index
+        while i > 0:
+            labels.append(tree.codes[i] if tree.descriptions[i] is None
+                          else tree.descriptions[i])
+            i = int(tree.parent[i])
+
+        return sep.join(labels[::-1])
+
+    def to_primitive(self):
+        return self.tree.to_primitive(index=self.index)
+
+
 def tree_from_hierarchy_id(id):
     hierarchies = Session()\
         .query(Hierarchy)\
@@ -0,0 +1,55 @@
+"""
+Deferred imports of the heavy dependencies (e.g. pandas and scipy).
+
+Importing the backend or the CLI should not pay for modules which are only
+needed by some endpoints or commands:
+
+pd = LazyModule("pandas")
+scipy = LazyModule("scipy")
+
+The module is imported on the first attribute access (e.g. pd.read_csv).
+Submodules are imported when they are accessed as attributes (e.g.
+scipy.stats).
+"""
+
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """A module imported on first use.
+
+    Relative names are resolved from package (see importlib.import_module).
+
+    """
+    def __init__(self, name, package=None):
+        super().__init__(name)
+        self.__dict__["_lazy_target"] = (name, package)
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            module = importlib.import_module(*self.__dict__["_lazy_target"])
+            self.__dict__["_lazy_module"] = module
+
+        return module
+
+    def __getattr__(self, attr):
+        module = self._load()
+
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            # Submodules which are not imported by their package.
+            return importlib.import_module(f"{module.__name__}.{attr}")
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        name, package = self.__dict__["_lazy_target"]
+        if package is not None:
+            name = package + name
+
+        return f"<lazy module '{name}'>"
@@ -0,0 +1,337 @@
+"""
+Mendelian randomization (MR) using the gene principal components (PCs) as
+instruments.
+
+The estimators work on batches: the effects of the PCs on the exposure (x)
+and on the outcome (y) are (n_batch, n_pcs) arrays where missing PCs (e.g.
+for genes with fewer PCs) are NaN. Every estimator returns a dict of arrays
+with one value per row ("beta", "se" and "n_instruments" at least).
+
+- ivw: inverse variance weighted estimator.
+- egger: MR-Egger regression (at least 3 instruments).
+- weighted_median: weighted median of the ratio estimates (use bootstrap
+  for its standard error).
+
+Bootstrap standard errors and confidence intervals are computed for whole
+batches with parametric draws of the PC effects.
+"""
+
+import numpy as np
+
+from .lazy import LazyModule
+
+
+scipy = LazyModule("scipy")
+
+
+# Instruments with no marginally significant effect on the exposure are
+# pruned (chi2 statistic with 1 df at 0.05).
+INSTRUMENT_CHI2_THRESHOLD = 3.841459
+
+# Maximum number of values drawn at once for the bootstrap (the batch is
+# split in chunks to bound the memory usage).
+BOOTSTRAP_MAX_DRAWS = 2 ** 23
+
+
+def _as_2d(*arrays):
+    return [np.atleast_2d(np.asarray(a, dtype=float)) for a in arrays]
+
+
+def align_pc_effects(pairs):
+    """Align the exposure and outcome PC effects by term.
+
+    pairs is a sequence of (x_effects, y_effects), each as (terms, betas,
+    standard errors).
+
+    Returns the terms of every row and the x_beta, x_se, y_beta and y_se
+    arrays (n_pairs, max_n_terms), padded with NaN.
+
+    """
+    row_terms = []
+    for (x_terms, _, _), (y_terms, _, _) in pairs:
+        x_terms_set = set(x_terms)
+        terms = list(x_terms)
+        terms.extend(term for term in y_terms if term not in x_terms_set)
+        row_terms.append(terms)
+
+    n_terms = max((len(terms) for terms in row_terms), default=0)
+    arrays = np.full((4, len(pairs), n_terms), np.nan)
+
+    for i, (terms, (x, y)) in enumerate(zip(row_terms, pairs)):
+        for j, (cur_terms, betas, ses) in enumerate((x, y)):
+            if list(cur_terms) == terms[:len(cur_terms)]:
+                cols = np.arange(len(cur_terms))
+            else:
+                index = {term: k for k, term in enumerate(terms)}
+                cols = np.array([index[term] for term in cur_terms],
+                                dtype=int)
+
+            arrays[2 * j, i, cols] = betas
+            arrays[2 * j + 1, i, cols] = ses
+
+    x_beta, x_se, y_beta, y_se = arrays
+    return row_terms, x_beta, x_se, y_beta, y_se
+
+
+def instrument_mask(x_beta, x_se, y_beta, y_se, instrument_prune=True):
+    """Get the mask of the PCs used as instruments.
+
+    PCs need effects on both the exposure and the outcome. If
+    instrument_prune is set, the PCs without a significant effect on the
+    exposure are excluded.
+
+    """
+    mask = (np.isfinite(x_beta) & np.isfinite(x_se) &
+            np.isfinite(y_beta) & np.isfinite(y_se))
+
+    if instrument_prune:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mask &= (x_beta / x_se) ** 2 >= INSTRUMENT_CHI2_THRESHOLD
+
+    return mask
+
+
+def _prepare(x_beta, x_se, y_beta, y_se, instrument_prune, mask):
+    x_beta, x_se, y_beta, y_se = _as_2d(x_beta, x_se, y_beta, y_se)
+
+    if mask is None:
+        mask = instrument_mask(x_beta, x_se, y_beta, y_se, instrument_prune)
+    else:
+        mask = np.broadcast_to(mask, x_beta.shape)
+
+    return x_beta, x_se, y_beta, y_se, mask
+
+
+def ivw(x_beta, x_se, y_beta, y_se, instrument_prune=True, mask=None):
+    """Compute the IVW estimates.
+
+    The standard errors use the first order approximation (Burgess 2013,
+    Genetic Epi.). The instruments are given by the mask or selected with
+    instrument_mask.
+
+    Also returns the instrument mask and the IVW weights (NaN for the PCs
+    which are not used). The estimates are NaN without instruments.
+
+    """
+    x_beta, x_se, y_beta, y_se, mask = _prepare(
+        x_beta, x_se, y_beta, y_se, instrument_prune, mask
+    )
+
+    # The IVW weight is only valid under relevance, but if we filter out PCs
+    # with a null effect, then we're subject to Winner's curse.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precisions = np.where(mask, y_se ** -2, 0)
+        x_beta = np.where(mask, x_beta, 0)
+        y_beta = np.where(mask, y_beta, 0)
+
+        denum = np.sum(x_beta ** 2 * precisions, axis=1)
+        beta = np.sum(x_beta * y_beta * precisions, axis=1) / denum
+        se = np.sqrt(1 / denum)
+
+        weights = np.where(
+            mask, precisions / np.sum(precisions, axis=1, keepdims=True),
+            np.nan
+        )
+
+    n_instruments = np.sum(mask, axis=1)
+    beta[n_instruments == 0] = np.nan
+    se[n_instruments == 0] = np.nan
+
+    return {
+        "beta": beta,
+        "se": se,
+        "n_instruments": n_instruments,
+        "mask": mask,
+        "weights": weights,
+    }
+
+
+def egger(x_beta, x_se, y_beta, y_se, instrument_prune=True, mask=None):
+    """Compute the MR-Egger estimates.
+
+    The outcome effects are regressed on the exposure effects (oriented to
+    be positive) with an intercept, weighting by the outcome precisions. As
+    in the MendelianRandomization R package, the standard errors are scaled
+    by the residual standard error when it is larger than 1.
+
+    Returns the slope ("beta" and "se"), the intercept ("intercept" and
+    "intercept_se") and the residual standard error ("sigma"). The estimates
+    are NaN with less than 3 instruments.
+
+    """
+    x_beta, x_se, y_beta, y_se, mask = _prepare(
+        x_beta, x_se, y_beta, y_se, instrument_prune, mask
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sign = np.where(x_beta < 0, -1, 1)
+        x = np.where(mask, x_beta * sign, 0)
+        y = np.where(mask, y_beta * sign, 0)
+        w = np.where(mask, y_se ** -2, 0)
+
+        sw = np.sum(w, axis=1)
+        sx = np.sum(w * x, axis=1)
+        sy = np.sum(w * y, axis=1)
+        sxx = np.sum(w * x ** 2, axis=1)
+        sxy = np.sum(w * x * y, axis=1)
+
+        det = sw * sxx - sx ** 2
+        slope = (sw * sxy - sx * sy) / det
+        intercept = (sxx * sy - sx * sxy) / det
+
+        n_instruments = np.sum(mask, axis=1)
+        residuals = y - intercept[:, None] - slope[:, None] * x
+        sigma = np.sqrt(
+            np.sum(w * residuals ** 2, axis=1) / (n_instruments - 2)
+        )
+
+        scale = np.fmax(sigma, 1)
+        se = np.sqrt(sw / det) * scale
+        intercept_se = np.sqrt(sxx / det) * scale
+
+    results = {
+        "beta": slope,
+        "se": se,
+        "intercept": intercept,
+        "intercept_se": intercept_se,
+        "sigma": sigma,
+    }
+
+    for values in results.values():
+        values[n_instruments < 3] = np.nan
+
+    results["n_instruments"] = n_instruments
+    return results
+
+
+def weighted_median(x_beta, x_se, y_beta, y_se, instrument_prune=True,
+                    mask=None):
+    """Compute the weighted median estimates (Bowden 2016, Genetic Epi.).
+
+    The ratio estimates are weighted by their first order inverse variance.
+    The standard errors ("se") are NaN: they are estimated by bootstrap.
+
+    """
+    x_beta, x_se, y_beta, y_se, mask = _prepare(
+        x_beta, x_se, y_beta, y_se, instrument_prune, mask
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # The unused PCs are sorted last with a null weight.
+        ratios = np.where(mask, y_beta / x_beta, np.inf)
+        weights = np.where(mask, (x_beta / y_se) ** 2, 0)
+
+        order = np.argsort(ratios, axis=1, kind="stable")
+        ratios = np.take_along_axis(ratios, order, axis=1)
+        weights = np.take_along_axis(weights, order, axis=1)
+
+        weights /= np.sum(weights, axis=1, keepdims=True)
+        cum_weights = np.cumsum(weights, axis=1) - weights / 2
+
+    n_instruments = np.sum(mask, axis=1)
+
+    # Interpolation between the ratio estimates around the median (the
+    # unused PCs have a cumulative weight of 1).
+    n_below = np.sum(cum_weights < 0.5, axis=1)
+    below = np.clip(n_below - 1, 0, ratios.shape[1] - 1)
+    above = np.clip(n_below, 0, ratios.shape[1] - 1)
+
+    rows = np.arange(ratios.shape[0])
+    r_below, r_above = ratios[rows, below], ratios[rows, above]
+    p_below, p_above = cum_weights[rows, below], cum_weights[rows, above]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        beta = np.where(
+            n_below > 0,
+            r_below + (r_above - r_below) * (0.5 - p_below) /
+            (p_above - p_below),
+            r_above,
+        )
+
+    beta[n_instruments == 0] = np.nan
+
+    return {
+        "beta": beta,
+        "se": np.full(beta.shape, np.nan),
+        "n_instruments": n_instruments,
+    }
+
+
+ESTIMATORS = {
+    "ivw": ivw,
+    "egger": egger,
+    "weighted_median": weighted_median,
+}
+
+
+def bootstrap(estimator, x_beta, x_se, y_beta, y_se, n_boot=1000,
+              alpha=0.05, instrument_prune=True, seed=None):
+    """Bootstrap standard errors and percentile confidence intervals.
+
+    The PC effects are drawn from normal distributions (parametric
+    bootstrap) for the whole batch at once. The instruments are selected on
+    the observed effects and kept fixed.
+
+    Returns the standard deviation of the estimates ("se") and the bounds
+    of the confidence interval ("lower" and "upper").
+
+    """
+    if isinstance(estimator, str):
+        estimator = ESTIMATORS[estimator]
+
+    x_beta, x_se, y_beta, y_se = _as_2d(x_beta, x_se, y_beta, y_se)
+    mask = instrument_mask(x_beta, x_se, y_beta, y_se, instrument_prune)
+
+    rng = np.random.default_rng(seed)
+
+    n, k = x_beta.shape
+    chunk_size = max(1, BOOTSTRAP_MAX_DRAWS // max(1, 2 * n_boot * k))
+
+    se = np.full(n, np.nan)
+    lower = np.full(n, np.nan)
+    upper = np.full(n, np.nan)
+
+    for start in range(0, n, chunk_size):
+        cur = slice(start, start + chunk_size)
+        m = x_beta[cur].shape[0]
+
+        # The replicates are stacked as (n_boot * m, k) arrays where the row
+        # b * m + i is the replicate b of the row i.
+        idx = np.tile(np.arange(m), n_boot)
+        boot_mask = mask[cur][idx]
+
+        def _draw(beta, se):
+            beta = np.where(mask[cur], beta[cur], 0)
+            se = np.where(mask[cur], se[cur], 0)
+            return rng.normal(beta, se, size=(n_boot, m, k)).reshape(-1, k)
+
+        estimates = estimator(
+            _draw(x_beta, x_se), x_se[cur][idx],
+            _draw(y_beta, y_se), y_se[cur][idx],
+            mask=boot_mask,
+        )["beta"].reshape(n_boot, m)
+
+        with np.errstate(invalid="ignore"):
+            se[cur] = np.nanstd(estimates, axis=0, ddof=1)
+            lower[cur], upper[cur] = np.nanquantile(
+                estimates, [alpha / 2, 1 - alpha / 2], axis=0
+            )
+
+    return {"se": se, "lower": lower, "upper": upper}
+
+
+def wald_test(beta, se, alpha=0.05):
+    """Get the confidence intervals (at level 1 - alpha), the p-values and
+    the -log10(p) of Wald tests.
+
+    """
+    z = scipy.stats.norm.ppf(alpha / 2)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        wald = np.abs(beta / se)
+
+    # 2 * pnorm(-abs(wald)) and its log (to rank tiny p-values)
+    p = 2 * scipy.stats.norm.cdf(-wald)
+    nlog10p = -(np.log(2) + scipy.stats.norm.logcdf(-wald)) / np.log(10)
+
+    return beta + z * se, beta - z * se, p, nlog10p
@@ -6,21 +6,27 @@ import gzip
 import json
 import csv
 
-import pandas as pd
 import numpy as np
-import scipy.stats
-from scipy.interpolate import UnivariateSpline
 
-from pkg_resources import resource_filename
+from . import mr
+from .lazy import LazyModule
 
 
-__all__ = ["load_gtex_median_tpm", "load_gtex_statistics"]
+pd = LazyModule("pandas")
+interpolate = LazyModule("scipy.interpolate")
+pkg_resources = LazyModule("pkg_resources")
+
+
+__all__ = ["load_gtex_median_tpm", "load_gtex_statistics", "qvalue",
+           "qvalue_batch"]
 
 
 def load_gtex_median_tpm():
     """Loads the GTEx data in a DataFrame"""
     fn = "GTEx_Analysis_2017-06-05_v8_RNASeQCv1.1.9_gene_median_tpm.gct.gz"
-    fn = resource_filename(__name__, path.join("backend", "data", fn))
+    fn = pkg_resources.resource_filename(
+        __name__, path.join("backend", "data", fn)
+    )
 
     # Skipping the first two lines
     df = pd.read_csv(fn, sep="\t", skiprows=2)
@@ -38,7 +44,9 @@ def load_gtex_median_tpm():
 def load_gtex_statistics():
     """Loads the GTEx statistics (number of sample per tissue type)."""
     fn = "GTEx_Current_Release.csv.gz"
-    fn = resource_filename(__name__, path.join("backend", "data", fn))
+    fn = pkg_resources.resource_filename(
+        __name__, path.join("backend", "data", fn)
+    )
 
     # Reading with pandas because it's simpler
     df = pd.read_csv(fn).set_index("Tissue", verify_integrity=True)
@@ -49,7 +57,9 @@ def load_gtex_statistics():
 def load_variable_labels():
     """Load the label for UKBPheWAS IDs."""
     fn = "variable_labels.csv.gz"
-    fn = resource_filename(__name__, path.join("db", "scripts", "data", fn))
+    fn = pkg_resources.resource_filename(
+        __name__, path.join("db", "scripts", "data", fn)
+    )
 
     labels = {}
     meta = pd.read_csv(fn)
@@ -89,63 +99,58 @@ def load_ukbphewas_model(filename, as_dict=False, fit_df=True):
 def one_sample_ivw_mr(x_model, y_model, alpha=None, instrument_prune=True):
     """Compute the IVW estimate of the effect of X on Y using PCs as IVs.
 
+    The model fits are DataFrames (see exphewas.mr for the batched
+    estimators).
+
     """
-    def _prep_df(df, label):
+    def _pc_effects(df):
         term_column = "term" if "term" in df.columns else "variable"
-        cols = [term_column, "beta", "se"]
 
-        # Keep only PCs and the relevant columns.
-        df = df.loc[df[term_column].str.startswith("XPC"), cols].copy()
-        df = df.set_index(term_column)
-        df.columns = [f"{label}_beta", f"{label}_se"]
-        return df
+        terms, betas, ses = [], [], []
+        for term, beta, se in zip(df[term_column].tolist(),
+                                  df["beta"].tolist(), df["se"].tolist()):
+            if isinstance(term, str) and term.startswith("XPC"):
+                terms.append(term)
+                betas.append(beta)
+                ses.append(se)
 
-    x = _prep_df(x_model, "x")
-    y = _prep_df(y_model, "y")
-    df = pd.concat((x, y), axis=1)
+        return terms, np.array(betas, dtype=float), np.array(ses, dtype=float)
 
-    # If instrument prune, we drop PCs with no marginally significant effect
-    # on the exposure.
-    # Based on the chi2 statistic at 0.05.
-    if instrument_prune:
-        df["pruned"] = (df["x_beta"] / df["x_se"]) ** 2 < 3.841459
-    else:
-        df["pruned"] = False
+    (terms, ), x_beta, x_se, y_beta, y_se = mr.align_pc_effects(
+        [(_pc_effects(x_model), _pc_effects(y_model))]
+    )
 
-    analysis_df = df.loc[~df["pruned"], :]
+    results = mr.ivw(x_beta, x_se, y_beta, y_se, instrument_prune)
 
-    if analysis_df.shape[0] == 0:
+    if results["n_instruments"][0] == 0:
         raise ValueError("No relevant instrument after pruning.")
 
-    # The IVW weight is only valid under relevance, but if we filter out PCs
-    # with a null effect, then we're subject to Winner's curse.
-    precisions = analysis_df["y_se"] ** -2
-    df.loc[~df["pruned"], "ivw_weight"] = precisions / np.sum(precisions)
-    ivw_denum = np.sum(analysis_df["x_beta"] ** 2 * precisions)
-    ivw = (
-        np.sum(analysis_df["x_beta"] * analysis_df["y_beta"] * precisions) /
-        ivw_denum
-    )
-
-    # We use the first order approximation as in Burgess 2013 (Genetic Epi.)
-    # for now.
-    se = np.sqrt(1 / ivw_denum)
+    # If instrument prune, we drop PCs with no marginally significant effect
+    # on the exposure (as reported in the summary statistics).
+    with np.errstate(invalid="ignore"):
+        pruned = (
+            (x_beta[0] / x_se[0]) ** 2 < mr.INSTRUMENT_CHI2_THRESHOLD
+            if instrument_prune else np.zeros(len(terms), dtype=bool)
+        )
 
     summary_stats = []
-    for i, row in df.iterrows():
+    for i, term in enumerate(terms):
         d = {
-            "term": i,
-            "exposure_beta": row.x_beta,
-            "exposure_se": row.x_se,
-            "outcome_beta": row.y_beta,
-            "outcome_se": row.y_se,
-            "pruned": row.pruned
+            "term": term,
+            "exposure_beta": float(x_beta[0, i]),
+            "exposure_se": float(x_se[0, i]),
+            "outcome_beta": float(y_beta[0, i]),
+            "outcome_se": float(y_se[0, i]),
+            "pruned": bool(pruned[i]),
         }
-        if not np.isnan(row.ivw_weight):
-            d["weight"] = row.ivw_weight
+        if results["mask"][0, i]:
+            d["weight"] = float(results["weights"][0, i])
 
         summary_stats.append(d)
 
+    ivw = float(results["beta"][0])
+    se = float(results["se"][0])
+
     out = {
         "ivw_beta": ivw,
         "ivw_se": se,
@@ -153,49 +158,129 @@ def one_sample_ivw_mr(x_model, y_model, alpha=None, instrument_prune=True):
     }
 
     if alpha:
-        z = scipy.stats.norm.ppf(alpha / 2)
-        ci_pct = str(int((1 - alpha) * 100))
-        out[f"lower_ci{ci_pct}"] = ivw + z * se
-        out[f"upper_ci{ci_pct}"] = ivw - z * se
+        lower, upper, p, _ = mr.wald_test(ivw, se, alpha)
 
-        # 2 * pnorm(-abs(wald))
-        out["wald_p"] = 2 * scipy.stats.norm.cdf(-np.abs(ivw / se))
+        ci_pct = str(int((1 - alpha) * 100))
+        out[f"lower_ci{ci_pct}"] = lower
+        out[f"upper_ci{ci_pct}"] = upper
+        out["wald_p"] = p
 
     return out
 
 
-def _pi_0(ps, l=0.5):
-    return np.sum(ps > l) / (ps.shape[0] * (1 - l))
+def clamp_nlog10p(nlog10ps):
+    """Clamp -log10(p) values (in place) at 500 (including non finite ones).
+
+    Returns the clamped values and the corresponding p-values.
+
+    """
+    # We clamp everything at 10^-500
+    nlog10ps[~np.isfinite(nlog10ps) | (nlog10ps >= 500)] = 500
+
+    return nlog10ps, 10 ** -nlog10ps
 
 
-def qvalue(ps):
-    # Implementation of qvalue as described in Storey, Tibshirani (2003) PNAS
-    # https://www.pnas.org/content/pnas/100/16/9440.full.pdf
-    idx = np.argsort(ps)
-    ps = ps[idx]
-    m = ps.shape[0]
+# Same range as original in paper.
+QVALUE_LAMBDAS = np.arange(0.01, 0.96, 0.01)
 
-    # Same range as original in paper.
-    l = np.arange(0.01, 0.96, 0.01)
-    pi0s = np.empty(l.shape[0])
 
-    # Calculate pi hat for different values of lambda.
-    for i, cur_l in enumerate(l):
-        pi0s[i] = _pi_0(ps, cur_l)
+def _pi_0(sorted_ps, m):
+    """Estimate pi0 (using the spline) from sorted p-values.
+
+    The p-values need to be sorted in increasing order. Only the first m
+    values are used (the remaining ones are padding).
+
+    """
+    # Number of p-values greater than each lambda, using a single search in
+    # the sorted p-values.
+    n_greater = m - np.searchsorted(sorted_ps[:m], QVALUE_LAMBDAS,
+                                    side="right")
+    pi0s = n_greater / (m * (1 - QVALUE_LAMBDAS))
 
     # Fit spline.
-    spline = UnivariateSpline(x=l, y=pi0s, k=3)
+    spline = interpolate.UnivariateSpline(x=QVALUE_LAMBDAS, y=pi0s, k=3)
 
     # Predicted pi0 when lambda -> 1
-    pi0 = spline(1)
+    return float(spline(1))
 
-    qs = np.empty(m, dtype=float)
-    qs[-1] = pi0 * ps[-1]
 
-    for i in reversed(range(m - 1)):
-        qs[i] = np.minimum(
-            pi0 * m * ps[i] / (i + 1),
-            qs[i + 1]
-        )
+def _qvalue_2d(ps, ms):
+    """Compute the q-values for every row of a 2D array.
+
+    The first ms[i] values of the row i are used, and the remaining ones are
+    ignored (padding). Returns the q-values and the pi0 estimates.
+
+    """
+    idx = np.argsort(ps, axis=1, kind="stable")
+    sorted_ps = np.take_along_axis(ps, idx, axis=1)
+
+    n_rows, n_cols = ps.shape
+
+    # The padding is set to +inf so that it is last after sorting and it
+    # doesn't affect the cumulative minimum.
+    is_padding = np.arange(n_cols) >= ms[:, np.newaxis]
+    sorted_ps[is_padding] = np.inf
+
+    pi0s = np.full(n_rows, np.nan)
+    for i in range(n_rows):
+        if ms[i] > 0:
+            pi0s[i] = _pi_0(sorted_ps[i], ms[i])
+
+    # q_i = min_{j >= i} pi0 * m * p_j / j (as a reversed cumulative minimum)
+    ranks = np.arange(1, n_cols + 1)
+    qs = (pi0s * ms)[:, np.newaxis] * sorted_ps / ranks
+    qs[is_padding] = np.inf
+    qs = np.minimum.accumulate(qs[:, ::-1], axis=1)[:, ::-1]
+
+    # Back to the original order.
+    out = np.empty_like(qs)
+    np.put_along_axis(out, idx, qs, axis=1)
+
+    return out, pi0s
+
+
+def qvalue(ps, return_pi0=False):
+    """Compute the q-values for a vector of p-values.
+
+    Implementation of qvalue as described in Storey, Tibshirani (2003) PNAS
+    https://www.pnas.org/content/pnas/100/16/9440.full.pdf
+
+    """
+    ps = np.asarray(ps, dtype=float)
+
+    qs, pi0s = _qvalue_2d(ps[np.newaxis, :], np.array([ps.shape[0]]))
+
+    if return_pi0:
+        return qs[0], pi0s[0]
+
+    return qs[0]
+
+
+def qvalue_batch(ps, return_pi0=False):
+    """Compute the q-values for many vectors of p-values at once.
+
+    The p-values are either a 2D array (one row per vector, e.g. one row per
+    outcome), or a sequence of 1D arrays with different lengths. The q-values
+    are returned in the same format.
+
+    """
+    if isinstance(ps, np.ndarray) and ps.ndim == 2:
+        qs, pi0s = _qvalue_2d(ps.astype(float),
+                              np.full(ps.shape[0], ps.shape[1]))
+
+    else:
+        # Ragged vectors are padded into a 2D array.
+        vectors = [np.asarray(v, dtype=float) for v in ps]
+        ms = np.array([v.shape[0] for v in vectors], dtype=int)
+
+        padded = np.full((len(vectors), max(ms, default=0)), np.inf)
+        for i, v in enumerate(vectors):
+            padded[i, :ms[i]] = v
+
+        qs, pi0s = _qvalue_2d(padded, ms)
+        qs = [qs[i, :m] for i, m in enumerate(ms)]
+
+    if return_pi0:
+        return qs, pi0s
 
-    return qs[np.argsort(idx)]
+    return qs
@@ -0,0 +1,92 @@
+-- Columns for the multiple testing statistics computed after the import
+-- (exphewas-db compute-statistics).
+begin;
+
+alter table results_both_phecodes
+    add column if not exists static_q float8,
+    add column if not exists static_bonf float8,
+    add column if not exists static_gene_q float8,
+    add column if not exists static_gene_bonf float8;
+
+alter table results_female_phecodes
+    add column if not exists static_q float8,
+    add column if not exists static_bonf float8,
+    add column if not exists static_gene_q float8,
+    add column if not exists static_gene_bonf float8;
+
+alter table results_male_phecodes
+    add column if not exists static_q float8,
+    add column if not exists static_bonf float8,
+    add column if not exists static_gene_q float8,
+    add column if not exists static_gene_bonf float8;
+
+alter table results_both_continuous_variables
+    add column if not exists static_q float8,
+    add column if not exists static_bonf float8,
+    add column if not exists static_gene_q float8,
+    add column if not exists static_gene_bonf float8;
+
+alter table results_female_continuous_variables
+    add column if not exists static_q float8,
+    add column if not exists static_bonf float8,
+    add column if not exists static_gene_q float8,
+    add column if not exists static_gene_bonf float8;
+
+alter table results_male_continuous_variables
+    add column if not exists static_q float8,
+    add column if not exists static_bonf float8,
+    add column if not exists static_gene_q float8,
+    add column if not exists static_gene_bonf float8;
+
+alter table results_both_self_reported
+    add column if not exists static_q float8,
+    add column if not exists static_bonf float8,
+    add column if not exists static_gene_q float8,
+    add column if not exists static_gene_bonf float8;
+
+alter table results_female_self_reported
+    add column if not exists static_q float8,
+    add column if not exists static_bonf float8,
+    add column if not exists static_gene_q float8,
+    add column if not exists static_gene_bonf float8;
+
+alter table results_male_self_reported
+    add column if not exists static_q float8,
+    add column if not exists static_bonf float8,
+    add column if not exists static_gene_q float8,
+    add column if not exists static_gene_bonf float8;
+
+alter table results_both_cv_endpoints
+    add column if not exists static_q float8,
+    add column if not exists static_bonf float8,
+    add column if not exists static_gene_q float8,
+    add column if not exists static_gene_bonf float8;
+
+alter table results_female_cv_endpoints
+    add column if not exists static_q float8,
+    add column if not exists static_bonf float8,
+    add column if not exists static_gene_q float8,
+    add column if not exists static_gene_bonf float8;
+
+alter table results_male_cv_endpoints
+    add column if not exists static_q float8,
+    add column if not exists static_bonf float8,
+    add column if not exists static_gene_q float8,
+    add column if not exists static_gene_bonf float8;
+
+do $$ begin
+    create type enum_testing_scope as enum ('OUTCOME', 'GENE');
+exception
+    when duplicate_object then null;
+end $$;
+
+create table if not exists multiple_testing_summary (
+    scope enum_testing_scope not null,
+    iid integer not null,
+    analysis_subset enum_sex_subset not null,
+    n_tests integer not null,
+    pi0 float8,
+    constraint multiple_testing_summary_pkey
+        primary key (scope, iid, analysis_subset)
+);
+commit;
\ No newline at end of file
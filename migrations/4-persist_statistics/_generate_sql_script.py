@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+
+import exphewas.db.models
+
+from jinja2 import Template
+
+
+RESULTS_TABLES = [
+    i.__tablename__ for i in exphewas.db.models.RESULTS_CLASSES
+]
+
+
+with open("persist_statistics_template.jsql", "rt") as f:
+    sql_template = f.read()
+
+with open("4-persist_statistics.sql", "wt") as f:
+    f.write(Template(sql_template).render(result_tables=RESULTS_TABLES))
@@ -0,0 +1,15 @@
+-- Index on gene_iid for the gene-centric queries (the gene is the second
+-- column of the primary key). For partitioned tables, existing equivalent
+-- indexes on the partitions (see 3-partition_phecodes) are attached.
+create index if not exists ix_results_both_phecodes_gene_iid on results_both_phecodes (gene_iid);
+create index if not exists ix_results_female_phecodes_gene_iid on results_female_phecodes (gene_iid);
+create index if not exists ix_results_male_phecodes_gene_iid on results_male_phecodes (gene_iid);
+create index if not exists ix_results_both_continuous_variables_gene_iid on results_both_continuous_variables (gene_iid);
+create index if not exists ix_results_female_continuous_variables_gene_iid on results_female_continuous_variables (gene_iid);
+create index if not exists ix_results_male_continuous_variables_gene_iid on results_male_continuous_variables (gene_iid);
+create index if not exists ix_results_both_self_reported_gene_iid on results_both_self_reported (gene_iid);
+create index if not exists ix_results_female_self_reported_gene_iid on results_female_self_reported (gene_iid);
+create index if not exists ix_results_male_self_reported_gene_iid on results_male_self_reported (gene_iid);
+create index if not exists ix_results_both_cv_endpoints_gene_iid on results_both_cv_endpoints (gene_iid);
+create index if not exists ix_results_female_cv_endpoints_gene_iid on results_female_cv_endpoints (gene_iid);
+create index if not exists ix_results_male_cv_endpoints_gene_iid on results_male_cv_endpoints (gene_iid);
\ No newline at end of file
@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+
+import exphewas.db.models
+
+from jinja2 import Template
+
+
+RESULTS_TABLES = [
+    i.__tablename__ for i in exphewas.db.models.RESULTS_CLASSES
+]
+
+
+with open("gene_iid_indexes_template.jsql", "rt") as f:
+    sql_template = f.read()
+
+with open("5-gene_iid_indexes.sql", "wt") as f:
+    f.write(Template(sql_template).render(result_tables=RESULTS_TABLES))
@@ -0,0 +1,15 @@
+-- Significant genes for every outcome as bitmaps over the gene iids
+-- (filled by exphewas-db compute-statistics).
+begin;
+create table if not exists significance_bitmap (
+    outcome_iid integer not null references outcomes (iid),
+    analysis_subset enum_sex_subset not null,
+    q_threshold float8 not null,
+    n_tested integer not null,
+    n_significant integer not null,
+    tested bytea not null,
+    significant bytea not null,
+    constraint significance_bitmap_pkey
+        primary key (outcome_iid, analysis_subset, q_threshold)
+);
+commit;
@@ -0,0 +1,41 @@
+-- Column for the model fits in the binary layout (filled by exphewas-db
+-- convert-model-fits). After converting with --clear-json, a
+-- "vacuum full" of the tables is needed to reclaim the space.
+begin;
+
+alter table results_both_phecodes_model_fit
+    add column if not exists model_fit_bin bytea;
+
+alter table results_female_phecodes_model_fit
+    add column if not exists model_fit_bin bytea;
+
+alter table results_male_phecodes_model_fit
+    add column if not exists model_fit_bin bytea;
+
+alter table results_both_continuous_variables_model_fit
+    add column if not exists model_fit_bin bytea;
+
+alter table results_female_continuous_variables_model_fit
+    add column if not exists model_fit_bin bytea;
+
+alter table results_male_continuous_variables_model_fit
+    add column if not exists model_fit_bin bytea;
+
+alter table results_both_self_reported_model_fit
+    add column if not exists model_fit_bin bytea;
+
+alter table results_female_self_reported_model_fit
+    add column if not exists model_fit_bin bytea;
+
+alter table results_male_self_reported_model_fit
+    add column if not exists model_fit_bin bytea;
+
+alter table results_both_cv_endpoints_model_fit
+    add column if not exists model_fit_bin bytea;
+
+alter table results_female_cv_endpoints_model_fit
+    add column if not exists model_fit_bin bytea;
+
+alter table results_male_cv_endpoints_model_fit
+    add column if not exists model_fit_bin bytea;
+commit;
\ No newline at end of file
@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+
+import exphewas.db.models
+
+from jinja2 import Template
+
+
+MODEL_FIT_TABLES = [
+    i.__tablename__ for i in exphewas.db.models.MODEL_FIT_CLASSES
+]
+
+
+with open("binary_model_fits_template.jsql", "rt") as f:
+    sql_template = f.read()
+
+with open("7-binary_model_fits.sql", "wt") as f:
+    f.write(Template(sql_template).render(model_fit_tables=MODEL_FIT_TABLES))
@@ -0,0 +1,14 @@
+-- Index on gene_iid for the gene-centric queries on the model fits (e.g. the
+-- phenome cis-MR), as the gene is the second column of the primary key.
+create index if not exists ix_results_both_phecodes_model_fit_gene_iid on results_both_phecodes_model_fit (gene_iid);
+create index if not exists ix_results_female_phecodes_model_fit_gene_iid on results_female_phecodes_model_fit (gene_iid);
+create index if not exists ix_results_male_phecodes_model_fit_gene_iid on results_male_phecodes_model_fit (gene_iid);
+create index if not exists ix_results_both_continuous_variables_model_fit_gene_iid on results_both_continuous_variables_model_fit (gene_iid);
+create index if not exists ix_results_female_continuous_variables_model_fit_gene_iid on results_female_continuous_variables_model_fit (gene_iid);
+create index if not exists ix_results_male_continuous_variables_model_fit_gene_iid on results_male_continuous_variables_model_fit (gene_iid);
+create index if not exists ix_results_both_self_reported_model_fit_gene_iid on results_both_self_reported_model_fit (gene_iid);
+create index if not exists ix_results_female_self_reported_model_fit_gene_iid on results_female_self_reported_model_fit (gene_iid);
+create index if not exists ix_results_male_self_reported_model_fit_gene_iid on results_male_self_reported_model_fit (gene_iid);
+create index if not exists ix_results_both_cv_endpoints_model_fit_gene_iid on results_both_cv_endpoints_model_fit (gene_iid);
+create index if not exists ix_results_female_cv_endpoints_model_fit_gene_iid on results_female_cv_endpoints_model_fit (gene_iid);
+create index if not exists ix_results_male_cv_endpoints_model_fit_gene_iid on results_male_cv_endpoints_model_fit (gene_iid);
\ No newline at end of file
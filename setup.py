@@ -50,6 +50,10 @@ def setup_package():
                           "Flask-Cors >= 3.0.8", "psycopg2-binary >= 2.8.4",
                           "sqlalchemy-datatables >= 2.0.1",
                           "pandas >= 0.25.3"],
+        extras_require={
+            # Binary (msgpack) format for the API results.
+            "msgpack": ["msgpack >= 1.0"],
+        },
         packages=find_packages(),
         package_data={
             "exphewas.backend": ["templates/*", "static/*", "static/docs/*",